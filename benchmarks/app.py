@@ -0,0 +1,83 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+"""
+Set up the application against a benchmark site on disk.
+"""
+
+import os.path
+
+from bp.filepath import FilePath
+
+from newrem.admin import admin
+from newrem.chan import osuchan
+from newrem.filters import load_filters
+from newrem.models import db, lm
+from newrem.profiling import recorder
+from newrem.users import users
+from newrem.views import app
+
+# The administrator's credentials for benchmark sites.
+USERNAME = "admin"
+PASSWORD = "benchmark"
+
+_configured = []
+
+def make_app(path):
+    """
+    Point the application at the site in the directory `path`, creating the
+    directory if necessary, and return the application.
+
+    The application can only be set up once per process.
+    """
+
+    if _configured:
+        if _configured[0] != path:
+            raise ValueError("Already set up for %s" % _configured[0])
+        return app
+    _configured.append(path)
+
+    root = FilePath(path)
+    if not root.exists():
+        root.makedirs()
+
+    passwords = root.child("passwords.dcon")
+    passwords.setContent("%s:%s\n" % (USERNAME, PASSWORD))
+
+    app.config.update({
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///%s" %
+                                   os.path.abspath(root.child("dcon.db").path),
+        "DCON_CONFIG": {"slogan": "Benchmark", "upload_time_now": False},
+        "DCON_PATH": root,
+        "DCON_PASSWORD_FILE": passwords,
+        "DCON_UPLOAD_PATH": root.child("uploads"),
+        "DCON_STATIC_URL": "/static/",
+        "SECRET_KEY": "benchmark",
+        "CSRF_ENABLED": False,
+        "WTF_CSRF_ENABLED": False,
+    })
+    app.static_paths = []
+
+    @app.context_processor
+    def site_config():
+        return {"dcon": app.config["DCON_CONFIG"]}
+
+    load_filters(app)
+    db.init_app(app)
+    lm.setup_app(app)
+    recorder.init_app(app)
+    app.register_blueprint(users)
+    app.register_blueprint(admin, url_prefix="/admin")
+    app.register_blueprint(osuchan, url_prefix="/chan")
+
+    return app
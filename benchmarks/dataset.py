@@ -0,0 +1,295 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+"""
+Generate a large synthetic site to benchmark against.
+
+Run with ``python -m benchmarks.dataset PATH``, with --help for the sizes.
+The database, uploads and a summary of what was made are written to the
+directory PATH.
+"""
+
+import argparse
+from datetime import datetime, timedelta
+import json
+import os.path
+from random import Random
+from StringIO import StringIO
+import sys
+from time import time
+
+from PIL import Image
+
+from werkzeug.datastructures import FileStorage
+
+from newrem.grammars import VERSION, paragraphs, safe_paragraphs
+from newrem.models import (db, Appearance, Blob, Board, Character, Comic,
+                           POSITION_GAP, PREVIEW_LENGTH, Post, Thread,
+                           Universe, casts)
+from newrem.util import excerpt, slugify
+
+from benchmarks.app import make_app
+
+# Rows are inserted this many at a time.
+BATCH = 10000
+
+# How many distinct placeholder images are shared between everything.
+PLACEHOLDERS = 16
+
+# How many characters are major.
+MAJORS = 20
+
+# What comments and posts say. They are rendered once each and reused.
+COMMENTS = [
+    u"",
+    u"A *short* comment.",
+    u"**Bold** words and _underlined_ ones.\r\n\r\n>greentext\r\nand more.",
+    u" ".join([u"A rather long comment about the comic."] * 40),
+]
+
+def insert(table, rows):
+    """
+    Insert rows into a table in batches, consuming an iterable of them.
+    """
+
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH:
+            db.session.execute(table.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(table.insert(), batch)
+
+def placeholders(r, count=PLACEHOLDERS):
+    """
+    Store some small, distinct images, and return their digests.
+    """
+
+    digests = []
+    for i in range(count):
+        color = tuple(r.randrange(256) for channel in "rgb")
+        handle = StringIO()
+        Image.new("RGB", (800, 600), color).save(handle, "PNG")
+        handle.seek(0)
+        fs = FileStorage(handle, filename="placeholder-%d.png" % i)
+        digests.append(Blob.store(fs).digest)
+    db.session.commit()
+    return digests
+
+def generate(comics=10000, characters=500, cast=8, posts=1000000,
+             threads=None, seed=0):
+    """
+    Fill an empty database with a universe of `comics` comics and
+    `characters` characters, each comic having `cast` of them, and a chan
+    board of `posts` posts in `threads` threads.
+
+    Every comic but the last few is live. One thread is much larger than the
+    rest. Returns a summary of what was made, for finding it again.
+    """
+
+    if threads is None:
+        threads = max(posts // 100, 1)
+
+    r = Random(seed)
+    db.create_all()
+    digests = placeholders(r)
+
+    universe = Universe(u"Benchmark")
+    universe.board = Board("bench", u"Benchmark")
+    chan = Board("b", u"Random")
+    db.session.add_all([universe, chan])
+    db.session.commit()
+    slug = universe.slug
+
+    slugs = ["bench-%04d" % i for i in range(characters)]
+    insert(Character.__table__, ({
+        "slug": s,
+        "name": u"Character %d" % i,
+        "major": i < MAJORS,
+        "description": u"A character.",
+        "universe_fk": slug,
+        "blob_id": r.choice(digests),
+    } for i, s in enumerate(slugs)))
+
+    rendered = [paragraphs(comment) for comment in COMMENTS]
+
+    # A comic every hour, with the last 1% still to go live.
+    now = datetime.utcnow().replace(microsecond=0)
+    start = now - timedelta(hours=comics - comics // 100)
+    casting = [r.sample(slugs, min(cast, characters)) for i in range(comics)]
+
+    insert(Thread.__table__, ({
+        "id": i + 1,
+        "subject": u"Comic %d" % i,
+        "author": u"DCoN",
+        "board_fk": universe.board_fk,
+        "replies": 0,
+        "images": 0,
+    } for i in range(comics)))
+
+    def comic_rows():
+        for i in range(comics):
+            title = u"Comic %d" % i
+            variant = r.randrange(len(COMMENTS))
+            yield {
+                "id": i + 1,
+                "time": start + timedelta(hours=i),
+                "filename": "bench-%06d.png" % i,
+                "position": i * POSITION_GAP,
+                "title": title,
+                "slug": slugify(title),
+                "description": u"",
+                "comment": COMMENTS[variant],
+                "comment_html": rendered[variant],
+                "grammar": VERSION,
+                "threadid": i + 1,
+                "universe_fk": slug,
+                "blob_id": r.choice(digests),
+            }
+    insert(Comic.__table__, comic_rows())
+
+    insert(casts, ({"comic_id": i + 1, "character_id": s}
+                   for i, cast in enumerate(casting) for s in cast))
+
+    # Comics are in timeline order by ID, so each character's appearances
+    # are numbered in the order that they're found.
+    def appearance_rows():
+        ordinals = dict.fromkeys(slugs, 0)
+        for i, cast in enumerate(casting):
+            for s in cast:
+                yield {
+                    "character_id": s,
+                    "comic_id": i + 1,
+                    "ordinal": ordinals[s],
+                    "time": start + timedelta(hours=i),
+                }
+                ordinals[s] += 1
+    insert(Appearance.__table__, appearance_rows())
+
+    summary = make_chan(r, chan, comics, posts, threads, digests, now)
+    db.session.commit()
+
+    summary.update({
+        "universe": slug,
+        "board": chan.abbreviation,
+        "comic": comics // 2,
+        "character": slugs[0],
+        "sizes": {
+            "comics": comics,
+            "characters": characters,
+            "cast": cast,
+            "posts": posts,
+            "threads": threads,
+        },
+    })
+    return summary
+
+def make_chan(r, board, first, posts, threads, digests, now):
+    """
+    Fill a board with posts, a post a minute up until `now`, along with their
+    threads' summaries. Thread IDs start after `first`.
+    """
+
+    rendered = [safe_paragraphs(comment) for comment in COMMENTS]
+    previews = [excerpt(comment, PREVIEW_LENGTH) for comment in COMMENTS]
+    start = now - timedelta(minutes=posts)
+
+    # The first thread gets a tenth of the posts, and the rest are spread
+    # evenly. Every thread gets its opening post first.
+    big = first + 1
+    ids = range(big, big + threads)
+    order = list(ids)
+    order += [big] * (posts // 10)
+    order += [r.choice(ids) for i in range(max(posts - len(order), 0))]
+    r.shuffle(order)
+    # Shuffling may have put replies before their thread's opening post.
+    seen = set()
+    openers = []
+    rest = []
+    for tid in order[:posts]:
+        if tid in seen:
+            rest.append(tid)
+        else:
+            seen.add(tid)
+            openers.append(tid)
+    order = openers + rest
+
+    variants = [r.randrange(len(COMMENTS)) for tid in order]
+    images = [r.random() < 0.1 for tid in order]
+    stamps = [start + timedelta(minutes=i) for i in range(len(order))]
+
+    # Work out the threads' summaries before any posts refer to them.
+    summaries = {}
+    for tid, variant, image, timestamp in zip(order, variants, images,
+                                              stamps):
+        summary = summaries.get(tid)
+        if summary is None:
+            summary = summaries[tid] = {
+                "id": tid,
+                "subject": u"Thread %d" % tid,
+                "author": u"Anonymous",
+                "board_fk": board.abbreviation,
+                "replies": 0,
+                "images": 0,
+                "op_preview": previews[variant],
+                "last_preview": None,
+            }
+        else:
+            summary["replies"] += 1
+            summary["last_preview"] = previews[variant]
+        summary["images"] += image
+        summary["bumped"] = timestamp
+        summary["last_author"] = u"Anonymous"
+    insert(Thread.__table__, summaries.itervalues())
+
+    insert(Post.__table__, ({
+        "author": u"Anonymous",
+        "threadid": tid,
+        "timestamp": timestamp,
+        "comment": COMMENTS[variant],
+        "comment_html": rendered[variant],
+        "grammar": VERSION,
+        "email": "",
+        "blob_id": r.choice(digests) if image else None,
+    } for tid, variant, image, timestamp
+      in zip(order, variants, images, stamps)))
+
+    return {"thread": big}
+
+def summary_path(path):
+    return os.path.join(path, "dataset.json")
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("path")
+    parser.add_argument("--comics", type=int, default=10000)
+    parser.add_argument("--characters", type=int, default=500)
+    parser.add_argument("--cast", type=int, default=8)
+    parser.add_argument("--posts", type=int, default=1000000)
+    parser.add_argument("--threads", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    app = make_app(args.path)
+    before = time()
+    with app.test_request_context():
+        summary = generate(args.comics, args.characters, args.cast,
+                           args.posts, args.threads, args.seed)
+
+    with open(summary_path(args.path), "wb") as handle:
+        json.dump(summary, handle, indent=4, sort_keys=True)
+    print "Generated %s in %.1fs" % (args.path, time() - before)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
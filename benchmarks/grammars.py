@@ -0,0 +1,67 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+"""
+Compare the compiled blog markup renderer against the Parsley grammar.
+
+Run with ``python -m benchmarks.grammars``.
+"""
+
+from random import Random
+import sys
+from time import time
+
+from newrem.grammars import paragraphs
+
+# A mix of plain words and every construct which makes the grammar backtrack.
+words = [
+    "lorem", "ipsum", "dolor", "sit", "amet", "*italic*", "**bold**",
+    "_underline_", "*unclosed", "**unclosed", "_unclosed", "a*b**c_d",
+    "\r\n", "\r\n\r\n", "\r\n>greentext", "<html>", "&", "'quoted'",
+]
+
+def make_text(size, seed=0):
+    """
+    Make some pseudorandom blog markup, roughly `size` bytes long.
+    """
+
+    r = Random(seed)
+    l = []
+    length = 0
+    while length < size:
+        word = r.choice(words)
+        l.append(word)
+        length += len(word) + 1
+    return " ".join(l)
+
+def timed(f, *args, **kwargs):
+    before = time()
+    f(*args, **kwargs)
+    return time() - before
+
+def main(size=100 * 1024):
+    text = make_text(size)
+
+    print "Input: %d bytes" % len(text)
+
+    for safe in (False, True):
+        reference = timed(paragraphs, text, safe=safe, reference=True)
+        compiled = timed(paragraphs, text, safe=safe)
+        print "safe=%s: Parsley %.3fs, compiled %.3fs, %.1fx faster" % (
+            safe, reference, compiled, reference / compiled)
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
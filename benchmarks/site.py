@@ -0,0 +1,240 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+"""
+Time requests against a generated site, in-process.
+
+Run with ``python -m benchmarks.site PATH``, after generating a site in PATH
+with benchmarks.dataset. Results are printed as JSON, and can be saved with
+--save and compared against a saved baseline with --baseline; the exit
+status is 1 if any scenario regressed.
+"""
+
+import argparse
+from base64 import b64encode
+from datetime import datetime, timedelta
+from itertools import count
+import json
+from StringIO import StringIO
+import sys
+from time import time
+
+from PIL import Image
+
+from newrem.cache import invalidate
+from newrem.models import db, Comic, Universe
+from newrem.profiling import recorder
+
+from benchmarks.app import PASSWORD, USERNAME, make_app
+from benchmarks.dataset import summary_path
+
+# A scenario regresses when its median time grows by more than this
+# fraction, and by more than NOISE seconds, or when it runs more queries.
+TOLERANCE = 0.25
+NOISE = 0.002
+
+SCENARIOS = []
+
+def scenario(name, cold=True):
+    """
+    Register a scenario.
+
+    Scenarios are called with a test client and the dataset's summary, and
+    make a single request, or do a single thing. Unless `cold` is False,
+    every cache is invalidated before each run.
+    """
+
+    def register(f):
+        SCENARIOS.append((name, f, cold))
+        return f
+    return register
+
+def get(client, path, status=200):
+    response = client.get(path)
+    if response.status_code != status:
+        raise Exception("%s: %s" % (path, response.status))
+    return response
+
+@scenario("comic")
+def comic(client, summary):
+    get(client, "/%(universe)s/comics/%(comic)d" % summary)
+
+@scenario("comic-cached", cold=False)
+def comic_cached(client, summary):
+    get(client, "/%(universe)s/comics/%(comic)d" % summary)
+
+@scenario("recent-character")
+def recent_character(client, summary):
+    get(client, "/%(universe)s/comics/recent?char=%(character)s" % summary,
+        302)
+
+@scenario("anything-goes")
+def anything_goes(client, summary):
+    get(client, "/%(universe)s/comics/recent?char=anything-goes" % summary,
+        302)
+
+@scenario("rss")
+def rss(client, summary):
+    get(client, "/rss.xml")
+
+@scenario("universe-rss")
+def universe_rss(client, summary):
+    get(client, "/%(universe)s/rss.xml" % summary)
+
+@scenario("board")
+def board(client, summary):
+    get(client, "/chan/%(board)s/" % summary)
+
+@scenario("thread")
+def thread(client, summary):
+    get(client, "/chan/%(board)s/%(thread)d" % summary)
+
+@scenario("insert-head", cold=False)
+def insert_head(client, summary):
+    # Rolled back afterwards, so that the dataset doesn't change.
+    with client.application.test_request_context():
+        universe = Universe.query.get(summary["universe"])
+        q = Comic.query.filter_by(universe=universe)
+        head = q.order_by(Comic.position).first()
+        comic = Comic(universe, "insert-head.png")
+        comic.rename(u"Inserted")
+        comic.insert(head, True)
+        db.session.flush()
+        db.session.rollback()
+
+uploads = count()
+session = int(time())
+upload_image = []
+
+@scenario("admin-upload", cold=False)
+def admin_upload(client, summary):
+    # Each upload adds a comic, far in the future so that none of them go
+    # live and change the other scenarios. Comics need distinct times, which
+    # are only precise to the second, so each benchmark run gets its own
+    # minute for every second since the epoch.
+    if not upload_image:
+        handle = StringIO()
+        Image.new("RGB", (800, 600), (255, 0, 0)).save(handle, "PNG")
+        upload_image.append(handle.getvalue())
+
+    i = next(uploads)
+    stamp = "%d-%f" % (i, time())
+    when = datetime(2100, 1, 1) + timedelta(seconds=session * 60 + i)
+    credentials = b64encode("%s:%s" % (USERNAME, PASSWORD))
+    response = client.post("/admin/%s/comics/create" % summary["universe"],
+        headers={"Authorization": "Basic " + credentials},
+        data={
+            "file": (StringIO(upload_image[0]), "upload-%s.png" % stamp),
+            "title": "Upload %s" % stamp,
+            "description": "",
+            "comment": "Uploaded.",
+            "index": str(summary["sizes"]["comics"]),
+            "characters": [summary["character"]],
+            "time": when.strftime("%Y-%m-%d %H:%M:%S"),
+        })
+    if response.status_code != 302:
+        raise Exception("Upload failed: %s" % response.status)
+
+def median(l):
+    l = sorted(l)
+    middle = len(l) // 2
+    if len(l) % 2:
+        return l[middle]
+    return (l[middle - 1] + l[middle]) / 2.0
+
+def run(client, summary, runs, only=None):
+    """
+    Run every scenario, or only those named in `only`, `runs` times each.
+
+    Returns a dictionary of scenario names to results.
+    """
+
+    results = {}
+    for name, f, cold in SCENARIOS:
+        if only and name not in only:
+            continue
+
+        times = []
+        queries = []
+        for i in range(runs):
+            if cold:
+                with client.application.app_context():
+                    invalidate()
+            with recorder.capture() as tally:
+                before = time()
+                f(client, summary)
+                times.append(time() - before)
+            queries.append(tally.count)
+
+        results[name] = {
+            "runs": runs,
+            "median": median(times),
+            "min": min(times),
+            "max": max(times),
+            "queries": median(queries),
+        }
+    return results
+
+def compare(results, baseline):
+    """
+    Compare results against a baseline, returning a list of descriptions of
+    the scenarios which regressed.
+    """
+
+    regressions = []
+    for name, result in sorted(results.iteritems()):
+        old = baseline.get(name)
+        if old is None:
+            continue
+
+        slower = result["median"] - old["median"]
+        if slower > NOISE and slower > old["median"] * TOLERANCE:
+            regressions.append("%s: %.1fms, was %.1fms" % (name,
+                result["median"] * 1000, old["median"] * 1000))
+        if result["queries"] > old["queries"]:
+            regressions.append("%s: %d queries, was %d" % (name,
+                result["queries"], old["queries"]))
+    return regressions
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("path")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--only", action="append",
+                        help="run only this scenario; may be repeated")
+    parser.add_argument("--save", help="save the results to this file")
+    parser.add_argument("--baseline", help="compare against this file")
+    args = parser.parse_args(argv)
+
+    with open(summary_path(args.path), "rb") as handle:
+        summary = json.load(handle)
+
+    app = make_app(args.path)
+    results = run(app.test_client(), summary, args.runs, args.only)
+    print json.dumps(results, indent=4, sort_keys=True)
+
+    if args.save:
+        with open(args.save, "wb") as handle:
+            json.dump(results, handle, indent=4, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline, "rb") as handle:
+            baseline = json.load(handle)
+        regressions = compare(results, baseline)
+        for regression in regressions:
+            print >> sys.stderr, "Regressed: %s" % regression
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -13,25 +13,31 @@
 # the License.
 from werkzeug import secure_filename
 
-from flask import (Blueprint, abort, current_app, flash, redirect,
+from flask import (Blueprint, abort, current_app, flash, jsonify, redirect,
                    render_template, request, url_for)
 from flask.ext.wtf.file import FileRequired
 
 from sqlalchemy.orm.exc import NoResultFound
 
+from newrem.cache import cache, invalidate, invalidation_tags
 from newrem.config import load_config, write_config
-from newrem.files import save_file
+from newrem.derivatives import pipeline
 from newrem.forms import (ConfigForm, CreateCharacterForm,
                           DeleteCharacterForm, ModifyCharacterForm, NewsForm,
                           EditNewsForm, CreatePortraitForm,
                           ModifyPortraitForm, CreateUniverseForm,
                           ModifyUniverseForm, DeleteUniverseForm,
-                          CreateComicForm, ModifyComicForm)
-from newrem.models import (db, Board, Character, Comic, Newspost, Portrait,
-    Thread, Universe)
+                          CreateComicForm, ModifyComicForm, MoveComicsForm,
+                          label_for_comic)
+from newrem.models import (db, Appearance, Blob, Board, Character, Comic,
+    Newspost, Portrait, Thread, Universe, casts)
+from newrem.profiling import recorder
 from newrem.security import Authenticator
 from newrem.util import abbreviate
 
+# How many results each page of a picker's search holds.
+PICKER_PAGE = 20
+
 
 class AdminBlueprint(Blueprint):
     """
@@ -70,6 +76,17 @@ admin = AdminBlueprint("admin", __name__, static_folder="static",
     template_folder="templates/admin")
 
 
+def touch(universe=None):
+    """
+    Note that the public contents of a universe have changed.
+
+    Call this after committing any write which readers could see. If no
+    universe is given, then everything is considered to have changed.
+    """
+
+    invalidate(universe)
+
+
 @admin.route("/")
 def index():
     form = CreateUniverseForm()
@@ -81,7 +98,9 @@ def index():
 @admin.route("/config")
 def config():
     form = ConfigForm(current_app)
-    return render_template("config.html", form=form)
+    views, statements = recorder.stats()
+    return render_template("config.html", form=form, stats=cache.stats(),
+                           views=views, statements=statements)
 
 
 @admin.route("/reload", methods=("POST",))
@@ -114,6 +133,7 @@ def universe_create():
         universe.board = Board(abbreviate(universe.title), universe.title)
         db.session.add(universe)
         db.session.commit()
+        touch()
 
         flash("Successfully created the universe of %s!" % universe.title)
         return redirect(url_for("admin.universe", u=universe))
@@ -130,6 +150,7 @@ def universe_modify(u):
         u.rename(form.name.data)
         db.session.add(u)
         db.session.commit()
+        touch()
         flash("Successfully renamed the universe of %s to %s!" %
             (old, u.title))
 
@@ -143,6 +164,7 @@ def universe_delete(u):
         if form.verify.data:
             db.session.delete(u)
             db.session.commit()
+            touch()
             flash("Successfully destroyed universe %s!" % u.title)
         else:
             flash("Guess you changed your mind, huh? No worries.")
@@ -166,9 +188,6 @@ def character(u, c):
                                 description=c.description)
     dform = DeleteCharacterForm(prefix="delete")
 
-    # Character needs to be bound to a session.
-    db.session.add(c)
-
     return render_template("character.html", mform=mform, dform=dform, u=u,
         c=c)
 
@@ -181,11 +200,12 @@ def characters_create(u):
         character.major = form.major.data
         if form.description.data:
             character.description = form.description.data
+        if form.portrait.data:
+            character.blob = Blob.store(form.portrait.data)
         db.session.add(character)
         db.session.commit()
-
-        if form.portrait.data:
-            save_file(character.fp(), form.portrait.data)
+        touch(u)
+        pipeline.submit(character.blob, invalidation_tags(u))
 
         flash("Successfully created character %s!" % character.name)
     else:
@@ -200,10 +220,10 @@ def characters_modify(u, c):
 
     if form.validate_on_submit():
         # Which modifications do we want to make?
-        db.session.add(c)
-
         if form.name.data and form.name.data != c.name:
+            old = c.slug
             c.rename(form.name.data)
+            Appearance.reindex([old, c.slug])
             flash("Successfully renamed character %s!" % c.name)
 
         if c.major != form.major.data:
@@ -214,7 +234,9 @@ def characters_modify(u, c):
                 flash("%s is no longer a major character!" % c.name)
 
         if form.portrait.data:
-            if save_file(c.fp(), form.portrait.data):
+            blob = Blob.store(form.portrait.data)
+            if blob is not None:
+                c.blob = blob
                 flash("Successfully changed portrait for character %s!" %
                     c.name)
             else:
@@ -229,6 +251,9 @@ def characters_modify(u, c):
                 c.name)
 
         db.session.commit()
+        touch(u)
+        if form.portrait.data:
+            pipeline.submit(c.blob, invalidation_tags(u))
     else:
         flash("Couldn't validate form...")
 
@@ -241,8 +266,13 @@ def characters_delete(u, c):
 
     if form.validate_on_submit():
         db.session.delete(c)
+        Appearance.reindex([c.slug])
         db.session.commit()
-        c.fp().remove()
+        touch(u)
+        # Blobs are left for the sweeper, since they might be shared.
+        fp = c.own_fp()
+        if fp.exists():
+            fp.remove()
         flash("Successfully removed character %s!" % c.name)
     else:
         flash("Couldn't validate form...")
@@ -262,10 +292,11 @@ def portraits_create():
 
     if form.validate_on_submit():
         portrait = Portrait(form.name.data)
+        portrait.update_portrait(form.portrait.data)
         db.session.add(portrait)
         db.session.commit()
-
-        portrait.update_portrait(form.portrait.data)
+        touch()
+        pipeline.submit(portrait.blob, invalidation_tags())
 
         flash("Successfully created portrait %s!" % portrait.name)
     else:
@@ -280,7 +311,10 @@ def portraits_modify():
     if form.validate_on_submit():
         portrait = form.portraits.data
         if portrait and form.portrait.data:
-            portrait.update_portrait(form.portrait.data)
+            blob = portrait.update_portrait(form.portrait.data)
+            db.session.commit()
+            touch()
+            pipeline.submit(blob, invalidation_tags())
 
             flash("Successfully changed portrait for portrait %s!" %
                 portrait.name)
@@ -301,6 +335,7 @@ def news():
         post.portrait = form.portrait.data
         db.session.add(post)
         db.session.commit()
+        touch()
         flash("Successfully posted the news!")
         return redirect(url_for("index"))
 
@@ -309,17 +344,17 @@ def news():
 
 @admin.route("/news/<newspost:n>", methods=("GET", "POST"))
 def newsdetail(n):
-    db.session.add(n)
-
     form = EditNewsForm()
 
     if form.validate_on_submit():
         n.time = form.time.data
         n.title = form.title.data
         n.content = form.content.data
+        n.render()
         n.portrait = form.portrait.data
         db.session.add(n)
         db.session.commit()
+        touch()
         flash("Successfully edited the news!")
         return redirect(url_for("index"))
 
@@ -331,9 +366,201 @@ def newsdetail(n):
 
 @admin.route("/<universe:u>/comics", methods=("GET", "POST"))
 def comics(u):
+    form = MoveComicsForm()
+
+    if form.validate_on_submit():
+        try:
+            ids = comic_range(u, form.first.data, form.last.data)
+            move_comics(u, ids, form.after.data)
+        except ValueError, e:
+            db.session.rollback()
+            flash("Couldn't move comics: %s" % ", ".join(e.args))
+        else:
+            flash("Moved %d comics!" % len(ids))
+            return redirect(url_for("admin.comics", u=u))
+
     q = Comic.query.filter_by(universe=u)
     comics = q.order_by(Comic.position)
-    return render_template("admin-comics.html", u=u, comics=comics)
+    return render_template("admin-comics.html", u=u, comics=comics,
+                           form=form)
+
+
+def comic_range(universe, first, last):
+    """
+    Get the IDs of the comics from one comic to another in the timeline,
+    inclusive, in timeline order.
+    """
+
+    q = db.session.query(Comic.id, Comic.position)
+    q = q.filter(Comic.universe == universe)
+    ends = dict((cid, (position, cid))
+                for cid, position in q.filter(Comic.id.in_([first, last])))
+    if first not in ends or last not in ends:
+        raise ValueError("No such comic")
+
+    low, high = ends[first], ends[last]
+    if low > high:
+        raise ValueError("The first comic comes after the last one")
+
+    q = q.filter(Comic.position.between(low[0], high[0]))
+    return [cid for cid, position in q.order_by(Comic.position, Comic.id)
+            if low <= (position, cid) <= high]
+
+
+def move_comics(universe, ids, after):
+    """
+    Move comics after another comic, given its ID, or to the start of the
+    timeline if it is -1, and commit.
+    """
+
+    if after == -1:
+        prior = None
+    else:
+        prior = Comic.query.filter_by(universe=universe, id=after).first()
+        if prior is None:
+            raise ValueError("No such comic: %s" % after)
+
+    count = Comic.move(universe, ids, prior)
+
+    # Only the moved comics changed places relative to the others.
+    q = db.session.query(casts.c.character_id)
+    q = q.filter(casts.c.comic_id.in_(ids)).distinct()
+    Appearance.reindex(slug for slug, in q)
+    db.session.commit()
+    touch(universe)
+    return count
+
+
+def json_error(message):
+    response = jsonify(error=message)
+    response.status_code = 400
+    return response
+
+
+@admin.route("/<universe:u>/comics/move", methods=("POST",))
+def comics_move(u):
+    """
+    Move a block of comics.
+
+    Takes a JSON object with either "ids", listing the comics to move in
+    their new order, or "first" and "last", the ends of a range of the
+    timeline to move, along with "after", the comic to move them after, or
+    -1 to move them to the start. Only JSON is accepted, so that other sites
+    can't post forms here with the administrator's credentials.
+    """
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or "after" not in data:
+        return json_error("Expected a JSON object with \"after\"")
+
+    try:
+        if "ids" in data:
+            ids = [int(cid) for cid in data["ids"]]
+        else:
+            ids = comic_range(u, int(data["first"]), int(data["last"]))
+        count = move_comics(u, ids, int(data["after"]))
+    except (KeyError, TypeError):
+        return json_error("Expected \"ids\", or \"first\" and \"last\"")
+    except ValueError, e:
+        db.session.rollback()
+        return json_error(", ".join(e.args))
+
+    return jsonify(moved=len(ids), renumbered=count)
+
+
+@admin.route("/<universe:u>/comics/reorder", methods=("POST",))
+def comics_reorder(u):
+    """
+    Put every comic in a universe into a new order.
+
+    Takes a JSON object with "ids", listing every comic in its new order.
+    """
+
+    data = request.get_json(silent=True)
+    try:
+        ids = [int(cid) for cid in data["ids"]]
+    except (KeyError, TypeError, ValueError):
+        return json_error("Expected a JSON object with \"ids\"")
+
+    try:
+        Comic.reorder(u, ids)
+    except ValueError, e:
+        db.session.rollback()
+        return json_error(", ".join(e.args))
+
+    Appearance.reindex(c.slug for c in u.characters)
+    db.session.commit()
+    touch(u)
+
+    return jsonify(moved=len(ids), renumbered=len(ids))
+
+
+def like_pattern(term):
+    """
+    Make a LIKE pattern which finds a search term anywhere, taking any
+    wildcards in it literally. Use it with escape="\\".
+    """
+
+    for c in "\\%_":
+        term = term.replace(c, "\\" + c)
+    return u"%%%s%%" % term
+
+
+def search_page(q, option):
+    """
+    Respond with a page of picker search results, as JSON.
+
+    `option` turns each row of the query into an (id, label) pair.
+    """
+
+    try:
+        page = max(int(request.args.get("page", 1)), 1)
+    except ValueError:
+        page = 1
+
+    rows = q.offset((page - 1) * PICKER_PAGE).limit(PICKER_PAGE + 1).all()
+    results = [dict(zip(("id", "label"), option(row)))
+               for row in rows[:PICKER_PAGE]]
+    return jsonify(results=results, page=page,
+                   more=len(rows) > PICKER_PAGE)
+
+
+@admin.route("/<universe:u>/search/comics")
+def search_comics(u):
+    """
+    Search a universe's comics by title, or by ID or position, for comic
+    pickers.
+    """
+
+    term = request.args.get("q", u"").strip()
+    q = db.session.query(Comic.id, Comic.title, Comic.position)
+    q = q.filter(Comic.universe == u)
+    if term:
+        match = Comic.title.ilike(like_pattern(term), escape="\\")
+        if term.isdigit():
+            match = db.or_(match, Comic.id == int(term),
+                           Comic.position == int(term))
+        q = q.filter(match)
+    q = q.order_by(Comic.position, Comic.id)
+
+    return search_page(q, lambda row: (row.id,
+                                       u"After %s" % label_for_comic(row)))
+
+
+@admin.route("/<universe:u>/search/characters")
+def search_characters(u):
+    """
+    Search a universe's characters by name, for character pickers.
+    """
+
+    term = request.args.get("q", u"").strip()
+    q = db.session.query(Character.slug, Character.name)
+    q = q.filter(Character.universe == u)
+    if term:
+        q = q.filter(Character.name.ilike(like_pattern(term), escape="\\"))
+    q = q.order_by(Character.name, Character.slug)
+
+    return search_page(q, tuple)
 
 
 def find_reference(universe, index):
@@ -366,7 +593,9 @@ def comics_create(u):
                 flash("Couldn't position comic: %s" % ", ".join(e.args))
                 return render_template("upload.html", form=form, u=u)
 
-        db.session.add(u)
+        # Load the board now; once the new comic is in the session, lazy
+        # loads would try to flush it before it has a position.
+        board = u.board
         filename = secure_filename(form.file.data.filename)
 
         try:
@@ -376,10 +605,12 @@ def comics_create(u):
             return render_template("upload.html", form=form, u=u)
 
         comic.characters = form.characters.data
-        comic.title = form.title.data
+        comic.rename(form.title.data)
         comic.description = form.description.data
         comic.comment = form.comment.data
-        comic.thread = Thread(u.board, comic.title, "DCoN")
+        comic.render()
+        comic.thread = Thread(board, comic.title, "DCoN")
+        comic.blob = Blob.store(form.file.data)
 
         if form.time.data:
             comic.time = form.time.data
@@ -390,9 +621,9 @@ def comics_create(u):
             comic.position = 0
 
         db.session.add(comic)
+        Appearance.reindex(c.slug for c in comic.characters)
         db.session.commit()
-
-        save_file(comic.fp(), form.file.data)
+        touch(u)
 
         return redirect(url_for("admin.comics_modify", u=u, cid=comic.id))
 
@@ -408,8 +639,6 @@ def comics_modify(u, cid):
     form = ModifyComicForm(u)
 
     if form.validate_on_submit():
-        db.session.add(u)
-
         # Attempt to set the new filename, and then verify it.
         if form.file.data:
             comic.filename = secure_filename(form.file.data.filename)
@@ -419,11 +648,16 @@ def comics_modify(u, cid):
                 flash("Couldn't alter comic: %s" % ", ".join(e.args))
                 return render_template("upload-modify.html", form=form, u=u,
                                        comic=comic)
+            comic.blob = Blob.store(form.file.data)
+
+        # Both the old and new casts need their appearances reindexed.
+        cast = [c.slug for c in comic.characters]
 
         comic.characters = form.characters.data
-        comic.title = form.title.data
+        comic.rename(form.title.data)
         comic.description = form.description.data
         comic.comment = form.comment.data
+        comic.render()
 
         if form.time.data:
             comic.time = form.time.data
@@ -442,11 +676,10 @@ def comics_modify(u, cid):
             comic.insert(reference, before)
 
         db.session.add(comic)
+        cast.extend(c.slug for c in comic.characters)
+        Appearance.reindex(cast)
         db.session.commit()
-
-        # Only write a new image down if requested.
-        if form.file.data:
-            save_file(comic.fp(), form.file.data)
+        touch(u)
 
         return render_template("upload-modify.html", form=form, u=u,
                                comic=comic)
@@ -11,10 +11,25 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
 # License for the specific language governing permissions and limitations under
 # the License.
+from collections import OrderedDict
+import os
+from threading import Lock
+from time import time
+
 from jinja2 import ChoiceLoader, FileSystemLoader
 from werkzeug.exceptions import NotFound
 from flask import Flask
-from flask.helpers import locked_cached_property, send_from_directory
+from flask.helpers import locked_cached_property, safe_join, send_file
+
+# One year, which is as long as HTTP caches are asked to keep anything.
+BLOB_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
 
 
 class DCoN(Flask):
@@ -23,27 +38,83 @@ class DCoN(Flask):
     paths.
     """
 
+    # How often, in seconds, a static file's resolution is checked against
+    # the modification times of the directories it could be in.
+    static_interval = 5
+
+    # How many static file resolutions, including misses, to remember.
+    static_size = 10000
+
     def __init__(self, *args, **kwargs):
         super(DCoN, self).__init__(*args, **kwargs)
 
         self.static_paths = []
         self.template_paths = []
 
-    def send_static_file(self, filename):
-        cache_timeout = self.get_send_file_max_age(filename)
+        self._static_index = OrderedDict()
+        self._static_lock = Lock()
+
+    def get_send_file_max_age(self, filename):
+        # Blobs are named after their contents, so they never change.
+        if filename.startswith("blobs/"):
+            return BLOB_MAX_AGE
+        return super(DCoN, self).get_send_file_max_age(filename)
+
+    def resolve_static(self, filename):
+        """
+        Find the full path of a static file, or None if there is no such
+        file in any static path.
 
-        l = self.static_paths[:]
+        Resolutions, including misses, are remembered until the modification
+        time of one of the directories which the file could be in changes.
+        """
+
+        roots = self.static_paths[:]
         if self.has_static_folder:
-            l.append(self.static_folder)
+            roots.append(self.static_folder)
+
+        key = tuple(roots), filename
+        now = time()
+
+        with self._static_lock:
+            entry = self._static_index.get(key)
+        if entry is not None and entry[0] + self.static_interval > now:
+            return entry[2]
+
+        # safe_join() refuses filenames which escape their roots.
+        paths = [os.path.join(self.root_path, safe_join(root, filename))
+                 for root in roots]
+        mtimes = [mtime(os.path.dirname(path)) for path in paths]
+
+        if entry is None or entry[1] != mtimes:
+            for path in paths:
+                if os.path.isfile(path):
+                    break
+            else:
+                path = None
+        else:
+            path = entry[2]
 
-        for path in l:
-            try:
-                return send_from_directory(path, filename,
-                        cache_timeout=cache_timeout)
-            except NotFound:
-                continue
+        with self._static_lock:
+            self._static_index.pop(key, None)
+            self._static_index[key] = now, mtimes, path
+            while len(self._static_index) > self.static_size:
+                self._static_index.popitem(last=False)
 
-        raise NotFound()
+        return path
+
+    def send_static_file(self, filename):
+        path = self.resolve_static(filename)
+        if path is None:
+            raise NotFound()
+
+        cache_timeout = self.get_send_file_max_age(filename)
+        try:
+            return send_file(path, cache_timeout=cache_timeout,
+                             conditional=True)
+        except (IOError, OSError):
+            # The file went away since it was resolved.
+            raise NotFound()
 
     @locked_cached_property
     def jinja_loader(self):
@@ -0,0 +1,315 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+from collections import OrderedDict
+import cPickle as pickle
+import sqlite3
+from threading import Lock, local
+from time import time
+
+
+def next_version(version):
+    """
+    Pick the version of a tag after the given one.
+
+    Versions are the time of invalidation in milliseconds, or one more than
+    the last version if that isn't later, so that they both always increase
+    and say when each tag was last invalidated.
+    """
+
+    return max(version + 1, int(time() * 1000))
+
+
+class MemoryBackend(object):
+    """
+    A cache backend which keeps entries in this process's memory.
+
+    At most `size` entries are kept; the least recently used entries are
+    thrown out first. Invalidations only reach this process.
+    """
+
+    name = "memory"
+    shared = False
+
+    def __init__(self, size=1000):
+        self.size = size
+        self.epoch = next_version(0)
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def versions(self, tags):
+        return dict((tag, self._versions.get(tag, 0)) for tag in tags)
+
+    def bump(self, tag):
+        with self._lock:
+            self._versions[tag] = next_version(self._versions.get(tag, 0))
+
+
+class SQLiteBackend(object):
+    """
+    A cache backend which keeps entries in a SQLite database, so that every
+    worker on a host can share them.
+
+    When more than `size` entries are stored, the oldest are thrown out.
+    """
+
+    name = "sqlite"
+    shared = True
+
+    def __init__(self, path, size=10000):
+        self.path = path
+        self.size = size
+        self._local = local()
+
+        with self.connection() as c:
+            c.execute("""CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY, stored REAL, entry BLOB)""")
+            c.execute("""CREATE INDEX IF NOT EXISTS entries_stored
+                ON entries (stored)""")
+            c.execute("""CREATE TABLE IF NOT EXISTS tags (
+                name TEXT PRIMARY KEY, version INTEGER)""")
+            c.execute("""CREATE TABLE IF NOT EXISTS meta (
+                name TEXT PRIMARY KEY, value INTEGER)""")
+            c.execute("INSERT OR IGNORE INTO meta VALUES ('epoch', ?)",
+                      (next_version(0),))
+            self.epoch = c.execute("""SELECT value FROM meta
+                WHERE name = 'epoch'""").fetchone()[0]
+
+    def connection(self):
+        # SQLite connections can't be shared between threads.
+        c = getattr(self._local, "connection", None)
+        if c is None:
+            c = self._local.connection = sqlite3.connect(self.path,
+                                                         timeout=10)
+        return c
+
+    def __len__(self):
+        c = self.connection()
+        return c.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def get(self, key):
+        c = self.connection()
+        row = c.execute("SELECT entry FROM entries WHERE key = ?",
+                        (key,)).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(str(row[0]))
+
+    def set(self, key, entry):
+        blob = sqlite3.Binary(pickle.dumps(entry, pickle.HIGHEST_PROTOCOL))
+        with self.connection() as c:
+            c.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?)",
+                      (key, time(), blob))
+            c.execute("""DELETE FROM entries WHERE key IN (
+                SELECT key FROM entries ORDER BY stored DESC
+                LIMIT -1 OFFSET ?)""", (self.size,))
+
+    def delete(self, key):
+        with self.connection() as c:
+            c.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def versions(self, tags):
+        d = dict((tag, 0) for tag in tags)
+        if d:
+            c = self.connection()
+            marks = ", ".join("?" for tag in d)
+            sql = "SELECT name, version FROM tags WHERE name IN (%s)" % marks
+            d.update(c.execute(sql, d.keys()))
+        return d
+
+    def bump(self, tag):
+        with self.connection() as c:
+            c.execute("INSERT OR IGNORE INTO tags VALUES (?, 0)", (tag,))
+            c.execute("""UPDATE tags SET version = MAX(version + 1, ?)
+                WHERE name = ?""", (next_version(0), tag))
+
+
+class Cache(object):
+    """
+    A cache with per-entry expiry and tag-based invalidation.
+
+    Every entry remembers the versions of its tags when it was stored.
+    Invalidating a tag bumps its version, so all of the entries stored with
+    the old version become misses, without having to find and delete them.
+    """
+
+    def __init__(self, backend=None):
+        if backend is None:
+            backend = MemoryBackend()
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Retrieve an entry, or None if it is missing, expired, or invalidated.
+        """
+
+        entry = self.backend.get(key)
+        if entry is not None:
+            expires, versions, value = entry
+            if ((not expires or expires > time()) and
+                self.backend.versions(versions) == versions):
+                self.hits += 1
+                return value
+            self.backend.delete(key)
+
+        self.misses += 1
+        return None
+
+    def set(self, key, value, ttl=0, tags=()):
+        """
+        Store an entry.
+
+        `ttl` is the lifetime of the entry in seconds; zero means forever.
+        `tags` is either a list of tags, or the result of calling versions()
+        on a list of tags; the latter should be used for values which take a
+        while to compute, so that invalidations made in the meantime aren't
+        missed.
+        """
+
+        if not isinstance(tags, dict):
+            tags = self.versions(tags)
+        expires = time() + ttl if ttl else 0
+        self.backend.set(key, (expires, tags, value))
+
+    @property
+    def epoch(self):
+        """
+        The time at which the backend's tag versions began, as a UTC
+        timestamp.
+
+        Versions start again from zero in a new memory backend, or a new
+        SQLite cache file, so anything made from them, like an ETag, should
+        include this too.
+        """
+
+        return self.backend.epoch / 1000.0
+
+    def versions(self, tags):
+        """
+        Get the current version of each of some tags.
+        """
+
+        return self.backend.versions(tags)
+
+    def invalidate(self, tag):
+        """
+        Throw out every entry with a tag.
+        """
+
+        self.backend.bump(tag)
+
+    def modified(self, tags):
+        """
+        Get the time at which any of some tags was last invalidated, as a
+        UTC timestamp, or None if none of them ever were.
+        """
+
+        latest = max(self.versions(tags).values() or [0])
+        if not latest:
+            return None
+        return latest / 1000.0
+
+    def stats(self):
+        return {
+            "backend": self.backend.name,
+            "entries": len(self.backend),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def make_backend(config):
+    """
+    Make a cache backend according to the site configuration.
+    """
+
+    size = config.get("cache_size", 1000)
+    kind = config.get("cache", "memory")
+    if kind == "memory":
+        return MemoryBackend(size)
+    else:
+        return SQLiteBackend(kind, size)
+
+
+def tags_for(universe):
+    """
+    Get the tags for things which depend on a universe, given its slug.
+
+    Things which don't belong to any universe should pass None. Those things
+    are invalidated along with every universe, since they might list comics
+    from any of them.
+    """
+
+    if universe is None:
+        return ["site", "global"]
+    return ["site", "universe:%s" % universe]
+
+
+def board_tag(board):
+    """
+    Get the tag for pages which show a board's posts, given its
+    abbreviation. It is invalidated when thumbnails of the posts' files are
+    made.
+    """
+
+    return "board:%s" % board
+
+
+cache = Cache()
+
+
+def invalidation_tags(universe=None):
+    """
+    Get the tags to invalidate when a universe changes, or when everything
+    changes if no universe is given.
+    """
+
+    if universe is None:
+        return ["site"]
+    return ["universe:%s" % universe.slug, "global"]
+
+
+def invalidate(universe=None):
+    """
+    Throw out everything cached about a universe, along with everything which
+    isn't part of any universe.
+
+    If no universe is given, throw out everything.
+    """
+
+    for tag in invalidation_tags(universe):
+        cache.invalidate(tag)
@@ -12,37 +12,205 @@
 #
 # You should have received a copy of the GNU General Public License along with
 # DCoN. If not, see <http://www.gnu.org/licenses/>.
-from flask import Blueprint, render_template, request, url_for
+from calendar import timegm
+from datetime import datetime
+from hashlib import md5
+from math import ceil
+from time import time
 
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import aliased, joinedload
+
+from flask import (Blueprint, abort, render_template, request, session,
+                   url_for)
+
+from newrem.cache import board_tag, cache
+from newrem.decorators import respond
+from newrem.derivatives import pipeline
 from newrem.forms import ChanForm
-from newrem.models import db, Board, Post, Thread
-from newrem.util import chan_filename
+from newrem.models import db, Blob, Board, Post, Thread
 
 osuchan = Blueprint("osuchan", __name__, static_folder="static",
     template_folder="templates")
 
 header = "OSUChan"
 
+# Pages with forms carry a CSRF token which expires, so a reader's copy of
+# one is only reused for this many seconds.
+TOKEN_PERIOD = 600
+
+# How many threads each page of a board lists.
+THREADS_PER_PAGE = 15
+# How many threads each page of a board's catalog lists.
+CATALOG_THREADS = 100
+# How many of the latest replies are shown beneath each thread on a board.
+PREVIEW_POSTS = 3
+# How many posts each page of a thread shows.
+POSTS_PER_PAGE = 100
+# How many posts the "last posts" view of a thread shows.
+LAST_POSTS = 50
+
 def save_file(f):
     """
-    Save the given file resource to disk.
+    Save the given file resource to the blob store.
+
+    Returns the blob, or None if there was nothing to save.
+    """
+
+    # Browsers send an unnamed, empty part when no file was picked. Parts
+    # don't usually say how long they are, so the name is all there is to
+    # go on.
+    if not f.filename:
+        return None
+
+    return Blob.store(f)
+
+def validators(q, board):
+    """
+    Work out the ETag and Last-Modified time of a page showing the threads
+    matched by a query, from their summaries, the version of their board's
+    tag, and the cache's epoch.
+
+    The ETag is weak, since the page's form has a fresh CSRF token every time
+    that it is rendered.
+    """
+
+    count, replies, latest = q.with_entities(func.count(Thread.id),
+                                             func.sum(Thread.replies),
+                                             func.max(Thread.bumped)).one()
+    bucket = int(time() // TOKEN_PERIOD)
+    tags = [board_tag(board.abbreviation)]
+
+    key = [request.full_path, count, replies, latest, bucket, cache.epoch,
+           sorted(cache.versions(tags).items()), session.get("csrf_token")]
+    etag = md5(repr(key)).hexdigest()
+
+    stamps = [bucket * TOKEN_PERIOD, cache.modified(tags) or 0, cache.epoch]
+    if latest is not None:
+        stamps.append(timegm(latest.utctimetuple()))
+    modified = datetime.utcfromtimestamp(ceil(max(stamps)))
+    return etag, modified
+
+def cursor(thread):
+    """
+    Make the key for the page of a board which follows a thread.
+    """
+
+    return "%s-%d" % (thread.bumped.strftime("%Y%m%d%H%M%S%f"), thread.id)
+
+def parse_cursor(s):
+    """
+    Turn a key made by cursor() back into a bump time and thread ID, or None
+    if it isn't one.
+    """
+
+    try:
+        stamp, tid = s.split("-")
+        return datetime.strptime(stamp, "%Y%m%d%H%M%S%f"), int(tid)
+    except (AttributeError, ValueError):
+        return None
+
+def list_threads(board, before=None, size=THREADS_PER_PAGE):
+    """
+    List a page of a board's threads, most recently bumped first.
+
+    Pages are keyed rather than numbered: `before` is the cursor() of the
+    last thread on the previous page, so each page is read straight off of
+    the bump index no matter how deep it is. Threads without any posts,
+    like those of comics which nobody has commented on, aren't listed.
+
+    Returns the threads, and the `before` for the next page, or None if this
+    is the last page.
+    """
+
+    q = Thread.query.filter(Thread.board_fk == board.abbreviation,
+                            Thread.bumped.isnot(None))
+
+    key = parse_cursor(before)
+    if key is not None:
+        bumped, tid = key
+        q = q.filter(or_(Thread.bumped < bumped,
+                         and_(Thread.bumped == bumped, Thread.id < tid)))
+
+    q = q.order_by(Thread.bumped.desc(), Thread.id.desc())
+    threads = q.limit(size + 1).all()
+
+    if len(threads) > size:
+        return threads[:size], cursor(threads[size - 1])
+    return threads, None
+
+def preview_posts(ids, size=PREVIEW_POSTS):
+    """
+    Find the opening post and the latest few replies of each of some
+    threads, given their IDs, in a single query.
 
-    Returns the filename on disk.
+    Returns a dictionary of thread IDs to lists of posts, oldest first.
     """
 
-    # Empty file?
-    if not f.content_length:
-        return ""
+    previews = dict((tid, []) for tid in ids)
+    if not ids:
+        return previews
+
+    opening = aliased(Post)
+    first = db.session.query(func.min(opening.id))
+    first = first.filter(opening.threadid.in_(ids)).group_by(opening.threadid)
+    wanted = [Post.id.in_(first.subquery())]
+
+    # Find where each thread's latest replies start separately, rather than
+    # counting newer posts for every post, so that long threads only cost an
+    # index lookup each.
+    for tid in ids:
+        later = aliased(Post)
+        cutoff = db.session.query(later.id).filter(later.threadid == tid)
+        cutoff = cutoff.order_by(later.id.desc()).offset(size - 1).limit(1)
+        cutoff = func.coalesce(cutoff.as_scalar(), 0)
+        wanted.append(and_(Post.threadid == tid, Post.id >= cutoff))
+
+    q = Post.query.options(joinedload(Post.blob)).filter(or_(*wanted))
+    for post in q.order_by(Post.id):
+        previews[post.threadid].append(post)
+    return previews
+
+def list_posts(tid, after=None, last=None, size=POSTS_PER_PAGE):
+    """
+    List a page of a thread's posts, given its ID, oldest first.
+
+    Pages are keyed like boards' pages: `after` is the ID of the last post
+    on the previous page. If `last` is given, the last that many posts are
+    listed instead, but always at least one and no more than a page.
+
+    Returns the posts, and the `after` for the next page, or None if this is
+    the last page.
+    """
+
+    q = Post.query.options(joinedload(Post.blob)).filter_by(threadid=tid)
+
+    if last is not None:
+        last = max(1, min(last, size))
+        posts = q.order_by(Post.id.desc()).limit(last).all()
+        posts.reverse()
+        return posts, None
 
-    filename = chan_filename(f)
-    f.save("static/images/%s" % filename)
+    if after is not None:
+        q = q.filter(Post.id > after)
+    posts = q.order_by(Post.id).limit(size + 1).all()
 
-    return filename
+    if len(posts) > size:
+        return posts[:size], posts[size - 1].id
+    return posts, None
 
 @osuchan.route('/')
 def index():
     boards = Board.query.all()
-    return render_template("oc/index.html", title=header, boards=boards)
+
+    q = db.session.query(Thread.board_fk, func.count(Thread.id),
+                         func.max(Thread.bumped))
+    q = q.filter(Thread.bumped.isnot(None)).group_by(Thread.board_fk)
+    stats = dict((abbreviation, (count, bumped))
+                 for abbreviation, count, bumped in q)
+
+    return render_template("oc/index.html", title=header, boards=boards,
+        stats=stats)
 
 @osuchan.route('/<board:b>/comment', methods=('POST',))
 def comment(b):
@@ -54,16 +222,18 @@ def comment(b):
     if "datafile" not in request.files:
         return "You forgot to select a file to upload"
 
-    filename = save_file(request.files["datafile"])
+    blob = save_file(request.files["datafile"])
 
     # Create thread and first post, inserting them together.
     thread = Thread(b, form.subject.data, form.name.data)
-    post = Post(form.name.data, form.comment.data, form.email.data, filename)
-
-    thread.posts = [post]
+    post = Post(form.name.data, form.comment.data, form.email.data, None)
+    post.blob = blob
 
     db.session.add(thread)
+    db.session.flush()
+    Thread.add(thread.id, post)
     db.session.commit()
+    pipeline.submit(blob, [board_tag(b.abbreviation)])
 
     email = form.email.data
 
@@ -71,9 +241,9 @@ def comment(b):
         if request.referrer:
             url = request.referrer
         else:
-            url = url_for("osuchan.showthread", board=b, tid=thread)
+            url = url_for("osuchan.showthread", b=b, tid=thread.id)
     else:
-        url = url_for("osuchan.showboard", board=b)
+        url = url_for("osuchan.showboard", b=b)
 
     return render_template("oc/redirect.html", url=url)
 
@@ -85,15 +255,17 @@ def threadcomment(b, thread):
         return "Error"
 
     if "datafile" in request.files:
-        filename = save_file(request.files["datafile"])
+        blob = save_file(request.files["datafile"])
     else:
-        filename = ""
+        blob = None
 
-    post = Post(form.name.data, form.comment.data, form.email.data, filename)
-    post.threadid = thread
+    post = Post(form.name.data, form.comment.data, form.email.data, None)
+    post.blob = blob
 
-    db.session.add(post)
+    if not Thread.add(thread, post):
+        abort(404)
     db.session.commit()
+    pipeline.submit(blob, [board_tag(b.abbreviation)])
 
     email = form.email.data
 
@@ -101,28 +273,57 @@ def threadcomment(b, thread):
         if request.referrer:
             url = request.referrer
         else:
-            url = url_for("osuchan.showthread", board=b, tid=thread)
+            url = url_for("osuchan.showthread", b=b, tid=thread)
     else:
-        url = url_for("osuchan.showboard", board=b)
+        url = url_for("osuchan.showboard", b=b)
 
     return render_template("oc/redirect.html", url=url)
 
 @osuchan.route('/<board:b>/')
 def showboard(b):
-    form = ChanForm()
-    threads = Thread.query.filter_by(board=b).all()
+    before = request.args.get("before")
+
+    def view():
+        form = ChanForm()
+        threads, after = list_threads(b, before)
+        previews = preview_posts([thread.id for thread in threads])
+
+        return render_template("oc/showboard.html", title=b.abbreviation,
+            board=b, threads=threads, previews=previews, after=after,
+            form=form)
+
+    etag, modified = validators(Thread.query.filter_by(board=b), b)
+    return respond(etag, modified, view, weak=True)
 
-    return render_template("oc/showboard.html", title=b.abbreviation, board=b,
-        threads=threads, form=form)
+@osuchan.route('/<board:b>/catalog')
+def catalog(b):
+    before = request.args.get("before")
+
+    def view():
+        threads, after = list_threads(b, before, CATALOG_THREADS)
+
+        return render_template("oc/catalog.html", title=b.abbreviation,
+            board=b, threads=threads, after=after)
+
+    etag, modified = validators(Thread.query.filter_by(board=b), b)
+    return respond(etag, modified, view, weak=True)
 
 @osuchan.route('/<board:b>/<int:tid>')
 def showthread(b, tid):
-    form = ChanForm()
-    thread = Thread.query.filter_by(id=tid).one()
-    subject = thread.subject
+    after = request.args.get("after", type=int)
+    last = request.args.get("last", type=int)
+
+    def view():
+        form = ChanForm()
+        thread = Thread.query.filter_by(id=tid, board=b).first()
+        if thread is None:
+            abort(404)
+
+        posts, next = list_posts(tid, after, last)
 
-    query = Post.query.filter_by(threadid=tid).order_by(Post.timestamp)
-    posts = query.all()
+        return render_template("oc/showthread.html", title=thread.subject,
+            board=b, posts=posts, thread=thread, after=next,
+            last=LAST_POSTS, form=form)
 
-    return render_template("oc/showthread.html", title=subject, board=b,
-        posts=posts, thread=thread, form=form)
+    etag, modified = validators(Thread.query.filter_by(id=tid), b)
+    return respond(etag, modified, view, weak=True)
@@ -15,6 +15,9 @@ import os.path
 
 import yaml
 
+from newrem.cache import cache, make_backend
+from newrem.derivatives import pipeline
+
 
 def load_config(app):
     config = {
@@ -28,11 +31,20 @@ def load_config(app):
 
     app.config["DCON_CONFIG"] = config
     app.config["SQLALCHEMY_DATABASE_URI"] = config["database"]
-    app.config["SQLALCHEMY_ECHO"] = app.debug
+    app.config["SQLALCHEMY_ECHO"] = config.get("sql_echo", False)
+    app.config["DCON_SERVER_TIMING"] = config.get("server_timing", False)
+    app.config["DCON_SLOW_SQL"] = config.get("slow_sql")
 
     app.config["RECAPTCHA_PUBLIC_KEY"] = config["recaptcha_public"]
     app.config["RECAPTCHA_PRIVATE_KEY"] = config["recaptcha_private"]
 
+    cache.backend = make_backend(config)
+    # Whole pages are kept until they're invalidated, and invalidations only
+    # reach every worker through a shared backend.
+    app.config["DCON_CACHE_PAGES"] = config.get("cache_pages",
+                                                cache.backend.shared)
+    pipeline.processes = config.get("thumbnail_processes")
+
     assets = config.get("assets", "")
     if assets:
         app.static_paths = [os.path.join(assets, "static")]
@@ -21,6 +21,13 @@ from werkzeug.routing import BaseConverter, ValidationError
 from sqlalchemy.orm.exc import MultipleResultsFound, NoResultFound
 from sqlalchemy.types import DateTime
 
+from newrem.cache import cache
+from newrem.models import db
+
+# The cache tags which every admin write bumps, one way or another. Converted
+# objects are thrown out whenever any of them changes.
+TAGS = ["site", "global"]
+
 freezers = {
     DateTime: lambda dt: str(int(timegm(dt.utctimetuple()))),
 }
@@ -42,20 +49,47 @@ class ModelConverter(BaseConverter):
     def to_python(self, value):
         value = self.thawer(value)
 
-        try:
-            with self.app.test_request_context():
-                obj = self.model.query.filter_by(**{self.field: value}).one()
-        except (MultipleResultsFound, NoResultFound):
+        # URLs are matched before the request has a session, so the objects
+        # returned here are detached; attach_models() puts them into the
+        # request's session later. Misses are remembered too.
+        versions = cache.versions(TAGS)
+        entry = self.objects.get(value)
+        if entry is None or entry[0] != versions:
+            entry = versions, self.lookup(value)
+            if len(self.objects) >= self.size:
+                self.objects.clear()
+            self.objects[value] = entry
+
+        obj = entry[1]
+        if obj is None:
             raise ValidationError()
 
         return obj
 
+    def lookup(self, value):
+        """
+        Look up an object in the database, returning it detached, or None if
+        it doesn't exist.
+        """
+
+        with self.app.app_context():
+            try:
+                q = self.model.query.filter_by(**{self.field: value})
+                obj = q.one()
+            except (MultipleResultsFound, NoResultFound):
+                return None
+            db.session.expunge(obj)
+
+        return obj
+
     def to_url(self, value):
         return self.freezer(getattr(value, self.field))
 
-def make_model_converter(a, m, f):
+def make_model_converter(a, m, f, limit=1000):
     """
     Create a ModelConverter for the given app, model, and field.
+
+    Up to `limit` converted objects are cached between requests.
     """
 
     column_type = type(m.__table__.columns[f].type)
@@ -64,7 +98,22 @@ def make_model_converter(a, m, f):
         app = a
         field = f
         model = m
+        objects = {}
+        size = limit
         freezer = staticmethod(freezers.get(column_type, str))
         thawer = staticmethod(thawers.get(column_type, unicode))
 
     return Subclass
+
+def attach_models(endpoint, values):
+    """
+    Put every model converted from a URL into the request's session.
+
+    This should be registered as a URL value preprocessor. The objects are
+    merged without loading, so this costs no queries.
+    """
+
+    if values:
+        for k, v in values.items():
+            if isinstance(v, db.Model):
+                values[k] = db.session.merge(v, load=False)
@@ -11,22 +11,190 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
 # License for the specific language governing permissions and limitations under
 # the License.
+from calendar import timegm
+from datetime import datetime
 from functools import wraps
+from hashlib import md5
+from math import ceil
+from time import time
 
-from werkzeug.contrib.cache import SimpleCache
+from werkzeug.http import is_resource_modified
 
-from flask import request
+from flask import (current_app, get_flashed_messages, make_response,
+                   request, session)
+from flask.ext.login import current_user
 
-cache = SimpleCache()
+from newrem.cache import cache, tags_for
+from newrem.files import BANNER_PERIOD
+from newrem.timeline import timelines
+
+def page_timeout(universe):
+    """
+    Figure out how long a universe's pages can be cached, in seconds.
+
+    Pages must be thrown out when the next scheduled comic goes live. Pages
+    which aren't part of any universe must be thrown out when any universe's
+    next comic goes live. A timeout of zero means forever.
+    """
+
+    now = datetime.now()
+
+    if universe is None:
+        universes = timelines.universes()
+    else:
+        universes = [universe]
+
+    instants = [timelines.timeline(u).next_live(now) for u in universes]
+    instants = [instant for instant in instants if instant is not None]
+    if not instants:
+        return 0
+
+    delta = min(instants) - now
+    seconds = delta.days * 86400 + delta.seconds + delta.microseconds / 1e6
+    return max(int(ceil(seconds)), 1)
+
+def caching_pages():
+    """
+    Whether whole pages and views may be cached, according to the site's
+    cache_pages setting.
+    """
+
+    return current_app.config.get("DCON_CACHE_PAGES", False)
 
 def cached(f):
+    """
+    Cache a view's return value, keyed on the request path.
+
+    Entries are tagged with the universe passed in as `u`, if any, and
+    expire when that universe's next scheduled comic goes live.
+    """
+
     @wraps(f)
     def decorated(*args, **kwargs):
-        key = request.path
+        if not caching_pages():
+            return f(*args, **kwargs)
+
+        key = "view:%s" % request.path
         data = cache.get(key)
         if data is not None:
             return data
+
+        universe = kwargs.get("u")
+        versions = cache.versions(tags_for(universe and universe.slug))
         data = f(*args, **kwargs)
-        cache.set(key, data)
+        cache.set(key, data, page_timeout(universe), versions)
         return data
     return decorated
+
+def rendered(f):
+    """
+    Cache the rendered body of a page for anonymous readers.
+
+    Pages are keyed by their full path, including the query string, and are
+    otherwise treated like @cached views. Pages which flash messages aren't
+    cached, and pages aren't served from the cache to anybody with messages
+    waiting.
+    """
+
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if (not caching_pages() or not current_user.is_anonymous() or
+            session.get("_flashes")):
+            return f(*args, **kwargs)
+
+        key = "page:%s" % request.full_path
+        body = cache.get(key)
+        if body is not None:
+            return body
+
+        universe = kwargs.get("u")
+        versions = cache.versions(tags_for(universe and universe.slug))
+        body = f(*args, **kwargs)
+        if isinstance(body, unicode) and not get_flashed_messages():
+            body = body.encode("utf-8")
+            cache.set(key, body, page_timeout(universe), versions)
+        return body
+    return decorated
+
+def validators(universe):
+    """
+    Work out the ETag and Last-Modified time of a page without rendering it.
+
+    The ETag covers the page's full path, the versions of its cache tags and
+    the cache's epoch, and how many comics are live in its universe, or in
+    every universe if it isn't part of one, so it changes whenever the page
+    could. Universe pages also show a banner, which is picked anew every
+    BANNER_PERIOD.
+
+    Nothing can be known to have changed before the cache's epoch, since
+    invalidations from before it are lost.
+    """
+
+    now = datetime.now()
+
+    if universe is None:
+        universes = timelines.universes()
+    else:
+        universes = [universe]
+
+    tags = tags_for(universe and universe.slug)
+    versions = cache.versions(tags)
+    live = [timelines.timeline(u).live(now) for u in universes]
+
+    key = [request.full_path, cache.epoch, sorted(versions.items()),
+           [count for count, latest in live]]
+    stamps = [cache.modified(tags) or 0, cache.epoch]
+    stamps.extend(timegm(latest.utctimetuple())
+                  for count, latest in live if latest is not None)
+
+    if universe is not None:
+        bucket = int(time() // BANNER_PERIOD)
+        key.append(bucket)
+        stamps.append(bucket * BANNER_PERIOD)
+
+    etag = md5(repr(key)).hexdigest()
+    # HTTP dates are only precise to the second, so round up, lest a change
+    # in the same second as the last one go unnoticed.
+    modified = datetime.utcfromtimestamp(ceil(max(stamps)))
+    return etag, modified
+
+def respond(etag, modified, view, weak=False):
+    """
+    Answer a conditional request with 304 Not Modified if the client's copy
+    matches `etag` or is no older than `modified`, and otherwise call `view`
+    and attach those validators to its response.
+
+    Validators aren't attached to errors, redirects, or pages which flash
+    messages.
+    """
+
+    if not is_resource_modified(request.environ, etag,
+                                last_modified=modified):
+        response = current_app.response_class(status=304)
+    else:
+        response = make_response(view())
+        if response.status_code != 200 or get_flashed_messages():
+            return response
+
+    response.set_etag(etag, weak)
+    response.last_modified = modified
+    return response
+
+def conditional(f):
+    """
+    Give anonymous readers' pages an ETag and Last-Modified time, and answer
+    their conditional requests without calling the view when nothing has
+    changed.
+
+    This should be the outermost decorator, so that @cached and @rendered
+    views aren't even looked up in the cache for a 304.
+    """
+
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if not current_user.is_anonymous() or session.get("_flashes"):
+            return f(*args, **kwargs)
+
+        etag, modified = validators(kwargs.get("u"))
+        return respond(etag, modified, lambda: f(*args, **kwargs))
+    return decorated
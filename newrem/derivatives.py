@@ -0,0 +1,141 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+from multiprocessing import Pool
+import os
+from threading import Lock
+
+from PIL import Image
+
+from flask import current_app
+
+from newrem.cache import cache
+from newrem.files import temporary_file
+from newrem.models import db, Derivative
+
+# The longest edge of each size of thumbnail, in pixels.
+SIZES = {
+    "small": 150,
+    "medium": 250,
+    "large": 500,
+}
+
+
+def make_derivatives(path, stem, sizes):
+    """
+    Make thumbnails of an image.
+
+    This runs in a worker process, so it only deals in paths and plain
+    values. Each thumbnail is written next to the image, named after `stem`
+    and its size, and renamed into place once it is complete. Images with
+    transparency are thumbnailed to PNG, and everything else to JPEG.
+
+    Returns a list of (size, extension, width, height) tuples, which is
+    empty if the file isn't an image which PIL understands.
+    """
+
+    try:
+        source = Image.open(path)
+        source.load()
+    except (IOError, SyntaxError):
+        return []
+
+    if source.mode in ("RGBA", "LA", "P"):
+        source = source.convert("RGBA")
+        format, extension = "PNG", ".png"
+    else:
+        source = source.convert("RGB")
+        format, extension = "JPEG", ".jpg"
+
+    results = []
+    for size, edge in sorted(sizes.iteritems()):
+        image = source.copy()
+        image.thumbnail((edge, edge), Image.ANTIALIAS)
+
+        handle = temporary_file(os.path.dirname(path), ".derivative-")
+        with handle:
+            image.save(handle, format)
+        os.rename(handle.name, "%s-%s%s" % (stem, size, extension))
+
+        results.append((size, extension) + image.size)
+
+    return results
+
+
+def record(digest, results, tags):
+    """
+    Record some freshly made derivatives of a blob.
+    """
+
+    for size, extension, width, height in results:
+        derivative = Derivative(digest, size, extension, width, height)
+        db.session.merge(derivative)
+    db.session.commit()
+
+    for tag in tags:
+        cache.invalidate(tag)
+
+
+class Pipeline(object):
+    """
+    A pool of worker processes which make thumbnails of blobs.
+
+    The pool is started the first time that it is needed. If `processes` is
+    None, there is a worker for every CPU; if it is zero, thumbnails are made
+    in the calling thread instead.
+    """
+
+    def __init__(self, processes=None):
+        self.processes = processes
+        self._pool = None
+        self._lock = Lock()
+
+    def pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = Pool(self.processes)
+            return self._pool
+
+    def submit(self, blob, tags=()):
+        """
+        Make and record thumbnails of a blob in every size.
+
+        `tags` are cache tags to invalidate once the thumbnails are recorded,
+        for the sake of cached pages which show the blob. Until then, the
+        blob's own URL is used in place of its thumbnails.
+        """
+
+        if blob is None:
+            return
+
+        app = current_app._get_current_object()
+        digest = blob.digest
+        path = blob.fp().path
+        args = path, os.path.splitext(path)[0], SIZES
+
+        def done(results):
+            # This runs in the pool's result thread, which mustn't die.
+            with app.app_context():
+                try:
+                    record(digest, results, tags)
+                except Exception:
+                    db.session.rollback()
+                    app.logger.exception("Couldn't record derivatives")
+
+        if self.processes == 0:
+            record(digest, make_derivatives(*args), tags)
+        else:
+            self.pool().apply_async(make_derivatives, args, callback=done)
+
+
+pipeline = Pipeline()
@@ -0,0 +1,371 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+"""
+Export the public comic archive to a directory of static files, for a CDN or
+a plain file server.
+
+Run with ``python -m newrem.export PATH``, from the directory with
+``dcon.yaml`` in it. Only the pages which changed since the last export into
+PATH are written again. With --watch, the export is repeated whenever a
+scheduled comic goes live, and every so often to pick up edits.
+"""
+
+import argparse
+from datetime import datetime
+from hashlib import md5
+import json
+import os
+import shutil
+from time import sleep
+
+from flask import current_app, escape, request, url_for
+
+from newrem.cache import MemoryBackend, cache, invalidate
+from newrem.decorators import page_timeout
+from newrem.feeds import FORMATS
+from newrem.files import FILE_MODE, temporary_file, url_root
+from newrem.models import (db, Character, Comic, Derivative, Newspost,
+                           Universe)
+from newrem.timeline import timelines
+from newrem.util import slugify
+
+# The manifest of exported pages, kept in the export directory.
+MANIFEST = ".dcon-export.json"
+
+# The longest to wait between exports when watching, in seconds.
+WATCH_INTERVAL = 60
+
+# Written in place of pages which redirect, since a file server can't.
+REDIRECT = u"""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<meta http-equiv="refresh" content="0; url=%(url)s">
+<link rel="canonical" href="%(url)s">
+</head>
+<body><a href="%(url)s">%(url)s</a></body>
+</html>
+"""
+
+
+def digest(*parts):
+    return md5(repr(parts)).hexdigest()
+
+
+def rows(model, *criteria):
+    """
+    Get every column of the rows of a model's table which match some
+    criteria, in primary key order.
+    """
+
+    table = model.__table__
+    q = db.session.query(table).filter(*criteria)
+    return q.order_by(*table.primary_key.columns).all()
+
+
+def route(endpoint, **values):
+    """
+    Build the path of a page, relative to the root of the site.
+    """
+
+    return url_for(endpoint, **values)[len(request.script_root):]
+
+
+def universe_pages(u, site, now):
+    """
+    Work out the pages of a universe, and their stamps.
+
+    Every comic page is stamped with the comic, the comics that it links to,
+    and the universe's cast, so that editing a comic only changes a handful
+    of pages.
+    """
+
+    timeline = timelines.timeline(u)
+    comics = rows(Comic, Comic.universe_fk == u.slug, Comic.time < now)
+    names = dict((row.id, (row.slug or slugify(row.title), row.title))
+                 for row in comics)
+
+    characters = rows(Character, Character.universe_fk == u.slug)
+    blobs = [row.blob_id for row in characters if row.blob_id]
+    thumbnails = rows(Derivative, Derivative.blob_id.in_(blobs or [None]))
+    base = digest(site, characters, thumbnails)
+
+    pages = {
+        route("cast", u=u): base,
+    }
+
+    if comics:
+        # The universe's front page is another route to its latest comic.
+        latest = digest(names[comics[-1].id])
+        pages[route("recent", u=u)] = latest
+        pages["/%s/" % u.slug] = latest
+
+    feed = digest(base, comics)
+    for kind in FORMATS:
+        pages[route("universe_feed", u=u, kind=kind)] = feed
+
+    buffered = timeline.buffered and timeline.buffered.date()
+    for row in comics:
+        navigation = timeline.navigation(row.id, now)
+        linked = set(navigation["upload"]) | set(navigation["chrono"])
+        for t in navigation["characters"].itervalues():
+            linked.update(t)
+        linked = sorted((cid, names[cid]) for cid in linked if cid in names)
+
+        path = route("comics", u=u, cid=row.id, name=names[row.id][0])
+        pages[path] = digest(base, row, buffered, linked,
+                             navigation["upload"], navigation["chrono"],
+                             sorted(navigation["characters"].iteritems()))
+
+    return pages, feed
+
+
+def pages(now):
+    """
+    Work out every public page, along with a stamp of everything that it
+    shows.
+
+    Returns a dictionary of paths to stamps. A page only needs to be exported
+    again when its stamp changes.
+    """
+
+    config = sorted(current_app.config["DCON_CONFIG"].iteritems())
+    universes = rows(Universe)
+    site = digest(config, universes)
+
+    d = {
+        route("index"): digest(site, rows(Newspost)),
+    }
+
+    feeds = []
+    for u in Universe.query.order_by(Universe.slug):
+        stamps, feed = universe_pages(u, site, now)
+        d.update(stamps)
+        feeds.append(feed)
+
+    for kind in FORMATS:
+        d[route("feed", kind=kind)] = digest(site, feeds)
+
+    return d
+
+
+def write(path, data):
+    """
+    Write a file, renaming it into place once it is complete.
+    """
+
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    handle = temporary_file(directory, ".export-")
+    with handle:
+        handle.write(data)
+    os.rename(handle.name, path)
+
+
+def sync(sources, dest):
+    """
+    Copy every file from some directories into another directory, except
+    for those which are already there with the same size and modification
+    time. Files in earlier directories take precedence.
+
+    Copies get the usual mode for new files, whatever the modes of the
+    originals, so that a file server can serve them.
+    """
+
+    files = {}
+    for source in reversed(sources):
+        for directory, dirnames, filenames in os.walk(source):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                files[os.path.relpath(path, source)] = path
+
+    copied = 0
+    for name, path in sorted(files.iteritems()):
+        target = os.path.join(dest, name)
+        if os.path.exists(target):
+            old, new = os.stat(target), os.stat(path)
+            if (old.st_size, int(old.st_mtime)) == (new.st_size,
+                                                    int(new.st_mtime)):
+                continue
+
+        directory = os.path.dirname(target)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # The modification time is kept, for the sake of the next sync, but
+        # not the mode.
+        shutil.copy2(path, target)
+        os.chmod(target, FILE_MODE)
+        copied += 1
+
+    return copied
+
+
+class Exporter(object):
+    """
+    Exports the public site into a directory, using the views themselves.
+
+    The stamp of every exported page is kept in a manifest alongside them, so
+    that later exports only render the pages whose stamps have changed, and
+    remove the pages which have gone away. `base_url` is the public URL of
+    the exported site, which feeds link to.
+    """
+
+    def __init__(self, app, root, base_url="http://localhost/"):
+        self.app = app
+        self.root = root
+        self.base_url = base_url
+        self.client = app.test_client(use_cookies=False)
+
+        try:
+            with open(os.path.join(root, MANIFEST), "rb") as handle:
+                self.manifest = json.load(handle)
+        except IOError:
+            self.manifest = {}
+
+    def path(self, page):
+        """
+        Find the file for a page.
+
+        Feeds are written as they are named; every other page is written as
+        the index of a directory, so that its URL still works.
+        """
+
+        path = os.path.join(self.root, *page.strip("/").split("/"))
+        if not os.path.splitext(page)[1]:
+            path = os.path.join(path, "index.html")
+        return path
+
+    def render(self, page):
+        """
+        Render a page and write it out, returning whether that worked.
+        """
+
+        response = self.client.get(page, base_url=self.base_url)
+        if response.status_code == 200:
+            data = response.data
+        elif response.status_code in (301, 302, 303, 307):
+            url = escape(response.headers["Location"])
+            data = (REDIRECT % {"url": url}).encode("utf-8")
+        else:
+            self.app.logger.warning("Couldn't export %s: %s", page,
+                                    response.status)
+            return False
+
+        write(self.path(page), data)
+        return True
+
+    def export(self, now=None):
+        """
+        Bring the export up to date.
+
+        Returns the pages which were written and the pages which were
+        removed.
+        """
+
+        if now is None:
+            now = datetime.now()
+
+        with self.app.test_request_context(base_url=self.base_url):
+            # Changes made by the site's own workers can't be heard about
+            # here, so nothing which was cached earlier can be trusted.
+            invalidate()
+            stamps = pages(now)
+
+        written = []
+        for page, stamp in sorted(stamps.iteritems()):
+            if (self.manifest.get(page) == stamp and
+                os.path.exists(self.path(page))):
+                continue
+            if self.render(page):
+                self.manifest[page] = stamp
+                written.append(page)
+
+        removed = sorted(set(self.manifest) - set(stamps))
+        for page in removed:
+            del self.manifest[page]
+            try:
+                os.remove(self.path(page))
+            except OSError:
+                pass
+
+        write(os.path.join(self.root, MANIFEST),
+              json.dumps(self.manifest, indent=1, sort_keys=True))
+
+        self.sync()
+        return written, removed
+
+    def sync(self):
+        """
+        Copy static files and uploads into the export.
+        """
+
+        app = self.app
+        static = [os.path.join(app.root_path, path)
+                  for path in app.static_paths]
+        if app.has_static_folder:
+            static.append(app.static_folder)
+        copied = sync(static, os.path.join(self.root, "static"))
+
+        # Uploads can only be exported if they're served from this site.
+        url = url_root(app)
+        if url.startswith("/"):
+            dest = os.path.join(self.root, *url.strip("/").split("/"))
+            copied += sync([app.config["DCON_UPLOAD_PATH"].path], dest)
+
+        return copied
+
+    def delay(self, interval=WATCH_INTERVAL):
+        """
+        Figure out how long to wait before exporting again, in seconds: no
+        longer than `interval`, and no later than when the next scheduled
+        comic goes live.
+        """
+
+        with self.app.app_context():
+            timeout = page_timeout(None)
+        if timeout:
+            return min(timeout, interval)
+        return interval
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("path")
+    parser.add_argument("--url", default="http://localhost/",
+                        help="the public URL of the exported site")
+    parser.add_argument("--watch", action="store_true",
+                        help="keep exporting as comics go live")
+    parser.add_argument("--interval", type=int, default=WATCH_INTERVAL,
+                        help="the longest to wait between exports")
+    args = parser.parse_args(argv)
+
+    from newrem.main import app
+
+    # The export process keeps its own cache, rather than throwing out the
+    # workers' shared one.
+    cache.backend = MemoryBackend()
+
+    exporter = Exporter(app, args.path, args.url)
+    while True:
+        written, removed = exporter.export()
+        print "Wrote %d pages, removed %d" % (len(written), len(removed))
+        if not args.watch:
+            break
+        sleep(exporter.delay(args.interval))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+from bisect import bisect_left
+from calendar import timegm
+from email.utils import formatdate
+import json
+from xml.sax.saxutils import escape, quoteattr
+
+from sqlalchemy.orm import joinedload
+
+from flask import request
+
+from newrem.cache import cache, tags_for
+from newrem.filters import url_for_comic
+from newrem.models import Comic
+from newrem.timeline import timelines
+
+# How many comics each feed lists.
+FEED_SIZE = 10
+
+
+def rfc822(dt):
+    return formatdate(timegm(dt.utctimetuple()), usegmt=True)
+
+
+def rfc3339(dt):
+    return dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class RSS(object):
+    """
+    RSS 2.0.
+    """
+
+    mimetype = "application/rss+xml"
+
+    def item(self, url, title, html, time):
+        return (u"<item><title>%s</title><link>%s</link>"
+                u"<description>%s</description>"
+                u'<guid isPermaLink="true">%s</guid>'
+                u"<pubDate>%s</pubDate></item>"
+                % (escape(title), escape(url), escape(html), escape(url),
+                   rfc822(time)))
+
+    def head(self, title, link, url, updated):
+        head = (u'<?xml version="1.0" encoding="utf-8"?>\n'
+                u'<rss version="2.0"><channel><title>%s</title>'
+                u"<link>%s</link><description>%s</description>"
+                % (escape(title), escape(link), escape(title)))
+        if updated is not None:
+            head += u"<lastBuildDate>%s</lastBuildDate>" % rfc822(updated)
+        return head
+
+    separator = ""
+    tail = u"</channel></rss>"
+
+
+class Atom(object):
+    """
+    Atom 1.0.
+    """
+
+    mimetype = "application/atom+xml"
+
+    def item(self, url, title, html, time):
+        return (u"<entry><title>%s</title><link href=%s/><id>%s</id>"
+                u"<updated>%s</updated>"
+                u'<content type="html">%s</content></entry>'
+                % (escape(title), quoteattr(url), escape(url), rfc3339(time),
+                   escape(html)))
+
+    def head(self, title, link, url, updated):
+        # Atom feeds must say when they were updated, even if they're empty.
+        if updated is None:
+            updated = "1970-01-01T00:00:00Z"
+        else:
+            updated = rfc3339(updated)
+        return (u'<?xml version="1.0" encoding="utf-8"?>\n'
+                u'<feed xmlns="http://www.w3.org/2005/Atom">'
+                u"<title>%s</title><link href=%s/>"
+                u'<link rel="self" href=%s/><id>%s</id>'
+                u"<updated>%s</updated>"
+                % (escape(title), quoteattr(link), quoteattr(url),
+                   escape(url), updated))
+
+    separator = ""
+    tail = u"</feed>"
+
+
+class JSONFeed(object):
+    """
+    JSON Feed 1.
+    """
+
+    mimetype = "application/json"
+
+    def item(self, url, title, html, time):
+        return json.dumps({
+            "id": url,
+            "url": url,
+            "title": title,
+            "content_html": html,
+            "date_published": rfc3339(time),
+        }, sort_keys=True)
+
+    def head(self, title, link, url, updated):
+        head = json.dumps({
+            "version": "https://jsonfeed.org/version/1",
+            "title": title,
+            "home_page_url": link,
+            "feed_url": url,
+        }, sort_keys=True)
+        # Leave the object open for the items.
+        return head[:-1] + ', "items": ['
+
+    separator = ", "
+    tail = u"]}"
+
+
+FORMATS = {
+    "rss": RSS(),
+    "atom": Atom(),
+    "json": JSONFeed(),
+}
+
+
+class FragmentIndex(object):
+    """
+    A cache of serialized feed items for comics, in each feed format.
+
+    Items are serialized once, and feeds are put together by joining them.
+    Like timelines, each universe's items remember the versions of its cache
+    tags, and are thrown out when any of its comics are created or edited.
+    Comics going live doesn't change their items, only which feeds list them.
+    """
+
+    def __init__(self):
+        self._universes = {}
+
+    def items(self, kind, refs):
+        """
+        Get the serialized items for some comics, given (universe slug, comic
+        ID) pairs, in the same order, as UTF-8.
+
+        Items which haven't been serialized yet are built from a single query.
+        """
+
+        # Links are absolute, so they depend on the host being served.
+        root = request.url_root
+        fragments = {}
+        for slug in set(slug for slug, cid in refs):
+            versions = cache.versions(tags_for(slug))
+            entry = self._universes.get(slug)
+            if entry is None or entry[0] != versions:
+                entry = self._universes[slug] = versions, {}
+            fragments[slug] = entry[1]
+
+        missing = [cid for slug, cid in refs
+                   if (kind, root, cid) not in fragments[slug]]
+        if missing:
+            q = Comic.query.options(joinedload(Comic.universe))
+            for comic in q.filter(Comic.id.in_(missing)):
+                key = kind, root, comic.id
+                fragments[comic.universe_fk][key] = self.build(kind, comic)
+
+        # Comics which were deleted in the meantime are left out.
+        items = [fragments[slug].get((kind, root, cid)) for slug, cid in refs]
+        return [item for item in items if item is not None]
+
+    def build(self, kind, comic):
+        url = url_for_comic(comic, _external=True)
+        title = u"%s: %s" % (comic.universe.title, comic.title)
+        html = unicode(comic.html("comment"))
+        item = FORMATS[kind].item(url, title, html, comic.time)
+        return item.encode("utf-8")
+
+
+fragments = FragmentIndex()
+
+
+def latest(sequence, now, size=FEED_SIZE):
+    """
+    Find the latest live comics in a sequence, as (time, ID) pairs, newest
+    first.
+    """
+
+    if sequence.monotonic:
+        end = bisect_left(sequence.times, now)
+        pairs = zip(sequence.times[:end], sequence.ids[:end])
+        pairs = pairs[-size:]
+    else:
+        pairs = [(time, cid) for time, cid
+                 in zip(sequence.times, sequence.ids) if time < now]
+    pairs.sort(reverse=True)
+    return pairs[:size]
+
+
+def latest_comics(universes, now, character=None):
+    """
+    Find the latest live comics in some universes, or the latest appearances
+    of a character if one is given, as (universe slug, time, comic ID)
+    tuples, newest first.
+    """
+
+    found = []
+    for universe in universes:
+        timeline = timelines.timeline(universe)
+        if character is None:
+            sequence = timeline.upload
+        else:
+            sequence = timeline.characters.get(character)
+            if sequence is None:
+                continue
+        found.extend((time, cid, universe.slug)
+                     for time, cid in latest(sequence, now))
+    found.sort(reverse=True)
+    return [(slug, time, cid) for time, cid, slug in found[:FEED_SIZE]]
+
+
+def make_feed(kind, title, link, comics):
+    """
+    Put together a feed from the comics found by latest_comics().
+
+    Returns the feed's body and MIME type.
+    """
+
+    format = FORMATS[kind]
+    items = fragments.items(kind, [(slug, cid) for slug, time, cid in comics])
+    updated = comics[0][1] if comics else None
+
+    head = format.head(title, link, request.url, updated).encode("utf-8")
+    body = format.separator.join(items)
+    return head + body + format.tail.encode("utf-8"), format.mimetype
@@ -11,6 +11,14 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
 # License for the specific language governing permissions and limitations under
 # the License.
+from hashlib import md5
+from mimetypes import guess_extension
+import os
+import re
+from tempfile import NamedTemporaryFile
+from threading import Lock
+from time import time
+
 from bp.filepath import FilePath
 
 from flask import flash
@@ -43,23 +51,105 @@ def extend_url(url, segments):
     return url + "/".join(segments)
 
 
-def save_file(fp, fs):
+# Uploads are copied a chunk at a time, so that memory use doesn't depend on
+# how large they are.
+CHUNK_SIZE = 64 * 1024
+
+extension_re = re.compile(r"^\.[a-z0-9]{1,9}$")
+
+# Temporary files are only readable by their owner. Files which are renamed
+# into place get the mode of any other new file instead, so that a separate
+# static file server can read them.
+umask = os.umask(0)
+os.umask(umask)
+FILE_MODE = 0666 & ~umask
+
+
+def make_directory(fp):
     """
-    Save a ``FileStorage`` to a ``FilePath``.
+    Make sure that a directory exists.
     """
 
-    parent = fp.parent()
     try:
-        if not parent.exists():
-            parent.makedirs()
-    except IOError:
-        flash("Couldn't create path %r" % parent.path)
+        if not fp.exists():
+            fp.makedirs()
+    except (IOError, OSError):
+        flash("Couldn't create path %r" % fp.path)
         return False
     else:
-        fs.save(fp.path)
         return True
 
 
+def file_extension(fs):
+    """
+    Pick a reasonable and secure file extension for a ``FileStorage``.
+
+    The uploaded filename's extension is preferred; failing that, one is
+    guessed from the content type.
+    """
+
+    extension = os.path.splitext(fs.filename or "")[1].lower()
+    if not extension_re.match(extension):
+        extension = guess_extension(fs.content_type or "") or ""
+    return extension
+
+
+def temporary_file(directory, prefix=".upload-"):
+    """
+    Open a new file in a directory, to be renamed into place once it is
+    written.
+
+    The caller is responsible for removing the file if it isn't renamed.
+    """
+
+    handle = NamedTemporaryFile(dir=directory, prefix=prefix, delete=False)
+    os.chmod(handle.name, FILE_MODE)
+    return handle
+
+
+def stream_file(parent, fs, hash=md5):
+    """
+    Copy a ``FileStorage`` into a new temporary file in a directory, hashing
+    it along the way.
+
+    Returns the temporary ``FilePath`` and the hex digest of the file, using
+    the given hash, MD5 by default.
+    """
+
+    digest = hash()
+    handle = temporary_file(parent.path)
+    try:
+        with handle:
+            while True:
+                chunk = fs.stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                handle.write(chunk)
+    except:
+        os.unlink(handle.name)
+        raise
+
+    return FilePath(handle.name), digest.hexdigest()
+
+
+def save_file(fp, fs):
+    """
+    Save a ``FileStorage`` to a ``FilePath``.
+
+    The file is written next to its destination and then renamed into place,
+    so that nobody ever sees a partially written file.
+    """
+
+    parent = fp.parent()
+    if not make_directory(parent):
+        return False
+
+    temp, digest = stream_file(parent, fs)
+    temp.moveTo(fp)
+    return True
+
+
 def assets_in_paths(app, segments):
     """
     Select some assets from all of the static paths in the app which match the
@@ -80,3 +170,79 @@ def assets_in_paths(app, segments):
             names.extend([p.basename() for p in fp.children()])
 
     return names
+
+
+class AssetIndex(object):
+    """
+    A cache of the assets in an app's static paths.
+
+    Each listing is kept until the modification time of one of the listed
+    directories changes. Modification times are checked at most once every
+    `interval` seconds, so that a burst of requests for the same listing
+    costs no more than one request.
+    """
+
+    def __init__(self, interval=5):
+        self.interval = interval
+        self._listings = {}
+        self._lock = Lock()
+
+    def _stat(self, fps):
+        mtimes = []
+        for fp in fps:
+            try:
+                mtimes.append(os.stat(fp.path).st_mtime)
+            except OSError:
+                mtimes.append(None)
+        return mtimes
+
+    def names(self, app, segments):
+        """
+        Like ``assets_in_paths``, but cached, and sorted.
+        """
+
+        key = tuple(app.static_paths), tuple(segments)
+        now = time()
+
+        with self._lock:
+            entry = self._listings.get(key)
+            if entry is not None and entry[0] + self.interval > now:
+                return entry[2]
+
+        fps = [FilePath(path).descendant(segments)
+               for path in app.static_paths]
+        mtimes = self._stat(fps)
+
+        if entry is None or entry[1] != mtimes:
+            names = sorted(assets_in_paths(app, segments))
+        else:
+            names = entry[2]
+
+        with self._lock:
+            self._listings[key] = now, mtimes, names
+        return names
+
+
+# How long, in seconds, the same banner is shown.
+BANNER_PERIOD = 3600
+
+
+def pick_asset(names, seed, period=BANNER_PERIOD, now=None):
+    """
+    Pick one of some assets, or None if there aren't any.
+
+    The same asset is picked for the same seed throughout each `period`
+    seconds, so that pages which show it stay the same for a while.
+    """
+
+    if not names:
+        return None
+
+    if now is None:
+        now = time()
+    bucket = int(now // period)
+    digest = md5("%s:%d" % (seed, bucket)).hexdigest()
+    return names[int(digest, 16) % len(names)]
+
+
+assets = AssetIndex()
@@ -11,14 +11,40 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
 # License for the specific language governing permissions and limitations under
 # the License.
-from flask import url_for
+from flask import has_request_context, request, url_for
 
 from newrem.util import slugify
 
+# Comic URLs which have already been built, keyed on everything which goes
+# into them.
+comic_urls = {}
+COMIC_URLS_SIZE = 10000
+
 
 def url_for_comic(comic, **kwargs):
-    return url_for("comics", u=comic.universe, cid=comic.id,
-                   name=slugify(comic.title), **kwargs)
+    """
+    Build the URL for a comic.
+
+    URLs are remembered between requests, since a comic page links to the
+    same few comics many times over.
+    """
+
+    # Comics which predate stored slugs don't have one yet.
+    slug = comic.slug or slugify(comic.title)
+
+    if not has_request_context():
+        return url_for("comics", u=comic.universe, cid=comic.id, name=slug,
+                       **kwargs)
+
+    key = (request.url_root, comic.universe_fk, comic.id, slug,
+           tuple(sorted(kwargs.iteritems())))
+    url = comic_urls.get(key)
+    if url is None:
+        if len(comic_urls) >= COMIC_URLS_SIZE:
+            comic_urls.clear()
+        url = comic_urls[key] = url_for("comics", u=comic.universe,
+                                        cid=comic.id, name=slug, **kwargs)
+    return url
 
 
 def load_filters(app):
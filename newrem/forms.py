@@ -11,15 +11,18 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
 # License for the specific language governing permissions and limitations under
 # the License.
+from cgi import escape
 from datetime import datetime
 
 from wtforms.ext.dateutil.fields import DateTimeField
-from wtforms.ext.sqlalchemy.fields import (QuerySelectMultipleField,
-    QuerySelectField)
+from wtforms.ext.sqlalchemy.fields import QuerySelectField
 from wtforms.ext.sqlalchemy.orm import model_form
-from wtforms.fields import (BooleanField, PasswordField, SelectField,
+from wtforms.fields import (BooleanField, Field, IntegerField, PasswordField,
                             SubmitField, TextAreaField, TextField)
 from wtforms.validators import EqualTo, Length, Required, ValidationError
+from wtforms.widgets import HTMLString, html_params
+
+from flask import url_for
 
 from flask.ext.uploads import IMAGES, UploadSet
 from flask.ext.wtf import Form, RecaptchaField
@@ -151,6 +154,13 @@ class RegisterForm(LoginForm):
     captcha = RecaptchaField()
     submit = SubmitField("Register!")
 
+class PasswordForm(FormBase):
+    current = PasswordField("Current password", validators=(Required(),))
+    password = PasswordField("New password", validators=(Required(),))
+    confirm = PasswordField("Confirm new password",
+        validators=(Required(), EqualTo("password")))
+    submit = SubmitField("Change password!")
+
 class NewsFormBase(
     model_form(Newspost, base_class=FormBase, exclude=["portrait"])):
     portrait = QuerySelectField(u"Portrait",
@@ -168,25 +178,137 @@ class EditNewsForm(NewsFormBase):
 def label_for_comic(comic):
     return u'"%s" (%d)' % (comic.title, comic.position)
 
-def select_option_for_comics(first, second):
-    first_label = label_for_comic(first)
-    second_label = label_for_comic(second)
-    return first.id, u"%s to %s" % (first_label, second_label)
-
-def select_list_for_comics(comics):
-    if comics:
-        first = comics[0]
-        l = [(-1, u"Before %s" % label_for_comic(first))]
-        if len(comics) > 1:
-            for first, second in zip(comics, comics[1::]):
-                l.append(select_option_for_comics(first, second))
-            last = comics[-1]
-            l.append((second.id, u"After %s" % label_for_comic(last)))
+
+class PickerWidget(object):
+    """
+    Render a select holding only the options which are already chosen, or
+    which are always offered.
+
+    The select is wrapped in a span naming the field's search URL, which
+    picker.js uses to fetch more options as they are searched for.
+    """
+
+    def __init__(self, multiple=False):
+        self.multiple = multiple
+
+    def __call__(self, field, **kwargs):
+        kwargs.setdefault("id", field.id)
+        if self.multiple:
+            kwargs["multiple"] = True
+
+        html = [u"<select %s>" % html_params(name=field.name, **kwargs)]
+        for value, label in field.chosen():
+            options = {"value": value}
+            if self.multiple or value == field.data:
+                options["selected"] = True
+            html.append(u"<option %s>%s</option>" % (html_params(**options),
+                                                      escape(label)))
+        html.append(u"</select>")
+
+        params = html_params(class_="picker", **{"data-url": field.url})
+        return HTMLString(u"<span %s>%s</span>" % (params, u"".join(html)))
+
+
+class ComicPickerField(Field):
+    """
+    Pick where a comic goes in a universe's timeline: after the comic with
+    the chosen ID, before every comic with -1, or -2 if there are no comics
+    yet.
+
+    Only the chosen comic is ever loaded, rather than the whole timeline.
+    """
+
+    widget = PickerWidget()
+
+    def __init__(self, label=None, validators=None, **kwargs):
+        super(ComicPickerField, self).__init__(label, validators, **kwargs)
+        self.universe = None
+        self.url = None
+
+    def process_formdata(self, valuelist):
+        if valuelist:
+            try:
+                self.data = int(valuelist[0])
+            except ValueError:
+                self.data = None
+                raise ValueError(self.gettext("Not a valid choice"))
+
+    def first(self):
+        q = Comic.query.filter_by(universe=self.universe)
+        return q.order_by(Comic.position, Comic.id).first()
+
+    def chosen(self):
+        first = self.first()
+        if first is None:
+            return [(-2, u"<No comics exist yet>")]
+
+        choices = [(-1, u"Before %s" % label_for_comic(first))]
+        if self.data not in (None, -1, -2):
+            comic = Comic.query.filter_by(universe=self.universe,
+                                          id=self.data).first()
+            if comic is not None:
+                choices.append((comic.id,
+                                u"After %s" % label_for_comic(comic)))
+        return choices
+
+    def pre_validate(self, form):
+        if self.data == -1:
+            return
+
+        if self.data == -2:
+            valid = self.first() is None
         else:
-            l.append((comics[0].id, u"After %s" % label_for_comic(comics[0])))
-        return l
-    else:
-        return [(-2, "<No comics exist yet>")]
+            q = Comic.query.filter_by(universe=self.universe, id=self.data)
+            valid = self.data is not None and q.first() is not None
+        if not valid:
+            raise ValidationError(self.gettext("Not a valid choice"))
+
+
+class CharacterPickerField(Field):
+    """
+    Pick some of a universe's characters, by slug.
+
+    Only the chosen characters are ever loaded, rather than the whole cast.
+    """
+
+    widget = PickerWidget(multiple=True)
+
+    def __init__(self, label=None, validators=None, **kwargs):
+        kwargs.setdefault("default", [])
+        super(CharacterPickerField, self).__init__(label, validators,
+                                                   **kwargs)
+        self.universe = None
+        self.url = None
+        self._formdata = None
+        self._invalid_formdata = False
+
+    def _get_data(self):
+        # Submitted slugs are only looked up once the universe is known.
+        if self._formdata is not None:
+            slugs = self._formdata
+            q = Character.query.filter_by(universe=self.universe)
+            found = dict((c.slug, c) for c in q.filter(Character.slug.in_(
+                slugs or [None])))
+            self._invalid_formdata = len(found) != len(slugs)
+            self._set_data([found[slug] for slug in slugs if slug in found])
+        return self._data
+
+    def _set_data(self, data):
+        self._data = data
+        self._formdata = None
+
+    data = property(_get_data, _set_data)
+
+    def process_formdata(self, valuelist):
+        self._formdata = sorted(set(valuelist))
+
+    def chosen(self):
+        return [(c.slug, c.name) for c in self.data]
+
+    def pre_validate(self, form):
+        self._get_data()
+        if self._invalid_formdata:
+            raise ValidationError(self.gettext("Not a valid choice"))
 
 
 class ComicFormBase(FormBase):
@@ -195,29 +317,28 @@ class ComicFormBase(FormBase):
     title = TextField("Title", validators=(Required(), Length(max=80)))
     description = TextAreaField("Alternate Text")
     comment = TextAreaField("Commentary")
-    index = SelectField(u"Where should this comic be placed?",
-                        coerce=int)
-    characters = QuerySelectMultipleField(u"Characters", get_label="name")
+    index = ComicPickerField(u"Where should this comic be placed?")
+    characters = CharacterPickerField(u"Characters")
     time = DateTimeField("Activation time", default=datetime.now)
 
     def __init__(self, universe, *args, **kwargs):
         super(ComicFormBase, self).__init__(*args, **kwargs)
 
-        # Set up the comics index.
-        q = Comic.query.filter_by(universe=universe)
-        comics = q.order_by(Comic.position).all()
-        self.index.choices = select_list_for_comics(comics)
-
-        # Set up the query factory for characters.
-        def f():
-            q = Character.query.filter_by(universe=universe)
-            q = q.order_by(Character.name)
-            return q
-        self.characters.query_factory = f
+        self.index.universe = universe
+        self.index.url = url_for("admin.search_comics", u=universe)
+        self.characters.universe = universe
+        self.characters.url = url_for("admin.search_characters", u=universe)
 
 
 CreateComicForm, ModifyComicForm = makeCU(ComicFormBase)
 
+class MoveComicsForm(FormBase):
+    first = IntegerField(u"First comic to move", validators=(Required(),))
+    last = IntegerField(u"Last comic to move", validators=(Required(),))
+    after = IntegerField(u"Move them after this comic, or -1 for the start",
+                         validators=(Required(),))
+    submit = SubmitField("Move!")
+
 class CommentForm(FormBase):
     anonymous = BooleanField("Post anonymously?")
     sage = BooleanField("Sage?")
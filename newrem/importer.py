@@ -0,0 +1,414 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+"""
+Import a back catalogue of comics into a universe, from a directory of images
+and a manifest describing them.
+
+Run with ``python -m newrem.importer UNIVERSE DIRECTORY``, from the directory
+with ``dcon.yaml`` in it. The manifest is DIRECTORY/manifest.yaml or
+DIRECTORY/manifest.csv unless another is given with --manifest. Comics are
+added after the end of the universe's timeline. If an import is interrupted,
+run it again; comics which were already imported are skipped.
+"""
+
+import argparse
+import csv
+from datetime import datetime, timedelta
+from functools import partial
+from hashlib import sha256
+from multiprocessing import Pool
+import os
+import sys
+
+from dateutil.parser import parse as parse_time
+from dateutil.tz import tzlocal
+from PIL import Image
+import yaml
+
+from werkzeug import secure_filename
+from werkzeug.datastructures import FileStorage
+
+from flask import current_app
+
+from newrem.cache import invalidate
+from newrem.files import CHUNK_SIZE, file_extension, fp_root, stream_file
+from newrem.grammars import VERSION
+from newrem.models import (db, Appearance, Blob, Character, Comic, Thread,
+                           Universe, POSITION_GAP, casts)
+from newrem.util import slugify
+
+# How many comics are committed at a time. An interrupted import keeps every
+# batch which was committed.
+BATCH_SIZE = 500
+
+# Names of the manifest files which are looked for by default.
+MANIFESTS = "manifest.yaml", "manifest.yml", "manifest.csv"
+
+
+def read_manifest(path):
+    """
+    Read the entries of a manifest.
+
+    Manifests are either YAML, holding a list of mappings, or CSV, with a
+    header row. Each entry has a "file", relative to the directory of
+    images, and a "title", and may have a "description", "comment", "cast",
+    "time" and "order". In CSV, the cast is separated by commas.
+    """
+
+    with open(path, "rb") as handle:
+        if path.endswith(".csv"):
+            entries = []
+            for row in csv.DictReader(handle):
+                entry = dict((key, value.decode("utf-8"))
+                             for key, value in row.iteritems() if value)
+                entries.append(entry)
+        else:
+            entries = yaml.safe_load(handle) or []
+
+    return entries
+
+
+def cast_of(entry):
+    """
+    Get the slugs of the characters in a manifest entry.
+    """
+
+    cast = entry.get("cast") or []
+    if isinstance(cast, basestring):
+        cast = cast.split(",")
+    return set(slugify(unicode(c).strip()) for c in cast)
+
+
+def examine(path):
+    """
+    Hash an image, and check that PIL can read it.
+
+    This runs in a worker process. Returns the SHA-256 digest of the file,
+    and whether it is an image.
+    """
+
+    digest = sha256()
+    with open(path, "rb") as handle:
+        for chunk in iter(partial(handle.read, CHUNK_SIZE), ""):
+            digest.update(chunk)
+
+    try:
+        Image.open(path).verify()
+    except Exception:
+        # PIL raises all sorts of things for broken images.
+        return digest.hexdigest(), False
+
+    return digest.hexdigest(), True
+
+
+def copy_blob(path, fp):
+    """
+    Copy a file into the blob store, unless it is already there.
+    """
+
+    if fp.exists():
+        return
+
+    parent = fp.parent()
+    if not parent.exists():
+        parent.makedirs()
+
+    with open(path, "rb") as source:
+        temp, digest = stream_file(parent, FileStorage(source))
+    temp.moveTo(fp)
+
+
+class Importer(object):
+    """
+    Imports comics into a universe.
+
+    Images are hashed and checked by a pool of worker processes; as with the
+    thumbnail pipeline, `processes` of None means a worker for every CPU, and
+    zero means doing the work in this process.
+    """
+
+    def __init__(self, universe, directory, processes=None,
+                 batch_size=BATCH_SIZE):
+        self.universe = universe
+        self.directory = directory
+        self.processes = processes
+        self.batch_size = batch_size
+
+    def examine(self, paths):
+        """
+        Examine some images, returning a dictionary of paths to the results
+        of examine().
+        """
+
+        if self.processes == 0:
+            return dict(zip(paths, map(examine, paths)))
+
+        pool = Pool(self.processes)
+        try:
+            results = pool.map(examine, paths, chunksize=16)
+        finally:
+            pool.close()
+            pool.join()
+        return dict(zip(paths, results))
+
+    def prepare(self, entries):
+        """
+        Check a manifest's entries, and work out the comics to import.
+
+        Returns the comics as a list of dictionaries in timeline order, the
+        number of entries which were already imported, and a list of
+        problems. Nothing should be imported if there are any problems.
+        """
+
+        problems = []
+        u = self.universe
+
+        q = db.session.query(Character.slug).filter_by(universe_fk=u.slug)
+        characters = set(slug for slug, in q)
+        q = db.session.query(Comic.filename, Comic.universe_fk)
+        filenames = dict(q)
+
+        comics = []
+        skipped = 0
+        seen = set()
+        for i, entry in enumerate(entries):
+            where = "Entry %d" % (i + 1)
+            if not isinstance(entry, dict):
+                problems.append("%s isn't a mapping" % where)
+                continue
+
+            name = entry.get("file")
+            title = entry.get("title")
+            if not name or not title:
+                problems.append("%s needs a file and a title" % where)
+                continue
+            where = "%s (%s)" % (where, name)
+
+            filename = secure_filename(os.path.basename(name))
+            if filename in seen:
+                problems.append("%s is listed twice" % where)
+                continue
+            seen.add(filename)
+
+            if filename in filenames:
+                if filenames[filename] == u.slug:
+                    skipped += 1
+                else:
+                    problems.append("%s is already a comic in %s"
+                                    % (where, filenames[filename]))
+                continue
+
+            path = os.path.join(self.directory, name)
+            if not os.path.isfile(path):
+                problems.append("%s doesn't exist" % where)
+                continue
+
+            cast = cast_of(entry)
+            unknown = cast - characters
+            if unknown:
+                problems.append("%s has unknown characters: %s"
+                                % (where, ", ".join(sorted(unknown))))
+                continue
+
+            time = entry.get("time")
+            if time is not None and not isinstance(time, datetime):
+                try:
+                    time = parse_time(unicode(time))
+                except (ValueError, OverflowError):
+                    problems.append("%s has a bad time: %s" % (where, time))
+                    continue
+            if time is not None and time.tzinfo is not None:
+                # Comics' times are naive local times.
+                time = time.astimezone(tzlocal()).replace(tzinfo=None)
+
+            try:
+                order = float(entry.get("order", i))
+            except (TypeError, ValueError):
+                problems.append("%s has a bad order" % where)
+                continue
+
+            comics.append({
+                "path": path,
+                "filename": filename,
+                "title": unicode(title),
+                "description": unicode(entry.get("description") or u""),
+                "comment": unicode(entry.get("comment") or u""),
+                "cast": sorted(cast),
+                "time": time,
+                "order": (order, i),
+            })
+
+        comics.sort(key=lambda comic: comic["order"])
+
+        # Comics without a time have gone live by the time the import is
+        # done, a second apart, in timeline order.
+        now = datetime.now().replace(microsecond=0)
+        for i, comic in enumerate(comics):
+            if comic["time"] is None:
+                comic["time"] = now - timedelta(seconds=len(comics) - i)
+
+        times = [comic["time"] for comic in comics]
+        if len(set(times)) != len(times):
+            problems.append("Some comics share a time")
+        elif times:
+            q = db.session.query(Comic.time)
+            q = q.filter(Comic.time.between(min(times), max(times)))
+            if set(time for time, in q) & set(times):
+                problems.append("Some comics share a time with existing "
+                                "comics")
+
+        results = self.examine([comic["path"] for comic in comics])
+        for comic in comics:
+            comic["digest"], image = results[comic["path"]]
+            if not image:
+                problems.append("%s isn't an image" % comic["filename"])
+
+        return comics, skipped, problems
+
+    def run(self, entries):
+        """
+        Import comics from a manifest's entries.
+
+        Returns the number of comics imported, the number which were already
+        imported, and a list of problems. If there are problems, nothing is
+        imported.
+        """
+
+        u = self.universe
+        comics, skipped, problems = self.prepare(entries)
+        if problems:
+            return 0, skipped, problems
+
+        # New comics go after the end of the timeline, in one pass, so that
+        # nothing needs to be respaced.
+        q = db.session.query(db.func.max(Comic.position))
+        tail = q.filter(Comic.universe_fk == u.slug).scalar()
+        start = 0 if tail is None else tail + POSITION_GAP
+        for i, comic in enumerate(comics):
+            comic["position"] = start + i * POSITION_GAP
+
+        for i in range(0, len(comics), self.batch_size):
+            self.insert(comics[i:i + self.batch_size])
+
+        # The appearances are rebuilt even if there was nothing left to
+        # import, in case the last run was interrupted before it got here.
+        slugs = set()
+        for entry in entries:
+            slugs.update(cast_of(entry))
+        Appearance.reindex(slugs)
+        db.session.commit()
+        invalidate(u)
+
+        return len(comics), skipped, []
+
+    def insert(self, comics):
+        """
+        Store and insert a batch of comics, in a single transaction.
+        """
+
+        u = self.universe
+        root = fp_root(current_app)
+
+        blobs = {}
+        for comic in comics:
+            fs = FileStorage(filename=comic["filename"])
+            blob = Blob(comic["digest"], file_extension(fs))
+            copy_blob(comic["path"], root.descendant(blob.segments()))
+            blobs[blob.digest] = blob
+
+        q = db.session.query(Blob.digest).filter(Blob.digest.in_(blobs))
+        stored = set(digest for digest, in q)
+        rows = [{"digest": blob.digest, "extension": blob.extension,
+                 "time": blob.time}
+                for blob in blobs.itervalues() if blob.digest not in stored]
+        if rows:
+            db.session.execute(Blob.__table__.insert(), rows)
+
+        # Threads and comics need their IDs back, so they are inserted a row
+        # at a time, but without the overhead of the unit of work.
+        threads = [{"board_fk": u.board_fk, "subject": comic["title"],
+                    "author": u"DCoN"} for comic in comics]
+        db.session.bulk_insert_mappings(Thread, threads, return_defaults=True)
+
+        rows = []
+        for comic, thread in zip(comics, threads):
+            row = {
+                "time": comic["time"],
+                "filename": comic["filename"],
+                "position": comic["position"],
+                "title": comic["title"],
+                "slug": slugify(comic["title"]),
+                "description": comic["description"],
+                "comment": comic["comment"],
+                "grammar": VERSION,
+                "threadid": thread["id"],
+                "universe_fk": u.slug,
+                "blob_id": comic["digest"],
+            }
+            for source, (target, renderer) in Comic.markup.iteritems():
+                row[target] = renderer(row[source])
+            rows.append(row)
+        db.session.bulk_insert_mappings(Comic, rows, return_defaults=True)
+
+        rows = [{"character_id": slug, "comic_id": row["id"]}
+                for comic, row in zip(comics, rows) for slug in comic["cast"]]
+        if rows:
+            db.session.execute(casts.insert(), rows)
+
+        db.session.commit()
+
+
+def find_manifest(directory):
+    for name in MANIFESTS:
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("universe", help="the slug of the universe")
+    parser.add_argument("directory")
+    parser.add_argument("--manifest")
+    parser.add_argument("--processes", type=int,
+                        help="how many processes hash images")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    manifest = args.manifest or find_manifest(args.directory)
+    if manifest is None:
+        parser.error("No manifest in %s" % args.directory)
+
+    from newrem.main import app
+
+    with app.app_context():
+        universe = Universe.query.get(args.universe)
+        if universe is None:
+            parser.error("No such universe: %s" % args.universe)
+
+        importer = Importer(universe, args.directory, args.processes,
+                            args.batch_size)
+        imported, skipped, problems = importer.run(read_manifest(manifest))
+
+    for problem in problems:
+        print >> sys.stderr, problem
+    if problems:
+        sys.exit(1)
+    print "Imported %d comics, skipped %d already imported" % (imported,
+                                                              skipped)
+
+
+if __name__ == "__main__":
+    main()
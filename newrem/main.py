@@ -12,18 +12,24 @@
 # License for the specific language governing permissions and limitations under
 # the License.
 import os
+from threading import Thread
 
 from bp.filepath import FilePath
 
+from sqlalchemy.exc import SQLAlchemyError
+
 from flask.ext.uploads import configure_uploads, patch_request_class
 
 from newrem.admin import admin
+from newrem.cache import invalidate
 from newrem.chan import osuchan
 from newrem.comics import comics
 from newrem.config import load_config
+from newrem.files import assets
 from newrem.filters import load_filters
 from newrem.forms import images
-from newrem.models import db, lm
+from newrem.models import db, lm, Blob, rerender
+from newrem.profiling import recorder
 from newrem.users import users
 from newrem.views import app
 
@@ -37,6 +43,27 @@ def site_config():
 load_filters(app)
 
 
+def maintain_in_background():
+    """
+    Bring all of the stored HTML up to date with the grammar, and sweep away
+    unused blobs, without holding up startup or any requests.
+    """
+
+    def run():
+        with app.app_context():
+            try:
+                if rerender():
+                    invalidate()
+                Blob.sweep()
+            except SQLAlchemyError:
+                # Most likely the tables haven't been created yet.
+                db.session.rollback()
+
+    t = Thread(target=run)
+    t.daemon = True
+    t.start()
+
+
 wd = None
 if wd is None:
     wd = os.getcwd()
@@ -58,13 +85,19 @@ app.config["SESSION_PROTECTION"] = None
 
 load_config(app)
 
+# Index the 404 images now, rather than during the first 404.
+assets.names(app, ["404"])
+
 configure_uploads(app, (images,))
 patch_request_class(app)
 
 db.init_app(app)
 lm.setup_app(app)
+recorder.init_app(app)
 
 app.register_blueprint(users)
 app.register_blueprint(admin, url_prefix="/admin")
 app.register_blueprint(comics)
 app.register_blueprint(osuchan, url_prefix="/chan")
+
+maintain_in_background()
@@ -11,20 +11,28 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
 # License for the specific language governing permissions and limitations under
 # the License.
-from datetime import datetime
+from datetime import datetime, timedelta
 from functools import partial
+from hashlib import sha256
 
-from PIL import Image
-
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import (check_password_hash, generate_password_hash,
+                               safe_str_cmp)
 
 from flask import current_app
 
 from flask.ext.login import LoginManager, make_secure_token
 from flask.ext.sqlalchemy import SQLAlchemy
 
-from newrem.files import extend_url, fp_root, url_root
-from newrem.util import slugify
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.collections import attribute_mapped_collection
+from sqlalchemy.schema import CreateColumn
+
+from newrem.cache import cache
+from newrem.files import (extend_url, file_extension, fp_root, make_directory,
+                          stream_file, url_root)
+from newrem.grammars import VERSION, paragraphs, safe_paragraphs
+from newrem.util import excerpt, slugify
 
 db = SQLAlchemy()
 lm = LoginManager()
@@ -34,22 +42,120 @@ FK = partial(db.ForeignKey, onupdate="cascade", ondelete="cascade")
 # Oh, wait, that doesn't work on SQLite or MySQL. Plan B!
 relationship = partial(db.relationship, cascade="all", passive_updates=False)
 
+# The distance between neighboring comics' positions after respacing. Each
+# insertion takes the midpoint between its neighbors, so ten comics can be
+# inserted at the same spot before a respace is needed. Appending to either
+# end of the timeline never needs a respace.
+POSITION_GAP = 1024
+
+# How long a user's signature is cached, in seconds. Changing their password
+# throws it out sooner; workers which don't share a cache might take this long
+# to notice.
+USER_TTL = 60
+
 casts = db.Table("casts", db.metadata,
     db.Column("character_id", db.String(45), FK("characters.slug")),
     db.Column("comic_id", db.Integer, FK("comics.id"))
 )
 
 
+def position_between(lower, upper):
+    """
+    Pick a position strictly between two others.
+
+    Either bound may be None, meaning that side is open. Returns None if there
+    is no room between the bounds.
+    """
+
+    if lower is None and upper is None:
+        return 0
+    elif lower is None:
+        return upper - POSITION_GAP
+    elif upper is None:
+        return lower + POSITION_GAP
+    elif upper - lower > 1:
+        return (lower + upper) // 2
+    else:
+        return None
+
+
 class FilenameMixin(object):
     """
     A mixin to provide some file access based on segments.
     """
 
     def fp(self):
-        return fp_root(current_app).descendant(self.segments())
+        return fp_root(current_app).descendant(self.location())
 
     def url(self):
-        return extend_url(url_root(current_app), self.segments())
+        return extend_url(url_root(current_app), self.location())
+
+    def location(self):
+        """
+        Get the segments where the file is actually stored: in its blob, if
+        it has one, or else at its own segments.
+        """
+
+        blob = getattr(self, "blob", None)
+        if blob is None:
+            return self.segments()
+        return blob.segments()
+
+    def own_fp(self):
+        """
+        Get the path of the file outside of the blob store.
+        """
+
+        return fp_root(current_app).descendant(self.segments())
+
+    def thumbnail(self, size):
+        """
+        Get the URL of a thumbnail of the file.
+
+        The file's own URL is used if there is no such thumbnail, or it
+        hasn't been made yet.
+        """
+
+        blob = getattr(self, "blob", None)
+        if blob is not None and size in blob.derivatives:
+            return blob.derivatives[size].url()
+        return self.url()
+
+
+class MarkupMixin(object):
+    """
+    A mixin for models with markup which is rendered to HTML ahead of time.
+
+    `markup` maps the name of each markup column to the name of the column
+    which holds its HTML, and the renderer for it. The `grammar` column
+    records the grammar version that rendered the HTML.
+    """
+
+    markup = {}
+
+    def render(self):
+        """
+        Render all of the markup, after it has been changed.
+        """
+
+        for source, (target, renderer) in self.markup.iteritems():
+            setattr(self, target, renderer(getattr(self, source) or u""))
+        self.grammar = VERSION
+
+    def html(self, source):
+        """
+        Get the HTML for some markup.
+
+        Rows which have never been rendered are rendered on the fly. Rows
+        rendered by older grammars are served as-is until rerender() gets to
+        them.
+        """
+
+        target, renderer = self.markup[source]
+        html = getattr(self, target)
+        if html is None:
+            html = renderer(getattr(self, source) or u"")
+        return html
 
 
 class Wordfilter(db.Model):
@@ -79,13 +185,39 @@ class Board(db.Model):
         self.name = name
 
 
+# How many characters of a post are kept in its thread's summary.
+PREVIEW_LENGTH = 140
+
+
 class Thread(db.Model):
+    """
+    A thread of posts, either on a board or beneath a comic.
+
+    Threads carry a denormalized summary of their posts, so that they can be
+    listed without looking at any posts. Add posts with add(), which keeps
+    the summary up to date, or call summarize() after changing posts any
+    other way.
+    """
+
     __tablename__ = "thread"
+    __table_args__ = (
+        db.Index("thread_board_bumped", "board_fk", "bumped", "id"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     subject = db.Column(db.Unicode(50))
     author = db.Column(db.Unicode(30))
     board_fk = db.Column(db.String(5), FK(Board.abbreviation))
+    # Time of the latest post, or None if there are no posts yet.
+    bumped = db.Column(db.DateTime)
+    # Number of posts after the opening post.
+    replies = db.Column(db.Integer, default=0)
+    # Number of posts with images.
+    images = db.Column(db.Integer, default=0)
+    last_author = db.Column(db.Unicode(30))
+    # Excerpts of the opening post and of the latest reply.
+    op_preview = db.Column(db.Unicode(PREVIEW_LENGTH))
+    last_preview = db.Column(db.Unicode(PREVIEW_LENGTH))
 
     board = relationship(Board, backref="threads")
 
@@ -94,21 +226,307 @@ class Thread(db.Model):
         self.subject = subject
         self.author = author
 
+    @staticmethod
+    def add(tid, post):
+        """
+        Add a post to a thread, given its ID, and update the thread's summary
+        in the same transaction.
+
+        The summary is updated with a single UPDATE, so that simultaneous
+        posts can't lose each other's counts. Returns False if there is no
+        such thread.
+        """
+
+        post.threadid = tid
+        db.session.add(post)
+
+        first = Thread.bumped.is_(None)
+        preview = excerpt(post.comment, PREVIEW_LENGTH)
+        image = 1 if post.blob is not None else 0
+
+        # MySQL assigns columns from left to right, so the columns which
+        # check whether this is the first post have to come before bumped.
+        q = Thread.query.filter_by(id=tid)
+        return bool(q.update([
+            (Thread.replies, db.case([(first, 0)],
+                                     else_=Thread.replies + 1)),
+            (Thread.images, Thread.images + image),
+            (Thread.last_author, post.author),
+            (Thread.op_preview, db.case([(first, preview)],
+                                        else_=Thread.op_preview)),
+            (Thread.last_preview, db.case([(first, db.null())],
+                                          else_=preview)),
+            (Thread.bumped, post.timestamp),
+        ], synchronize_session=False,
+           update_args={"preserve_parameter_order": True}))
+
+    def summarize(self):
+        """
+        Work out this thread's summary from its posts.
+        """
+
+        q = Post.query.filter_by(threadid=self.id)
+        posts = q.count()
+        self.replies = max(posts - 1, 0)
+        self.images = q.filter(db.or_(Post.blob_id.isnot(None),
+                                      Post.filename.isnot(None))).count()
+
+        first = q.order_by(Post.id).first()
+        last = q.order_by(Post.id.desc()).first()
+        self.bumped = last and last.timestamp
+        self.last_author = last and last.author
+        self.op_preview = first and excerpt(first.comment, PREVIEW_LENGTH)
+        if posts > 1:
+            self.last_preview = excerpt(last.comment, PREVIEW_LENGTH)
+        else:
+            self.last_preview = None
+
+
+def insert_once(table, row):
+    """
+    Insert a row in the session's transaction, unless its key is already
+    taken. Returns whether the row was inserted.
+
+    Pending changes in the session aren't flushed, and aren't lost if the
+    key is taken.
+    """
+
+    connection = db.session.connection()
+
+    # A failed statement only undoes itself in SQLite. That's just as well,
+    # since pysqlite commits the transaction before any SAVEPOINT.
+    savepoint = None
+    if connection.dialect.name != "sqlite":
+        savepoint = connection.begin_nested()
+
+    try:
+        connection.execute(table.insert(), row)
+    except IntegrityError:
+        if savepoint is not None:
+            savepoint.rollback()
+        return False
+
+    if savepoint is not None:
+        savepoint.commit()
+    return True
+
+
+def add_columns(model, *names):
+    """
+    Add some of a model's columns to its table, if the database's copy of
+    the table doesn't have them yet. Returns the names of the columns which
+    were added.
+
+    create_all() only creates missing tables, so databases made before a
+    column was added need this.
+    """
+
+    table = model.__table__
+    existing = [column["name"]
+                for column in db.inspect(db.engine).get_columns(table.name)]
+    preparer = db.engine.dialect.identifier_preparer
+
+    added = []
+    for name in names:
+        if name in existing:
+            continue
+        spec = CreateColumn(table.c[name]).compile(dialect=db.engine.dialect)
+        db.engine.execute("ALTER TABLE %s ADD COLUMN %s"
+                          % (preparer.format_table(table), spec))
+        added.append(name)
+    return added
+
+
+def add_indexes(model):
+    """
+    Create any of a model's indexes which the database's copy of its table
+    doesn't have yet. Returns the names of the indexes which were created.
+    """
+
+    table = model.__table__
+    existing = [index["name"]
+                for index in db.inspect(db.engine).get_indexes(table.name)]
+
+    added = []
+    for index in table.indexes:
+        if index.name not in existing:
+            index.create(db.engine)
+            added.append(index.name)
+    return added
+
+
+class Blob(db.Model, FilenameMixin):
+    """
+    A file in the content-addressed store, named after the SHA-256 digest of
+    its contents.
+
+    Identical uploads share a single blob, and so a single URL, which never
+    changes what it points to. Blobs are referenced by comics, characters and
+    posts; sweep() removes the blobs which nothing references.
+    """
+
+    __tablename__ = "blobs"
+
+    digest = db.Column(db.String(64), primary_key=True)
+    extension = db.Column(db.String(10), nullable=False)
+    # When this blob was last stored.
+    time = db.Column(db.DateTime, nullable=False)
+
+    # Thumbnails, by size.
+    derivatives = db.relationship("Derivative", lazy="joined",
+        cascade="all, delete-orphan",
+        collection_class=attribute_mapped_collection("size"))
+
+    def __init__(self, digest, extension):
+        self.digest = digest
+        self.extension = extension
+        self.time = datetime.utcnow()
+
+    def __repr__(self):
+        return "<Blob(%r)>" % self.digest
+
+    def segments(self):
+        return ["blobs", self.digest[:2], self.digest + self.extension]
+
+    @staticmethod
+    def store(fs):
+        """
+        Store a ``FileStorage``, returning its blob, or None if it couldn't
+        be stored.
+
+        If the same bytes are already stored, the existing blob is returned
+        and the upload is thrown away.
+        """
+
+        root = fp_root(current_app).child("blobs")
+        if not make_directory(root):
+            return None
+
+        temp, digest = stream_file(root, fs, sha256)
+
+        # The row is inserted straight away, so that two identical uploads
+        # at once can't both decide to insert it; whichever is second finds
+        # the first's row instead. Callers might have half-built rows in the
+        # session already, so nothing is flushed.
+        row = {"digest": digest, "extension": file_extension(fs),
+               "time": datetime.utcnow()}
+        inserted = insert_once(Blob.__table__, row)
+        with db.session.no_autoflush:
+            blob = Blob.query.get(digest)
+        if not inserted:
+            # Keep the sweeper away until the new reference is committed.
+            blob.time = row["time"]
+
+        fp = blob.fp()
+        if fp.exists():
+            temp.remove()
+        elif make_directory(fp.parent()):
+            temp.moveTo(fp)
+        else:
+            temp.remove()
+            return None
+
+        return blob
+
+    @staticmethod
+    def references():
+        """
+        Count the references to each blob.
+
+        Returns a dictionary of digests to reference counts. Unreferenced
+        blobs aren't included.
+        """
+
+        counts = {}
+        for model in Comic, Character, Portrait, Post:
+            q = db.session.query(model.blob_id, db.func.count())
+            q = q.filter(model.blob_id.isnot(None)).group_by(model.blob_id)
+            for digest, count in q:
+                counts[digest] = counts.get(digest, 0) + count
+        return counts
+
+    @staticmethod
+    def sweep(grace=timedelta(hours=1)):
+        """
+        Remove every blob which is no longer referenced.
+
+        Blobs stored within the grace period are kept, since whatever stored
+        them might not have committed its reference yet. Returns the number
+        of blobs removed.
+        """
+
+        counts = Blob.references()
+        cutoff = datetime.utcnow() - grace
+        blobs = [blob for blob in Blob.query.filter(Blob.time < cutoff)
+                 if blob.digest not in counts]
+
+        fps = []
+        for blob in blobs:
+            fps.append(blob.fp())
+            fps.extend(d.fp() for d in blob.derivatives.itervalues())
+            db.session.delete(blob)
+        db.session.commit()
+
+        for fp in fps:
+            if fp.exists():
+                fp.remove()
+
+        return len(blobs)
+
+
+class Derivative(db.Model, FilenameMixin):
+    """
+    A thumbnail of a blob, stored alongside it.
+    """
+
+    __tablename__ = "derivatives"
+
+    blob_id = db.Column(db.String(64), db.ForeignKey(Blob.digest),
+                        primary_key=True)
+    size = db.Column(db.String(10), primary_key=True)
+    extension = db.Column(db.String(10), nullable=False)
+    width = db.Column(db.Integer, nullable=False)
+    height = db.Column(db.Integer, nullable=False)
+
+    def __init__(self, blob_id, size, extension, width, height):
+        self.blob_id = blob_id
+        self.size = size
+        self.extension = extension
+        self.width = width
+        self.height = height
+
+    def __repr__(self):
+        return "<Derivative(%r, %r)>" % (self.blob_id, self.size)
+
+    def segments(self):
+        filename = "%s-%s%s" % (self.blob_id, self.size, self.extension)
+        return ["blobs", self.blob_id[:2], filename]
+
 
-class Post(db.Model, FilenameMixin):
+class Post(db.Model, FilenameMixin, MarkupMixin):
     __tablename__ = "post"
+    __table_args__ = (
+        db.Index("post_thread", "threadid", "id"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     author = db.Column(db.Unicode(30), nullable=False)
     threadid = db.Column(db.Integer, FK(Thread.id), nullable=False)
     timestamp = db.Column(db.DateTime, nullable=False)
     comment = db.Column(db.UnicodeText(1024 * 1024))
+    comment_html = db.Column(db.UnicodeText(1024 * 1024))
+    grammar = db.Column(db.Integer)
     email = db.Column(db.String(30))
     filename = db.Column(db.String(50))
+    blob_id = db.Column(db.String(64), db.ForeignKey(Blob.digest))
 
+    blob = db.relationship(Blob, lazy="joined")
     thread = relationship(Thread, backref="posts", single_parent=True,
                           cascade="all, delete, delete-orphan")
 
+    # Posts are untrusted, so escape them.
+    markup = {"comment": ("comment_html", safe_paragraphs)}
+
     def __init__(self, author, comment, email, filename):
         self.comment = comment
         self.author = author
@@ -116,6 +534,7 @@ class Post(db.Model, FilenameMixin):
         self.filename = filename
 
         self.timestamp = datetime.now()
+        self.render()
 
     def segments(self):
         return ["comments", self.filename]
@@ -155,6 +574,8 @@ class Character(db.Model, FilenameMixin):
     description = db.Column(db.UnicodeText(1024 * 1024))
     universe_fk = db.Column(db.String(85), FK(Universe.slug), nullable=False)
     universe = relationship(Universe, backref="characters")
+    blob_id = db.Column(db.String(64), db.ForeignKey(Blob.digest))
+    blob = db.relationship(Blob, lazy="joined")
 
     def __init__(self, universe, name):
         self.universe = universe
@@ -172,19 +593,22 @@ class Character(db.Model, FilenameMixin):
 
     def rename(self, name):
         self.name = name
-        fp = self.fp()
+        fp = self.own_fp()
         self.slug = slugify(name)
 
         if fp.exists():
-            fp.moveTo(self.fp())
+            fp.moveTo(self.own_fp())
 
 
-class Comic(db.Model, FilenameMixin):
+class Comic(db.Model, FilenameMixin, MarkupMixin):
     """
     A comic.
     """
 
     __tablename__ = "comics"
+    __table_args__ = (
+        db.Index("comics_universe_position", "universe_fk", "position"),
+    )
 
     # Serial number, for simple PK.
     id = db.Column(db.Integer, primary_key=True, unique=True, nullable=False)
@@ -196,14 +620,21 @@ class Comic(db.Model, FilenameMixin):
     position = db.Column(db.Integer, nullable=False)
     # Title of the comic.
     title = db.Column(db.Unicode(80), nullable=False)
+    # Slug of the title, for URLs.
+    slug = db.Column(db.String(255))
     # Description/alt text.
     description = db.Column(db.UnicodeText(1024 * 1024))
     # Commentary.
     comment = db.Column(db.UnicodeText(1024 * 1024))
+    # Rendered commentary, and the grammar version which rendered it.
+    comment_html = db.Column(db.UnicodeText(1024 * 1024))
+    grammar = db.Column(db.Integer)
     # The discussion thread.
     threadid = db.Column(db.Integer, FK(Thread.id))
     # The universe in which this comic occurs.
     universe_fk = db.Column(db.String(85), FK(Universe.slug), nullable=False)
+    # The stored image.
+    blob_id = db.Column(db.String(64), db.ForeignKey(Blob.digest))
 
     # List of characters in this comic.
     characters = relationship(Character, secondary=casts, backref="comics")
@@ -211,6 +642,10 @@ class Comic(db.Model, FilenameMixin):
     thread = relationship(Thread, backref="comic", uselist=False)
     # The universe which owns this comic.
     universe = relationship(Universe, backref="comics")
+    # The stored image.
+    blob = db.relationship(Blob, lazy="joined")
+
+    markup = {"comment": ("comment_html", paragraphs)}
 
     def __init__(self, universe, filename):
         self.universe = universe
@@ -224,6 +659,10 @@ class Comic(db.Model, FilenameMixin):
     def __repr__(self):
         return "<Comic(%r) in %r>" % (self.filename, self.universe)
 
+    def rename(self, title):
+        self.title = title
+        self.slug = slugify(title)
+
     def __json__(self):
         d = {
             "comment": self.comment,
@@ -244,7 +683,7 @@ class Comic(db.Model, FilenameMixin):
         Assert that this comic will not destroy any pre-existing comic.
         """
 
-        if self.fp().exists():
+        if self.own_fp().exists():
             raise Exception("File already exists!")
 
     def insert(self, prior, after=False):
@@ -252,6 +691,10 @@ class Comic(db.Model, FilenameMixin):
         Move this comic to come just after another comic in the timeline.
 
         If after is True, move this comic to just *before* another comic.
+
+        Only this comic's position is changed, unless there is no room left
+        between its new neighbors, in which case the entire universe is
+        respaced first.
         """
 
         if not prior:
@@ -266,24 +709,227 @@ class Comic(db.Model, FilenameMixin):
                 "Comic.insert called with differing universes %r and %r" %
                 (self.universe, prior.universe))
 
+        # Don't let this comic get flushed with a half-finished position.
+        with db.session.no_autoflush:
+            position = position_between(*self.bounds(prior, after))
+            if position is None:
+                Comic.respace(self.universe)
+                position = position_between(*self.bounds(prior, after))
+
+        self.position = position
+        db.session.add(self)
+
+    def bounds(self, prior, after=False):
+        """
+        Find the positions between which this comic would be inserted.
+
+        Either bound may be None, if there is no comic on that side.
+        """
+
+        q = Comic.query.filter(Comic.universe == self.universe)
+        q = q.filter(Comic.id != prior.id)
+        if self.id is not None:
+            q = q.filter(Comic.id != self.id)
+
+        # Comics sharing the reference comic's position are neighbors too,
+        # and leave no room at all.
         if after:
-            position = max(prior.position - 1, 0)
+            q = q.filter(Comic.position <= prior.position)
+            neighbor = q.order_by(Comic.position.desc()).first()
+            lower, upper = None, prior.position
+            if neighbor:
+                lower = neighbor.position
         else:
-            position = prior.position + 1
+            q = q.filter(Comic.position >= prior.position)
+            neighbor = q.order_by(Comic.position).first()
+            lower, upper = prior.position, None
+            if neighbor:
+                upper = neighbor.position
 
-        q = Comic.query.filter(Comic.universe == self.universe)
-        q = q.filter(Comic.position >= position).order_by(Comic.position)
+        return lower, upper
 
-        for i, comic in enumerate(q):
-            # The correct new position. The +1 offset is because this current
-            # comic is shifting the old comics up.
-            target = i + position + 1
-            if comic.position != target:
-                comic.position = target
-                db.session.add(comic)
+    @staticmethod
+    def respace(universe):
+        """
+        Spread out the positions of every comic in a universe evenly, without
+        changing their order.
+        """
 
-        self.position = position
-        db.session.add(self)
+        q = db.session.query(Comic.id).filter(Comic.universe == universe)
+        ids = [cid for cid, in q.order_by(Comic.position, Comic.id)]
+        Comic.renumber((cid, i * POSITION_GAP) for i, cid in enumerate(ids))
+
+    @staticmethod
+    def renumber(positions):
+        """
+        Set the positions of some comics, given (id, position) pairs, with a
+        single UPDATE.
+        """
+
+        table = Comic.__table__
+        stmt = table.update().where(table.c.id == db.bindparam("cid"))
+        stmt = stmt.values(position=db.bindparam("new_position"))
+        params = [{"cid": cid, "new_position": position}
+                  for cid, position in positions]
+        if params:
+            db.session.execute(stmt, params)
+
+        # The update went around the ORM, so forget any loaded positions.
+        for obj in db.session.identity_map.values():
+            if isinstance(obj, Comic):
+                db.session.expire(obj, ["position"])
+
+    @staticmethod
+    def reorder(universe, ids):
+        """
+        Put every comic in a universe into the given order, given all of
+        their IDs.
+        """
+
+        q = db.session.query(Comic.id).filter(Comic.universe == universe)
+        if len(set(ids)) != len(ids) or set(ids) != set(cid for cid, in q):
+            raise ValueError("Every comic must be listed exactly once")
+
+        Comic.renumber((cid, i * POSITION_GAP) for i, cid in enumerate(ids))
+
+    @staticmethod
+    def move(universe, ids, prior=None):
+        """
+        Move some comics, in the given order, to come just after another
+        comic in the timeline, or at the start if `prior` is None.
+
+        The moved comics are spread out between their new neighbors. If
+        there isn't room, the comics after them are renumbered too, but only
+        as many as it takes to make room, so the work is proportional to
+        the size of the move rather than of the universe. Returns the number
+        of comics which were renumbered.
+        """
+
+        ids = list(ids)
+        moving = set(ids)
+        if not ids or len(moving) != len(ids):
+            raise ValueError("Comics must be listed exactly once")
+
+        q = db.session.query(db.func.count(Comic.id))
+        q = q.filter(Comic.universe == universe, Comic.id.in_(moving))
+        if q.scalar() != len(ids):
+            raise ValueError("Every comic must be in %s" % universe.title)
+
+        if prior is not None:
+            if prior.universe != universe:
+                raise ValueError("%r isn't in %s" % (prior, universe.title))
+            if prior.id in moving:
+                raise ValueError("Can't move comics after one of themselves")
+
+        # The comics which stay put, after the insertion point.
+        q = db.session.query(Comic.id, Comic.position)
+        q = q.filter(Comic.universe == universe, ~Comic.id.in_(moving))
+        if prior is None:
+            lower = None
+        else:
+            lower = prior.position
+            q = q.filter(db.or_(Comic.position > lower,
+                                db.and_(Comic.position == lower,
+                                        Comic.id > prior.id)))
+        q = q.order_by(Comic.position, Comic.id)
+
+        # Walk along the following comics until there's room for the moved
+        # comics and every following comic walked past, fetching them in
+        # growing pages.
+        following = []
+        upper = None
+        size = max(len(ids), 16)
+        while True:
+            page = q.offset(len(following)).limit(size).all()
+            for cid, position in page:
+                count = len(ids) + len(following)
+                if lower is None or position - lower > count:
+                    upper = position
+                    break
+                following.append(cid)
+            if upper is not None or len(page) < size:
+                break
+            size *= 2
+
+        renumbered = ids + following
+        if upper is None:
+            step = POSITION_GAP
+            start = -step if lower is None else lower
+        elif lower is None:
+            step = POSITION_GAP
+            start = upper - step * (len(renumbered) + 1)
+        else:
+            start = lower
+            step = min(POSITION_GAP, (upper - lower) // (len(renumbered) + 1))
+
+        positions = [start + step * (i + 1) for i in range(len(renumbered))]
+        Comic.renumber(zip(renumbered, positions))
+
+        # Nothing else should have landed between the new neighbors.
+        q = db.session.query(db.func.count(Comic.id))
+        q = q.filter(Comic.universe == universe,
+                     Comic.position.between(positions[0], positions[-1]))
+        if q.scalar() != len(positions):
+            raise ValueError("Comics would share positions")
+
+        return len(renumbered)
+
+
+class Appearance(db.Model):
+    """
+    A character's appearance in a comic.
+
+    This is a denormalized copy of the casts table which numbers each of a
+    character's appearances in timeline order. A character's neighboring
+    appearances are the rows with adjacent ordinals. Call reindex() whenever
+    a comic's cast or position changes.
+
+    Which appearances have gone live isn't stored here; timelines check the
+    comics' own times, which they load anyway.
+    """
+
+    __tablename__ = "appearances"
+    __table_args__ = (
+        db.Index("appearances_character_ordinal", "character_id", "ordinal"),
+    )
+
+    character_id = db.Column(db.String(45), FK(Character.slug),
+                             primary_key=True)
+    comic_id = db.Column(db.Integer, FK(Comic.id), primary_key=True,
+                         index=True)
+    # Index of this appearance among all of the character's appearances.
+    ordinal = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return "<Appearance(%r, %r, %d)>" % (self.character_id, self.comic_id,
+                                            self.ordinal)
+
+    @staticmethod
+    def reindex(slugs):
+        """
+        Rebuild the appearances of some characters.
+
+        Pending changes are flushed first, so that this can be called just
+        before committing.
+        """
+
+        db.session.flush()
+
+        table = Appearance.__table__
+
+        for slug in set(slugs):
+            db.session.execute(table.delete().where(
+                table.c.character_id == slug))
+
+            q = db.session.query(Comic.id)
+            q = q.join(casts, casts.c.comic_id == Comic.id)
+            q = q.filter(casts.c.character_id == slug)
+            q = q.order_by(Comic.position, Comic.id)
+
+            rows = [{"character_id": slug, "comic_id": cid, "ordinal": i}
+                    for i, (cid,) in enumerate(q)]
+            if rows:
+                db.session.execute(table.insert(), rows)
 
 
 class Portrait(db.Model, FilenameMixin):
@@ -292,6 +938,8 @@ class Portrait(db.Model, FilenameMixin):
 
     name = db.Column(db.String(40))
     slug = db.Column(db.String(45), primary_key=True)
+    blob_id = db.Column(db.String(64), db.ForeignKey(Blob.digest))
+    blob = db.relationship(Blob, lazy="joined")
 
     def __init__(self, name):
         self.rename(name)
@@ -310,34 +958,65 @@ class Portrait(db.Model, FilenameMixin):
 
     def rename(self, name):
         self.name = name
-        fp = self.fp()
+        fp = self.own_fp()
         self.slug = slugify(name)
 
         if fp.exists():
-            fp.moveTo(self.fp())
+            fp.moveTo(self.own_fp())
 
     def update_portrait(self, fs):
-        image = Image.open(fs)
-        image.thumbnail((250, 250), Image.ANTIALIAS)
-        image.save(self.fp().path)
+        blob = Blob.store(fs)
+        if blob is not None:
+            self.blob = blob
+        return blob
 
 
-class Newspost(db.Model):
+class Newspost(db.Model, MarkupMixin):
 
     __tablename__ = "newsposts"
 
     time = db.Column(db.DateTime, primary_key=True)
     title = db.Column(db.Unicode(80), nullable=False)
     content = db.Column(db.UnicodeText(1024 * 1024))
+    content_html = db.Column(db.UnicodeText(1024 * 1024))
+    grammar = db.Column(db.Integer)
 
     # Reference to the attached portrait.
     portrait_id = db.Column(db.String(45), FK(Portrait.slug), nullable=False)
     portrait = relationship(Portrait, backref="newsposts")
 
+    markup = {"content": ("content_html", paragraphs)}
+
     def __init__(self, title, content=u""):
         self.time = datetime.utcnow()
         self.title = title
         self.content = content
+        self.render()
+
+
+def rerender(batch=100):
+    """
+    Re-render all of the markup which was rendered by another version of the
+    grammar, or never rendered at all.
+
+    Rows are committed in batches, so that this can run in the background
+    while the site is up. Returns the number of rows rendered.
+    """
+
+    count = 0
+
+    for model in Comic, Newspost, Post:
+        stale = db.or_(model.grammar.is_(None), model.grammar != VERSION)
+        while True:
+            rows = model.query.filter(stale).limit(batch).all()
+            if not rows:
+                break
+            for row in rows:
+                row.render()
+            db.session.commit()
+            count += len(rows)
+
+    return count
 
 
 class User(db.Model):
@@ -347,30 +1026,53 @@ class User(db.Model):
     username = db.Column(db.Unicode(30), primary_key=True, unique=True,
                          nullable=False)
     password = db.Column(db.String(256))
-    logged_in = db.Column(db.Boolean, default=False)
 
-    def __init__(self, username, password):
+    def __init__(self, username, password=None):
         self.username = username
-        self.password = generate_password_hash(password)
+        if password is not None:
+            self.password = generate_password_hash(password)
 
     def __repr__(self):
         return "<User(%r)>" % self.username
 
+    @property
+    def cache_key(self):
+        return "user:%s" % self.username
+
     def check_password(self, password):
-        return check_password_hash(self.password, password)
+        # Hashes come back from some databases as unicode, which hashlib
+        # won't take as the name of a hash function.
+        return check_password_hash(str(self.password), password)
 
-    def login(self):
-        self.logged_in = True
-        db.session.add(self)
-        db.session.commit()
+    def set_password(self, password):
+        """
+        Change this user's password, which signs them out everywhere once
+        it is committed and forget() is called.
+        """
 
-    def logout(self):
-        self.logged_in = False
-        db.session.add(self)
-        db.session.commit()
+        self.password = generate_password_hash(password)
+
+    def forget(self):
+        """
+        Throw out this user's cached signature.
+
+        Call this after committing a new password, lest a request in the
+        meantime cache the old one again.
+        """
+
+        cache.invalidate(self.cache_key)
+
+    def signature(self):
+        """
+        Sign this user's name and password hash with the site's secret key.
+        """
+
+        return make_secure_token(self.username, self.password)
 
     def is_authenticated(self):
-        return self.logged_in
+        # Users are only ever loaded from a signed session or remember
+        # cookie, so any user there is has logged in.
+        return True
 
     def is_active(self):
         return True
@@ -379,12 +1081,51 @@ class User(db.Model):
         return False
 
     def get_id(self):
-        return self.username
+        """
+        Make the token which sessions and remember cookies keep: the
+        username and its signature.
 
-    def get_auth_token(self):
-        return make_secure_token(self.username, self.password)
+        The token stops working once the password changes, so changing it
+        signs the user out of every other session and remember cookie.
+        Logging out only forgets the token in that browser; a copy of it
+        keeps working until the password changes.
+        """
+
+        return u"%s|%s" % (self.username, self.signature())
+
+    get_auth_token = get_id
 
 
 @lm.user_loader
-def user_loader(username):
-    return User.query.filter_by(username=username).first()
+@lm.token_loader
+def load_user(token):
+    """
+    Load the user for a session or remember cookie's token, or None if it
+    isn't valid.
+
+    The signature of each user is cached, rather than the user, so that
+    requests from logged-in readers don't touch the database just to find
+    out who they are, and password hashes stay out of the cache. Cached
+    users are merged into the session without querying.
+    """
+
+    username, bar, signature = token.rpartition(u"|")
+    if not bar:
+        return None
+
+    user = User(username)
+    expected = cache.get(user.cache_key)
+    if expected is None:
+        versions = cache.versions([user.cache_key])
+        user = User.query.filter_by(username=username).first()
+        if user is None:
+            return None
+        expected = user.signature()
+        cache.set(user.cache_key, expected, USER_TTL, versions)
+    else:
+        make_transient_to_detached(user)
+        user = db.session.merge(user, load=False)
+
+    if not safe_str_cmp(signature.encode("utf-8"), expected):
+        return None
+    return user
@@ -0,0 +1,208 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+from contextlib import contextmanager
+import heapq
+from threading import Lock, local
+from time import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from flask import current_app, g, has_request_context, request
+
+
+class Statements(object):
+    """
+    A tally of SQL statements.
+
+    Only the `keep` slowest statements are kept; if `keep` is None, every
+    statement is kept.
+    """
+
+    def __init__(self, keep=None):
+        self.keep = keep
+        self.count = 0
+        self.seconds = 0.0
+        self._statements = []
+
+    def add(self, statement, seconds):
+        self.count += 1
+        self.seconds += seconds
+        if self.keep is None:
+            self._statements.append((seconds, statement))
+        elif len(self._statements) < self.keep:
+            heapq.heappush(self._statements, (seconds, statement))
+        else:
+            heapq.heappushpop(self._statements, (seconds, statement))
+
+    def slowest(self):
+        """
+        Get the kept statements as (seconds, statement) pairs, slowest first.
+        """
+
+        return sorted(self._statements, reverse=True)
+
+    def __iter__(self):
+        return iter(statement for seconds, statement in self._statements)
+
+
+class Recorder(object):
+    """
+    Records the SQL statements which each request runs, through SQLAlchemy's
+    engine events.
+
+    Each request's statements are tallied on `g`, and then added to running
+    totals for its view, alongside the slowest statements seen so far. If the
+    DCON_SERVER_TIMING setting is on, responses say how long they spent in
+    the database with a Server-Timing header, and requests which spent
+    longer than DCON_SLOW_SQL seconds there are logged.
+    """
+
+    def __init__(self, keep=10):
+        self.keep = keep
+        self.reset()
+        self._listening = False
+        # Where each request's tally is kept on g.
+        self._key = "statements-%x" % id(self)
+        # Where each statement's start time is kept on its context.
+        self._started = "started-%x" % id(self)
+        self._local = local()
+        self._lock = Lock()
+
+    def reset(self):
+        """
+        Forget all of the running totals.
+        """
+
+        # Endpoints to [requests, statements, seconds].
+        self.views = {}
+        # (seconds, statement, endpoint), as a heap.
+        self.statements = []
+
+    def init_app(self, app):
+        self.listen()
+        app.before_request(self.start)
+        app.after_request(self.finish)
+
+    def listen(self):
+        if not self._listening:
+            event.listen(Engine, "before_cursor_execute", self.before)
+            event.listen(Engine, "after_cursor_execute", self.after)
+            event.listen(Engine, "handle_error", self.failed)
+            self._listening = True
+
+    def tallies(self):
+        """
+        Get every tally which the statement being run should be added to.
+        """
+
+        tallies = list(getattr(self._local, "captures", ()))
+        if has_request_context():
+            tally = g.get(self._key)
+            if tally is not None:
+                tallies.append(tally)
+        return tallies
+
+    def before(self, conn, cursor, statement, parameters, context,
+               executemany):
+        # The start time is kept on the statement's own context, rather than
+        # on its connection, so that failed statements leave nothing behind.
+        if context is not None:
+            setattr(context, self._started, time())
+
+    def after(self, conn, cursor, statement, parameters, context,
+              executemany):
+        started = getattr(context, self._started, None)
+        self.add(statement, 0.0 if started is None else time() - started)
+
+    def failed(self, exception_context):
+        # Failed statements still ran, as far as budgets are concerned; but
+        # errors from before a statement was started aren't statements.
+        started = getattr(exception_context.execution_context, self._started,
+                          None)
+        if started is not None:
+            self.add(exception_context.statement, time() - started)
+
+    def add(self, statement, seconds):
+        for tally in self.tallies():
+            tally.add(statement, seconds)
+
+    def start(self):
+        setattr(g, self._key, Statements(self.keep))
+
+    def finish(self, response):
+        tally = g.pop(self._key, None)
+        if tally is None:
+            return response
+
+        endpoint = request.endpoint
+        with self._lock:
+            totals = self.views.setdefault(endpoint, [0, 0, 0.0])
+            totals[0] += 1
+            totals[1] += tally.count
+            totals[2] += tally.seconds
+
+            for seconds, statement in tally.slowest():
+                entry = seconds, statement, endpoint
+                if len(self.statements) < self.keep:
+                    heapq.heappush(self.statements, entry)
+                else:
+                    heapq.heappushpop(self.statements, entry)
+
+        config = current_app.config
+        if config.get("DCON_SERVER_TIMING"):
+            response.headers.add("Server-Timing",
+                                 'db;dur=%.1f;desc="%d queries"'
+                                 % (tally.seconds * 1000, tally.count))
+
+        slow = config.get("DCON_SLOW_SQL")
+        if slow is not None and tally.seconds > slow:
+            seconds, statement = tally.slowest()[0]
+            current_app.logger.warning(
+                "%s ran %d queries in %.1fms; the slowest took %.1fms: %s",
+                endpoint, tally.count, tally.seconds * 1000, seconds * 1000,
+                statement)
+
+        return response
+
+    @contextmanager
+    def capture(self):
+        """
+        Tally every statement run by this thread within a block, whether or
+        not it is part of a request.
+        """
+
+        self.listen()
+        tally = Statements()
+        captures = self._local.__dict__.setdefault("captures", [])
+        captures.append(tally)
+        try:
+            yield tally
+        finally:
+            captures.remove(tally)
+
+    def stats(self):
+        """
+        Get the running totals for each view, as (endpoint, requests,
+        statements, seconds) tuples, and the slowest statements, as (seconds,
+        statement, endpoint) tuples, slowest first.
+        """
+
+        with self._lock:
+            views = [(endpoint,) + tuple(totals)
+                     for endpoint, totals in sorted(self.views.iteritems())]
+            return views, sorted(self.statements, reverse=True)
+
+
+recorder = Recorder()
@@ -0,0 +1,123 @@
+// Copyright 2014 Google Inc. All rights reserved.
+//
+// Licensed under the Apache License, Version 2.0 (the "License"); you may not
+// use this file except in compliance with the License.  You may obtain a copy
+// of the License at
+//
+//     http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+// WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+// License for the specific language governing permissions and limitations under
+// the License.
+
+// Pickers are selects which only hold their chosen options. This adds a
+// search box to each of them, which fetches pages of matching options from
+// the picker's search URL; picking a result adds it to the select.
+
+(function () {
+    "use strict";
+
+    var DELAY = 250;
+
+    function setup(span) {
+        var select = span.getElementsByTagName("select")[0];
+        var url = span.getAttribute("data-url");
+        var input = document.createElement("input");
+        var list = document.createElement("ul");
+        var more = document.createElement("button");
+        var term = "";
+        var page = 1;
+        var timer = null;
+
+        input.type = "search";
+        input.placeholder = "Search";
+        more.type = "button";
+        more.appendChild(document.createTextNode("More"));
+        more.style.display = "none";
+        span.appendChild(input);
+        span.appendChild(list);
+        span.appendChild(more);
+
+        function pick(result) {
+            var options = select.options;
+            var i;
+
+            if (!select.multiple) {
+                for (i = 0; i < options.length; i++) {
+                    options[i].selected = false;
+                }
+            }
+            for (i = 0; i < options.length; i++) {
+                if (options[i].value === String(result.id)) {
+                    options[i].selected = true;
+                    return;
+                }
+            }
+
+            var option = document.createElement("option");
+            option.value = result.id;
+            option.appendChild(document.createTextNode(result.label));
+            option.selected = true;
+            select.appendChild(option);
+        }
+
+        function show(results) {
+            results.forEach(function (result) {
+                var item = document.createElement("li");
+                var link = document.createElement("a");
+                link.href = "#";
+                link.appendChild(document.createTextNode(result.label));
+                link.addEventListener("click", function (event) {
+                    event.preventDefault();
+                    pick(result);
+                });
+                item.appendChild(link);
+                list.appendChild(item);
+            });
+        }
+
+        function fetch() {
+            var request = new XMLHttpRequest();
+            var wanted = term;
+            request.open("GET", url + "?q=" + encodeURIComponent(term) +
+                         "&page=" + page);
+            request.onload = function () {
+                // Drop answers to searches which have since changed.
+                if (request.status !== 200 || wanted !== term) {
+                    return;
+                }
+                var data = JSON.parse(request.responseText);
+                show(data.results);
+                more.style.display = data.more ? "" : "none";
+            };
+            request.send();
+        }
+
+        input.addEventListener("input", function () {
+            clearTimeout(timer);
+            timer = setTimeout(function () {
+                term = input.value;
+                page = 1;
+                list.innerHTML = "";
+                more.style.display = "none";
+                if (term) {
+                    fetch();
+                }
+            }, DELAY);
+        });
+
+        more.addEventListener("click", function () {
+            page += 1;
+            fetch();
+        });
+    }
+
+    document.addEventListener("DOMContentLoaded", function () {
+        var spans = document.querySelectorAll("span.picker");
+        for (var i = 0; i < spans.length; i++) {
+            setup(spans[i]);
+        }
+    });
+}());
@@ -0,0 +1,171 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+from base64 import b64encode
+import json
+
+from newrem.models import db, Appearance, Comic
+from newrem.test.test_profiling import ADMIN, ViewTestCase
+
+
+class AdminTestCase(ViewTestCase):
+    """
+    Run requests against the admin views, as the administrator.
+    """
+
+    def setUp(self):
+        super(AdminTestCase, self).setUp()
+        credentials = b64encode("%s:%s" % ADMIN)
+        self.headers = {"Authorization": "Basic " + credentials}
+
+    def get_json(self, path):
+        response = self.client.get(path, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.data)
+
+
+class TestSearch(AdminTestCase):
+
+    def labels(self, path):
+        return [result["label"] for result in self.get_json(path)["results"]]
+
+    def test_comics(self):
+        labels = self.labels("/admin/testing/search/comics?q=comic+3")
+        self.assertEqual(len(labels), 1)
+        self.assertTrue('"Comic 3"' in labels[0])
+
+    def test_comic_position(self):
+        comic = Comic.query.get(4)
+        data = self.get_json("/admin/testing/search/comics?q=%d"
+                             % comic.position)
+        self.assertTrue(4 in [result["id"] for result in data["results"]])
+
+    def test_pages(self):
+        data = self.get_json("/admin/testing/search/comics?q=comic")
+        self.assertFalse(data["more"])
+        self.assertEqual(len(data["results"]), 10)
+
+    def test_wildcards(self):
+        comic = Comic.query.get(4)
+        comic.rename(u"50% off")
+        db.session.commit()
+
+        labels = self.labels("/admin/testing/search/comics?q=%25")
+        self.assertEqual(len(labels), 1)
+        self.assertTrue("50% off" in labels[0])
+        self.assertEqual(self.labels("/admin/testing/search/comics?q=_"), [])
+        self.assertEqual(
+            self.labels("/admin/testing/search/characters?q=%25"), [])
+
+    def test_characters(self):
+        data = self.get_json("/admin/testing/search/characters?q=ali")
+        self.assertEqual(data["results"], [{"id": "alice", "label": "Alice"}])
+
+    def test_unauthorized(self):
+        response = self.client.get("/admin/testing/search/comics")
+        self.assertEqual(response.status_code, 401)
+
+
+class TestMoveComics(AdminTestCase):
+
+    def order(self):
+        db.session.expire_all()
+        q = db.session.query(Comic.id).order_by(Comic.position, Comic.id)
+        return [cid for cid, in q]
+
+    def post_json(self, path, data):
+        response = self.client.post(path, data=json.dumps(data),
+                                    content_type="application/json",
+                                    headers=self.headers)
+        return response.status_code, json.loads(response.data)
+
+    def move(self, data):
+        return self.post_json("/admin/testing/comics/move", data)
+
+    def test_ids(self):
+        status, data = self.move({"ids": [3, 2], "after": 7})
+        self.assertEqual(status, 200)
+        self.assertEqual(data["moved"], 2)
+        self.assertEqual(self.order(), [1, 4, 5, 6, 7, 3, 2, 8, 9, 10])
+
+    def test_range(self):
+        status, data = self.move({"first": 2, "last": 4, "after": 9})
+        self.assertEqual(status, 200)
+        self.assertEqual(data["moved"], 3)
+        self.assertEqual(self.order(), [1, 5, 6, 7, 8, 9, 2, 3, 4, 10])
+
+        q = Appearance.query.filter_by(character_id="alice")
+        ids = [a.comic_id for a in q.order_by(Appearance.ordinal)]
+        self.assertEqual(ids, self.order())
+
+    def test_start(self):
+        status, data = self.move({"first": 9, "last": 10, "after": -1})
+        self.assertEqual(status, 200)
+        self.assertEqual(self.order(), [9, 10, 1, 2, 3, 4, 5, 6, 7, 8])
+
+    def test_errors(self):
+        for body in ({"ids": [2]},
+                     {"after": 5},
+                     {"first": 2, "after": 5},
+                     {"first": 4, "last": 2, "after": 9},
+                     {"first": 2, "last": 42, "after": 9},
+                     {"ids": [2], "after": 42},
+                     {"ids": ["two"], "after": 5},
+                     [2, 3]):
+            status, data = self.move(body)
+            self.assertEqual(status, 400, body)
+            self.assertTrue(data["error"], body)
+        self.assertEqual(self.order(), range(1, 11))
+
+    def test_form_body(self):
+        # Only JSON is accepted, so that other sites can't post forms here.
+        response = self.client.post("/admin/testing/comics/move",
+                                    data={"ids": "2", "after": "5"},
+                                    headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.order(), range(1, 11))
+
+    def test_reorder(self):
+        ids = range(10, 0, -1)
+        status, data = self.post_json("/admin/testing/comics/reorder",
+                                      {"ids": ids})
+        self.assertEqual(status, 200)
+        self.assertEqual(data["moved"], 10)
+        self.assertEqual(self.order(), ids)
+
+    def test_reorder_errors(self):
+        for body in ({"ids": [2, 1]}, {"ids": range(1, 12)}, {}, None):
+            status, data = self.post_json("/admin/testing/comics/reorder",
+                                          body)
+            self.assertEqual(status, 400, body)
+        response = self.client.post("/admin/testing/comics/reorder",
+                                    data={"ids": "1"}, headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.order(), range(1, 11))
+
+    def test_form(self):
+        response = self.client.post("/admin/testing/comics",
+                                    data={"first": "2", "last": "3",
+                                          "after": "5"},
+                                    headers=self.headers)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.order(), [1, 4, 5, 2, 3, 6, 7, 8, 9, 10])
+
+    def test_form_error(self):
+        response = self.client.post("/admin/testing/comics",
+                                    data={"first": "3", "last": "2",
+                                          "after": "5"},
+                                    headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue("comes after the last one" in response.data)
+        self.assertEqual(self.order(), range(1, 11))
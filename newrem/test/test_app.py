@@ -0,0 +1,59 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from bp.filepath import FilePath
+
+from newrem.app import DCoN
+
+
+class TestResolveStatic(TestCase):
+
+    def setUp(self):
+        self.app = DCoN(__name__, static_folder=None)
+        self.first = FilePath(mkdtemp())
+        self.second = FilePath(mkdtemp())
+        self.app.static_paths = [self.first.path, self.second.path]
+        self.second.child("test.css").setContent("second")
+
+    def test_resolve(self):
+        path = self.app.resolve_static("test.css")
+        self.assertEqual(path, self.second.child("test.css").path)
+
+    def test_resolve_first(self):
+        self.first.child("test.css").setContent("first")
+        path = self.app.resolve_static("test.css")
+        self.assertEqual(path, self.first.child("test.css").path)
+
+    def test_miss(self):
+        self.assertEqual(self.app.resolve_static("missing.css"), None)
+
+    def test_miss_cached(self):
+        self.app.resolve_static("new.css")
+        self.first.child("new.css").setContent("new")
+        self.assertEqual(self.app.resolve_static("new.css"), None)
+
+    def test_miss_refreshed(self):
+        self.app.static_interval = 0
+        self.app.resolve_static("new.css")
+        self.first.child("new.css").setContent("new")
+        path = self.app.resolve_static("new.css")
+        self.assertEqual(path, self.first.child("new.css").path)
+
+    def test_send(self):
+        with self.app.test_request_context():
+            response = self.app.send_static_file("test.css")
+            response.direct_passthrough = False
+            self.assertEqual(response.get_data(), "second")
@@ -0,0 +1,127 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+import os.path
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from newrem.cache import (Cache, MemoryBackend, SQLiteBackend, next_version,
+                          tags_for)
+
+
+class CacheTests(object):
+    """
+    Tests which every cache backend should pass.
+    """
+
+    def test_miss(self):
+        self.assertEqual(self.cache.get("test"), None)
+        self.assertEqual(self.cache.misses, 1)
+
+    def test_hit(self):
+        self.cache.set("test", "value")
+        self.assertEqual(self.cache.get("test"), "value")
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_ttl(self):
+        self.cache.set("test", "value", ttl=-1)
+        self.assertEqual(self.cache.get("test"), None)
+
+    def test_invalidate(self):
+        self.cache.set("test", "value", tags=["a", "b"])
+        self.cache.invalidate("b")
+        self.assertEqual(self.cache.get("test"), None)
+
+    def test_invalidate_other(self):
+        self.cache.set("test", "value", tags=["a"])
+        self.cache.invalidate("b")
+        self.assertEqual(self.cache.get("test"), "value")
+
+    def test_invalidate_during_set(self):
+        versions = self.cache.versions(["a"])
+        self.cache.invalidate("a")
+        self.cache.set("test", "value", tags=versions)
+        self.assertEqual(self.cache.get("test"), None)
+
+    def test_modified(self):
+        self.assertEqual(self.cache.modified(["a"]), None)
+        self.cache.invalidate("a")
+        self.assertTrue(self.cache.modified(["a", "b"]) > 0)
+
+    def test_modified_epoch(self):
+        self.cache.invalidate("a")
+        self.assertTrue(self.cache.modified(["a"]) >= self.cache.epoch)
+
+    def test_versions_increase(self):
+        self.cache.invalidate("a")
+        first = self.cache.versions(["a"])["a"]
+        self.cache.invalidate("a")
+        self.assertTrue(self.cache.versions(["a"])["a"] > first)
+
+    def test_size(self):
+        for i in range(5):
+            self.cache.set(str(i), i)
+        self.assertEqual(self.cache.stats()["entries"], 3)
+        self.assertEqual(self.cache.get("0"), None)
+        self.assertEqual(self.cache.get("4"), 4)
+
+
+class TestMemoryBackend(CacheTests, TestCase):
+
+    def setUp(self):
+        self.cache = Cache(MemoryBackend(3))
+
+    def test_lru(self):
+        for i in range(3):
+            self.cache.set(str(i), i)
+        self.cache.get("0")
+        self.cache.set("3", 3)
+        self.assertEqual(self.cache.get("0"), 0)
+        self.assertEqual(self.cache.get("1"), None)
+
+
+class TestSQLiteBackend(CacheTests, TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(mkdtemp(), "cache.db")
+        self.cache = Cache(SQLiteBackend(self.path, 3))
+
+    def test_shared(self):
+        other = Cache(SQLiteBackend(self.path, 3))
+        self.cache.set("test", "value", tags=["a"])
+        self.assertEqual(other.get("test"), "value")
+        other.invalidate("a")
+        self.assertEqual(self.cache.get("test"), None)
+
+    def test_shared_epoch(self):
+        other = Cache(SQLiteBackend(self.path, 3))
+        self.assertEqual(other.epoch, self.cache.epoch)
+
+
+class TestTagsFor(TestCase):
+
+    def test_universe(self):
+        self.assertEqual(tags_for("test"), ["site", "universe:test"])
+
+    def test_global(self):
+        self.assertEqual(tags_for(None), ["site", "global"])
+
+
+class TestNextVersion(TestCase):
+
+    def test_time(self):
+        self.assertTrue(next_version(0) > 1)
+
+    def test_increase(self):
+        future = next_version(0) * 2
+        self.assertEqual(next_version(future), future + 1)
@@ -0,0 +1,218 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+from StringIO import StringIO
+import re
+
+from newrem.cache import board_tag, cache
+from newrem.chan import list_posts, list_threads, preview_posts
+from newrem.derivatives import pipeline
+from newrem.models import db, Board, Post, Thread
+from newrem.profiling import recorder
+from newrem.test.test_derivatives import make_image
+from newrem.test.test_models import ComicTestCase
+from newrem.test.test_profiling import ViewTestCase
+
+
+class ChanTestCase(ComicTestCase):
+
+    def setUp(self):
+        super(ChanTestCase, self).setUp()
+        self.board = Board("t", u"Test")
+        db.session.add(self.board)
+        self.threads = [self.make_thread(i + 1) for i in range(3)]
+
+    def make_thread(self, posts):
+        thread = Thread(self.board, u"Subject", u"Anonymous")
+        db.session.add(thread)
+        db.session.flush()
+        for i in range(posts):
+            self.reply(thread)
+        return thread
+
+    def reply(self, thread, comment=u"Test"):
+        post = Post(u"Anonymous", comment, "", None)
+        Thread.add(thread.id, post)
+        db.session.commit()
+        return post
+
+
+class TestListThreads(ChanTestCase):
+
+    def test_bumped(self):
+        self.reply(self.threads[0])
+        threads, before = list_threads(self.board)
+        self.assertEqual(threads,
+                         [self.threads[0], self.threads[2], self.threads[1]])
+        self.assertEqual(before, None)
+
+    def test_pages(self):
+        threads, before = list_threads(self.board, size=2)
+        self.assertEqual(len(threads), 2)
+        threads, before = list_threads(self.board, before, size=2)
+        self.assertEqual(threads, [self.threads[0]])
+        self.assertEqual(before, None)
+
+    def test_bad_cursor(self):
+        threads, before = list_threads(self.board, "test")
+        self.assertEqual(len(threads), 3)
+
+    def test_empty(self):
+        self.make_thread(0)
+        threads, before = list_threads(self.board)
+        self.assertEqual(len(threads), 3)
+
+
+class TestThreadSummary(ChanTestCase):
+
+    def test_replies(self):
+        self.assertEqual([thread.replies for thread in self.threads],
+                         [0, 1, 2])
+
+    def test_previews(self):
+        thread = self.make_thread(0)
+        self.reply(thread, u"First")
+        self.assertEqual(thread.op_preview, u"First")
+        self.assertEqual(thread.last_preview, None)
+        post = self.reply(thread, u"Second")
+        self.assertEqual(thread.last_preview, u"Second")
+        self.assertEqual(thread.bumped, post.timestamp)
+
+    def test_missing(self):
+        post = Post(u"Anonymous", u"Test", "", None)
+        self.assertFalse(Thread.add(42, post))
+
+    def test_bumped_last(self):
+        # Some databases assign columns in order, so bumped has to be
+        # assigned after the columns which check it.
+        post = Post(u"Anonymous", u"Test", "", None)
+        with recorder.capture() as tally:
+            Thread.add(self.threads[0].id, post)
+        update, = [statement for statement in tally
+                   if statement.startswith("UPDATE thread")]
+        columns = re.findall(r"(\w+)=", update.split(" WHERE ")[0])
+        self.assertEqual(columns[-1], "bumped")
+        self.assertEqual(len(columns), 6)
+
+    def test_summarize(self):
+        thread = self.threads[2]
+        expected = (thread.replies, thread.images, thread.bumped,
+                    thread.op_preview, thread.last_preview)
+        thread.replies = thread.bumped = None
+        thread.summarize()
+        self.assertEqual((thread.replies, thread.images, thread.bumped,
+                          thread.op_preview, thread.last_preview), expected)
+
+
+class TestPreviewPosts(ChanTestCase):
+
+    def test_preview(self):
+        thread = self.threads[2]
+        previews = preview_posts([thread.id], size=1)
+        posts = list_posts(thread.id)[0]
+        self.assertEqual(previews[thread.id], [posts[0], posts[-1]])
+
+    def test_short(self):
+        thread = self.threads[1]
+        previews = preview_posts([thread.id], size=5)
+        self.assertEqual(len(previews[thread.id]), 2)
+
+
+class TestListPosts(ChanTestCase):
+
+    def test_pages(self):
+        thread = self.threads[2]
+        posts, after = list_posts(thread.id, size=2)
+        self.assertEqual(len(posts), 2)
+        more, after = list_posts(thread.id, after, size=2)
+        self.assertEqual(len(more), 1)
+        self.assertTrue(more[0].id > posts[-1].id)
+        self.assertEqual(after, None)
+
+    def test_last(self):
+        thread = self.threads[2]
+        posts = list_posts(thread.id)[0]
+        self.assertEqual(list_posts(thread.id, last=2)[0], posts[1:])
+
+    def test_last_bounds(self):
+        thread = self.threads[2]
+        posts = list_posts(thread.id)[0]
+        for last in (-1, 0):
+            self.assertEqual(list_posts(thread.id, last=last)[0], posts[-1:])
+        self.assertEqual(len(list_posts(thread.id, last=100, size=2)[0]), 2)
+
+
+class TestAttachments(ViewTestCase):
+
+    def setUp(self):
+        super(TestAttachments, self).setUp()
+        self.processes = pipeline.processes
+        pipeline.processes = 0
+
+    def tearDown(self):
+        pipeline.processes = self.processes
+        super(TestAttachments, self).tearDown()
+
+    def test_thumbnail(self):
+        path = "/chan/t/%d" % self.thread.id
+        response = self.client.post(path + "/comment", data={
+            "name": "Anonymous",
+            "comment": "Look",
+            "datafile": (StringIO(make_image()), "test.png"),
+        })
+        self.assertEqual(response.status_code, 200)
+
+        post = Post.query.order_by(Post.id.desc()).first()
+        self.assertNotEqual(post.blob, None)
+        derivative = post.blob.derivatives["small"]
+        self.assertTrue(derivative.fp().exists())
+
+        response = self.client.get(path + "?last=1")
+        self.assertTrue(derivative.url() in response.data)
+
+    def test_revalidate(self):
+        # Pages show thumbnails once they're made, rather than staying as
+        # they were when the post was made.
+        path = "/chan/t/%d" % self.thread.id
+        etag = self.client.get(path).headers["ETag"]
+        cache.invalidate(board_tag("t"))
+        self.assertNotEqual(self.client.get(path).headers["ETag"], etag)
+
+    def test_no_file(self):
+        path = "/chan/t/%d" % self.thread.id
+        response = self.client.post(path + "/comment", data={
+            "name": "Anonymous",
+            "comment": "Nothing",
+            "datafile": (StringIO(""), ""),
+        })
+        self.assertEqual(response.status_code, 200)
+
+        post = Post.query.order_by(Post.id.desc()).first()
+        self.assertEqual(post.comment, u"Nothing")
+        self.assertEqual(post.blob, None)
+
+    def test_new_thread(self):
+        response = self.client.post("/chan/t/comment", data={
+            "name": "Anonymous",
+            "subject": "New",
+            "comment": "Look",
+            "email": "noko",
+            "datafile": (StringIO(make_image()), "test.png"),
+        })
+        self.assertEqual(response.status_code, 200)
+
+        thread = Thread.query.filter_by(subject=u"New").one()
+        self.assertTrue("/chan/t/%d" % thread.id in response.data)
+        post = Post.query.filter_by(threadid=thread.id).one()
+        self.assertEqual(sorted(post.blob.derivatives),
+                         ["large", "medium", "small"])
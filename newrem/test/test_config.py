@@ -0,0 +1,60 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from bp.filepath import FilePath
+import yaml
+
+from flask import Flask
+
+from newrem.cache import cache
+from newrem.config import load_config
+from newrem.derivatives import pipeline
+
+
+class TestLoadConfig(TestCase):
+
+    def setUp(self):
+        self.backend = cache.backend
+        self.processes = pipeline.processes
+        self.path = FilePath(mkdtemp())
+        root = self.path.child("newrem")
+        root.makedirs()
+        self.app = Flask(__name__, root_path=root.path)
+
+    def tearDown(self):
+        cache.backend = self.backend
+        pipeline.processes = self.processes
+
+    def load(self, **config):
+        config.update({
+            "database": "sqlite://",
+            "recaptcha_public": None,
+            "recaptcha_private": None,
+        })
+        self.path.child("dcon.yaml").setContent(yaml.dump(config))
+        load_config(self.app)
+
+    def test_memory_pages(self):
+        self.load(cache="memory")
+        self.assertFalse(self.app.config["DCON_CACHE_PAGES"])
+
+    def test_memory_pages_on(self):
+        self.load(cache="memory", cache_pages=True)
+        self.assertTrue(self.app.config["DCON_CACHE_PAGES"])
+
+    def test_shared_pages(self):
+        self.load(cache=self.path.child("cache.db").path)
+        self.assertTrue(self.app.config["DCON_CACHE_PAGES"])
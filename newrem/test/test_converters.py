@@ -14,10 +14,13 @@
 from datetime import datetime
 from unittest import TestCase
 
+from werkzeug.routing import ValidationError
+
 from flask import Flask
 
-from newrem.converters import make_model_converter
-from newrem.models import db, Newspost
+from newrem.cache import cache
+from newrem.converters import attach_models, make_model_converter
+from newrem.models import db, Newspost, Universe
 
 class TestNewspostConverter(TestCase):
 
@@ -60,3 +63,48 @@ class TestNewspostConverter(TestCase):
             # No direct equality check, but this is close enough.
             self.assertEqual(result.title, news.title)
             self.assertEqual(result.time, news.time)
+
+class TestUniverseConverter(TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        self.converter = make_model_converter(self.app, Universe, "slug")(None)
+
+        db.init_app(self.app)
+        self.context = self.app.test_request_context()
+        self.context.push()
+        db.create_all()
+        db.session.add(Universe(u"Test"))
+        db.session.commit()
+
+    def tearDown(self):
+        db.drop_all()
+        self.context.pop()
+
+    def delete(self):
+        Universe.query.delete()
+        db.session.commit()
+
+    def test_to_python(self):
+        self.assertEqual(self.converter.to_python("test").title, u"Test")
+
+    def test_missing(self):
+        self.assertRaises(ValidationError, self.converter.to_python, "nope")
+
+    def test_cached(self):
+        self.converter.to_python("test")
+        self.delete()
+        self.assertEqual(self.converter.to_python("test").title, u"Test")
+
+    def test_invalidated(self):
+        self.converter.to_python("test")
+        self.delete()
+        cache.invalidate("site")
+        self.assertRaises(ValidationError, self.converter.to_python, "test")
+
+    def test_attach_models(self):
+        values = {"u": self.converter.to_python("test"), "cid": 1}
+        attach_models("comics", values)
+        self.assertTrue(values["u"] in db.session)
+        self.assertEqual(values["cid"], 1)
@@ -0,0 +1,70 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+from datetime import datetime
+from unittest import TestCase
+
+from flask import Flask, flash
+
+from newrem.decorators import respond
+
+
+class TestRespond(TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.secret_key = "test"
+        self.modified = datetime(2014, 1, 1)
+        self.calls = 0
+
+    def view(self):
+        self.calls += 1
+        return "body"
+
+    def request(self, view=None, **headers):
+        with self.app.test_request_context(headers=headers):
+            return respond("tag", self.modified, view or self.view)
+
+    def test_validators(self):
+        response = self.request()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_etag(), ("tag", False))
+        self.assertEqual(response.last_modified, self.modified)
+
+    def test_etag(self):
+        response = self.request(If_None_Match='"tag"')
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.calls, 0)
+
+    def test_etag_changed(self):
+        response = self.request(If_None_Match='"other"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.calls, 1)
+
+    def test_modified_since(self):
+        response = self.request(
+            If_Modified_Since="Wed, 01 Jan 2014 00:00:00 GMT")
+        self.assertEqual(response.status_code, 304)
+
+    def test_modified_since_earlier(self):
+        response = self.request(
+            If_Modified_Since="Tue, 31 Dec 2013 00:00:00 GMT")
+        self.assertEqual(response.status_code, 200)
+
+    def test_flashed(self):
+        def view():
+            flash("Hello")
+            return "body"
+
+        response = self.request(view)
+        self.assertEqual(response.get_etag(), (None, None))
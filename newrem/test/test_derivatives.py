@@ -0,0 +1,92 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+from datetime import timedelta
+import os.path
+from StringIO import StringIO
+import stat
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from PIL import Image
+
+from werkzeug.datastructures import FileStorage
+
+from newrem.derivatives import Pipeline, SIZES, make_derivatives
+from newrem.files import FILE_MODE
+from newrem.models import db, Blob, Post
+from newrem.test.test_models import ComicTestCase
+
+
+def make_image(mode="RGB", size=(800, 600)):
+    handle = StringIO()
+    Image.new(mode, size).save(handle, "PNG")
+    return handle.getvalue()
+
+
+class TestMakeDerivatives(TestCase):
+
+    def setUp(self):
+        self.root = mkdtemp()
+        self.path = os.path.join(self.root, "image.png")
+        self.stem = os.path.join(self.root, "image")
+
+    def test_sizes(self):
+        with open(self.path, "wb") as handle:
+            handle.write(make_image())
+        results = make_derivatives(self.path, self.stem, {"small": 100})
+        self.assertEqual(results, [("small", ".jpg", 100, 75)])
+        image = Image.open(self.stem + "-small.jpg")
+        self.assertEqual(image.size, (100, 75))
+        mode = stat.S_IMODE(os.stat(self.stem + "-small.jpg").st_mode)
+        self.assertEqual(mode, FILE_MODE)
+
+    def test_transparent(self):
+        with open(self.path, "wb") as handle:
+            handle.write(make_image("RGBA"))
+        results = make_derivatives(self.path, self.stem, {"small": 100})
+        self.assertEqual(results[0][1], ".png")
+
+    def test_not_an_image(self):
+        with open(self.path, "wb") as handle:
+            handle.write("test")
+        self.assertEqual(make_derivatives(self.path, self.stem, SIZES), [])
+
+
+class TestPipeline(ComicTestCase):
+
+    def setUp(self):
+        super(TestPipeline, self).setUp()
+        self.pipeline = Pipeline(processes=0)
+
+    def test_submit(self):
+        fs = FileStorage(StringIO(make_image()), filename="test.png")
+        post = Post(u"Anonymous", u"", "", None)
+        post.blob = Blob.store(fs)
+        db.session.commit()
+        self.pipeline.submit(post.blob)
+
+        self.assertEqual(sorted(post.blob.derivatives), sorted(SIZES))
+        derivative = post.blob.derivatives["small"]
+        self.assertTrue(derivative.fp().exists())
+        self.assertEqual(derivative.width, SIZES["small"])
+
+    def test_sweep(self):
+        fs = FileStorage(StringIO(make_image()), filename="test.png")
+        blob = Blob.store(fs)
+        db.session.commit()
+        self.pipeline.submit(blob)
+        fp = blob.derivatives["small"].fp()
+
+        Blob.sweep(timedelta(0))
+        self.assertFalse(fp.exists())
@@ -0,0 +1,151 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+from datetime import datetime, timedelta
+import os
+import stat
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from newrem.export import MANIFEST, Exporter, sync
+from newrem.files import FILE_MODE
+from newrem.models import db, Comic
+from newrem.test.test_profiling import ViewTestCase
+from newrem.views import app
+
+
+class TestSync(TestCase):
+
+    def setUp(self):
+        self.first = mkdtemp()
+        self.second = mkdtemp()
+        self.dest = mkdtemp()
+        for root, data in ((self.first, "first"), (self.second, "second")):
+            with open(os.path.join(root, "test.txt"), "wb") as handle:
+                handle.write(data)
+
+    def test_precedence(self):
+        self.assertEqual(sync([self.first, self.second], self.dest), 1)
+        with open(os.path.join(self.dest, "test.txt"), "rb") as handle:
+            self.assertEqual(handle.read(), "first")
+
+    def test_mode(self):
+        os.chmod(os.path.join(self.first, "test.txt"), 0600)
+        sync([self.first], self.dest)
+        mode = os.stat(os.path.join(self.dest, "test.txt")).st_mode
+        self.assertEqual(stat.S_IMODE(mode), FILE_MODE)
+
+    def test_unchanged(self):
+        sync([self.first], self.dest)
+        self.assertEqual(sync([self.first], self.dest), 0)
+
+
+class TestExporter(ViewTestCase):
+
+    def setUp(self):
+        super(TestExporter, self).setUp()
+        self.root = mkdtemp()
+        self.exporter = Exporter(app, self.root)
+
+    def read(self, *segments):
+        with open(os.path.join(self.root, *segments), "rb") as handle:
+            return handle.read()
+
+    def test_export(self):
+        written, removed = self.exporter.export()
+        self.assertTrue("/testing/comics/1/comic-0" in written)
+        self.assertTrue("Comic 0" in self.read("testing", "comics", "1",
+                                               "comic-0", "index.html"))
+        self.assertTrue("<rss" in self.read("testing", "rss.xml"))
+        self.assertTrue(os.path.exists(os.path.join(self.root, "index.html")))
+        self.assertTrue(os.path.exists(os.path.join(self.root, "static",
+                                                    "next.png")))
+        self.assertEqual(removed, [])
+
+    def test_mode(self):
+        self.exporter.export()
+        for segments in (("index.html",), ("testing", "rss.xml"),
+                         (MANIFEST,)):
+            mode = os.stat(os.path.join(self.root, *segments)).st_mode
+            self.assertEqual(stat.S_IMODE(mode), FILE_MODE)
+
+    def test_redirect(self):
+        self.exporter.export()
+        page = self.read("testing", "comics", "recent", "index.html")
+        self.assertTrue("/testing/comics/10/comic-9" in page)
+        self.assertEqual(page, self.read("testing", "index.html"))
+
+    def test_unchanged(self):
+        self.exporter.export()
+        written, removed = self.exporter.export()
+        self.assertEqual(written, [])
+
+    def test_manifest(self):
+        self.exporter.export()
+        written, removed = Exporter(app, self.root).export()
+        self.assertEqual(written, [])
+
+    def test_edit(self):
+        self.exporter.export()
+        comic = Comic.query.get(5)
+        comic.description = u"Edited"
+        db.session.commit()
+
+        written, removed = self.exporter.export()
+        self.assertTrue("/testing/comics/5/comic-4" in written)
+        self.assertTrue("/testing/rss.xml" in written)
+        self.assertFalse("/testing/comics/6/comic-5" in written)
+        self.assertTrue("Edited" in self.read("testing", "comics", "5",
+                                              "comic-4", "index.html"))
+
+    def test_rename(self):
+        self.exporter.export()
+        comic = Comic.query.get(5)
+        comic.rename(u"Renamed")
+        db.session.commit()
+
+        written, removed = self.exporter.export()
+        self.assertTrue("/testing/comics/5/renamed" in written)
+        # Its neighbors link to it.
+        self.assertTrue("/testing/comics/4/comic-3" in written)
+        self.assertFalse("/testing/comics/2/comic-1" in written)
+        self.assertEqual(removed, ["/testing/comics/5/comic-4"])
+
+    def test_go_live(self):
+        comic = Comic.query.get(10)
+        comic.time = datetime.now() + timedelta(days=1)
+        db.session.commit()
+
+        self.exporter.export()
+        path = os.path.join(self.root, "testing", "comics", "10", "comic-9")
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(self.exporter.delay(10 ** 6) <= 24 * 60 * 60)
+
+        comic = Comic.query.get(10)
+        comic.time = datetime.now() - timedelta(seconds=1)
+        db.session.commit()
+        written, removed = self.exporter.export()
+        self.assertTrue("/testing/comics/10/comic-9" in written)
+        self.assertTrue("/testing/comics/recent" in written)
+
+    def test_removed(self):
+        self.exporter.export()
+        comic = Comic.query.get(10)
+        comic.time = datetime.now() + timedelta(days=1)
+        db.session.commit()
+
+        written, removed = self.exporter.export()
+        self.assertEqual(removed, ["/testing/comics/10/comic-9"])
+        path = os.path.join(self.root, "testing", "comics", "10", "comic-9",
+                            "index.html")
+        self.assertFalse(os.path.exists(path))
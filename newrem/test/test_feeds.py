@@ -0,0 +1,198 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+from datetime import datetime, timedelta
+import json
+from unittest import TestCase
+from xml.dom.minidom import parseString
+
+from newrem.cache import MemoryBackend, cache, invalidate
+from newrem.feeds import FORMATS, FragmentIndex, latest
+from newrem.models import db, Comic, Thread, Universe
+from newrem.test.test_profiling import ViewTestCase
+from newrem.timeline import Sequence
+from newrem.views import app
+
+
+def make_feed(kind, items):
+    format = FORMATS[kind]
+    updated = datetime(2014, 1, 2)
+    items = [format.item(url, u"Title & More", u"<p>Hi</p>", updated)
+             for url in items]
+    return (format.head(u"Feed", "http://example.com/", "http://example.com/f",
+                        updated) +
+            format.separator.join(items) + format.tail)
+
+
+class TestFormats(TestCase):
+
+    def test_rss(self):
+        d = parseString(make_feed("rss", ["a", "b"]).encode("utf-8"))
+        items = d.getElementsByTagName("item")
+        self.assertEqual(len(items), 2)
+        title = items[0].getElementsByTagName("title")[0]
+        self.assertEqual(title.firstChild.data, u"Title & More")
+
+    def test_atom(self):
+        d = parseString(make_feed("atom", ["a", "b"]).encode("utf-8"))
+        entries = d.getElementsByTagName("entry")
+        self.assertEqual(len(entries), 2)
+        content = entries[0].getElementsByTagName("content")[0]
+        self.assertEqual(content.firstChild.data, u"<p>Hi</p>")
+
+    def test_json(self):
+        d = json.loads(make_feed("json", ["a", "b"]))
+        self.assertEqual([item["url"] for item in d["items"]], ["a", "b"])
+        self.assertEqual(d["items"][0]["date_published"],
+                         "2014-01-02T00:00:00Z")
+
+    def test_json_empty(self):
+        d = json.loads(make_feed("json", []))
+        self.assertEqual(d["items"], [])
+
+
+class TestLatest(TestCase):
+
+    def setUp(self):
+        self.times = [datetime(2014, 1, day) for day in range(1, 6)]
+
+    def test_monotonic(self):
+        sequence = Sequence([1, 2, 3, 4, 5], self.times, monotonic=True)
+        pairs = latest(sequence, datetime(2014, 1, 4), size=2)
+        self.assertEqual([cid for time, cid in pairs], [3, 2])
+
+    def test_unordered(self):
+        times = [self.times[i] for i in (2, 0, 4, 1, 3)]
+        sequence = Sequence([3, 1, 5, 2, 4], times)
+        pairs = latest(sequence, datetime(2014, 1, 4), size=2)
+        self.assertEqual([cid for time, cid in pairs], [3, 2])
+
+
+class TestFeedViews(ViewTestCase):
+
+    def titles(self, path):
+        response = self.get(path, 20)
+        d = parseString(response.data)
+        items = d.getElementsByTagName("item")
+        return [item.getElementsByTagName("title")[0].firstChild.data
+                for item in items]
+
+    def test_feed(self):
+        response = self.get("/rss.xml", 20)
+        self.assertEqual(response.mimetype, "application/rss+xml")
+        titles = self.titles("/rss.xml")
+        self.assertEqual(len(titles), 10)
+        self.assertEqual(titles[0], u"Testing: Comic 9")
+
+    def test_universe_feed(self):
+        d = parseString(self.get("/testing/atom.xml", 20).data)
+        self.assertEqual(len(d.getElementsByTagName("entry")), 10)
+
+        d = json.loads(self.get("/testing/feed.json", 20).data)
+        self.assertEqual(d["title"], u"Testing")
+        self.assertEqual(d["items"][0]["title"], u"Testing: Comic 9")
+
+    def test_new_cache(self):
+        # Tag versions start again from zero in a new cache, so a copy from
+        # an old one mustn't look current, even if the versions match.
+        backend = cache.backend
+        try:
+            cache.backend = MemoryBackend()
+            etag = self.get("/rss.xml", 20).headers["ETag"]
+            epoch = cache.backend.epoch
+            cache.backend = MemoryBackend()
+            cache.backend.epoch = epoch + 1000
+            response = self.client.get("/rss.xml",
+                                       headers={"If-None-Match": etag})
+        finally:
+            cache.backend = backend
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+    def test_character_feed(self):
+        titles = self.titles("/testing/cast/alice/rss.xml")
+        self.assertEqual(len(titles), 10)
+        response = self.client.get("/testing/cast/nobody/rss.xml")
+        self.assertEqual(response.status_code, 404)
+
+    def test_scheduled(self):
+        comic = Comic.query.get(10)
+        comic.time = datetime.now() + timedelta(days=1)
+        db.session.commit()
+        invalidate(self.u)
+
+        titles = self.titles("/testing/rss.xml")
+        self.assertEqual(titles[0], u"Testing: Comic 8")
+        self.assertEqual(len(titles), 9)
+
+    def test_edit(self):
+        self.titles("/testing/rss.xml")
+        comic = Comic.query.get(10)
+        comic.rename(u"Renamed")
+        db.session.commit()
+        invalidate(self.u)
+
+        self.assertEqual(self.titles("/testing/rss.xml")[0],
+                         u"Testing: Renamed")
+
+
+class TestFragmentIndex(ViewTestCase):
+
+    def setUp(self):
+        super(TestFragmentIndex, self).setUp()
+        self.other = Universe(u"Other")
+        comic = Comic(self.other, "other.png")
+        comic.title = u"Other"
+        comic.time = datetime.now() - timedelta(days=1)
+        comic.thread = Thread(self.u.board, comic.title, u"DCoN")
+        comic.insert(None)
+        db.session.add(comic)
+        db.session.commit()
+
+        self.index = FragmentIndex()
+        self.refs = [("testing", 1), ("testing", 2), ("other", comic.id)]
+
+    def items(self, refs=None, budget=1, base_url="http://localhost/"):
+        with app.test_request_context(base_url=base_url):
+            with self.assertQueries(budget):
+                return self.index.items("rss", refs or self.refs)
+
+    def test_items(self):
+        items = self.items()
+        self.assertEqual(len(items), 3)
+        self.assertTrue("Testing: Comic 0" in items[0])
+        self.assertTrue("Other: Other" in items[2])
+
+    def test_reuse(self):
+        first = self.items()
+        second = self.items(budget=0)
+        self.assertEqual(first, second)
+
+    def test_invalidate(self):
+        first = self.items()
+        invalidate(self.u)
+        # Only the invalidated universe's items are serialized again, with
+        # a single query.
+        second = self.items()
+        self.assertEqual(first, second)
+        self.assertTrue(second[2] is first[2])
+        self.assertFalse(second[0] is first[0])
+
+    def test_host(self):
+        self.items()
+        items = self.items(base_url="http://example.com/")
+        self.assertTrue("http://example.com/" in items[0])
+
+    def test_deleted(self):
+        items = self.items([("testing", 1), ("testing", 42)])
+        self.assertEqual(len(items), 1)
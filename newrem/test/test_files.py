@@ -11,9 +11,18 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
 # License for the specific language governing permissions and limitations under
 # the License.
+import os
+from StringIO import StringIO
+import stat
+from tempfile import mkdtemp
 from unittest import TestCase
 
-from newrem.files import extend_url
+from bp.filepath import FilePath
+
+from werkzeug.datastructures import FileStorage
+
+from newrem.files import (CHUNK_SIZE, FILE_MODE, AssetIndex, extend_url,
+                          file_extension, pick_asset, save_file)
 
 
 class TestExtendURL(TestCase):
@@ -23,3 +32,87 @@ class TestExtendURL(TestCase):
         segments = ["test", "path"]
         expected = "http://example.com/test/path"
         self.assertEqual(extend_url(url, segments), expected)
+
+
+class TestSaveFile(TestCase):
+
+    def setUp(self):
+        self.root = FilePath(mkdtemp())
+        self.data = "x" * (CHUNK_SIZE * 2 + 1)
+        self.fs = FileStorage(StringIO(self.data), content_type="image/png")
+
+    def test_save_file(self):
+        fp = self.root.child("sub").child("test.png")
+        self.assertTrue(save_file(fp, self.fs))
+        self.assertEqual(fp.getContent(), self.data)
+        self.assertEqual(fp.parent().listdir(), ["test.png"])
+
+    def test_mode(self):
+        fp = self.root.child("test.png")
+        save_file(fp, self.fs)
+        mode = stat.S_IMODE(os.stat(fp.path).st_mode)
+        self.assertEqual(mode, FILE_MODE)
+
+
+class TestFileExtension(TestCase):
+
+    def test_filename(self):
+        fs = FileStorage(filename="Comic.PNG", content_type="image/jpeg")
+        self.assertEqual(file_extension(fs), ".png")
+
+    def test_content_type(self):
+        fs = FileStorage(filename="comic", content_type="image/png")
+        self.assertEqual(file_extension(fs), ".png")
+
+    def test_unsafe(self):
+        fs = FileStorage(filename="comic.<b>", content_type="")
+        self.assertEqual(file_extension(fs), "")
+
+
+class FakeApp(object):
+
+    def __init__(self, static_paths):
+        self.static_paths = static_paths
+
+
+class TestAssetIndex(TestCase):
+
+    def setUp(self):
+        self.root = FilePath(mkdtemp())
+        self.banners = self.root.child("banners")
+        self.banners.makedirs()
+        self.banners.child("b.png").touch()
+        self.banners.child("a.png").touch()
+        self.app = FakeApp([self.root.path])
+
+    def test_names(self):
+        index = AssetIndex()
+        self.assertEqual(index.names(self.app, ["banners"]),
+                         ["a.png", "b.png"])
+
+    def test_missing(self):
+        index = AssetIndex()
+        self.assertEqual(index.names(self.app, ["missing"]), [])
+
+    def test_cached(self):
+        index = AssetIndex(interval=60)
+        index.names(self.app, ["banners"])
+        self.banners.child("c.png").touch()
+        self.assertEqual(len(index.names(self.app, ["banners"])), 2)
+
+    def test_refresh(self):
+        index = AssetIndex(interval=0)
+        index.names(self.app, ["banners"])
+        self.banners.child("c.png").touch()
+        self.assertEqual(len(index.names(self.app, ["banners"])), 3)
+
+
+class TestPickAsset(TestCase):
+
+    def test_empty(self):
+        self.assertEqual(pick_asset([], "test"), None)
+
+    def test_deterministic(self):
+        names = [str(i) for i in range(10)]
+        first = pick_asset(names, "test", now=0)
+        self.assertEqual(pick_asset(names, "test", now=3599), first)
@@ -0,0 +1,67 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+from unittest import TestCase
+
+from flask import Flask
+
+from newrem.filters import comic_urls, url_for_comic
+
+
+class FakeComic(object):
+
+    def __init__(self, title, slug=None):
+        self.id = 1
+        self.title = title
+        self.slug = slug
+        self.universe = self.universe_fk = "test"
+
+
+class TestURLForComic(TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.add_url_rule("/<u>/comics/<int:cid>/<name>", "comics")
+        self.context = self.app.test_request_context()
+        self.context.push()
+        comic_urls.clear()
+
+    def tearDown(self):
+        self.context.pop()
+
+    def test_slug(self):
+        comic = FakeComic(u"A Title", "a-title")
+        self.assertEqual(url_for_comic(comic), "/test/comics/1/a-title")
+
+    def test_no_slug(self):
+        comic = FakeComic(u"A Title")
+        self.assertEqual(url_for_comic(comic), "/test/comics/1/a-title")
+
+    def test_kwargs(self):
+        comic = FakeComic(u"A Title", "a-title")
+        url_for_comic(comic)
+        self.assertEqual(url_for_comic(comic, char="alice"),
+                         "/test/comics/1/a-title?char=alice")
+
+    def test_memoized(self):
+        comic = FakeComic(u"A Title", "a-title")
+        url_for_comic(comic)
+        self.assertEqual(len(comic_urls), 1)
+        url_for_comic(comic)
+        self.assertEqual(len(comic_urls), 1)
+
+    def test_renamed(self):
+        comic = FakeComic(u"A Title", "a-title")
+        url_for_comic(comic)
+        comic.slug = "another"
+        self.assertEqual(url_for_comic(comic), "/test/comics/1/another")
@@ -14,8 +14,13 @@
 from collections import namedtuple
 from unittest import TestCase
 
-from newrem.forms import (label_for_comic, select_option_for_comics,
-                          select_list_for_comics)
+from werkzeug.datastructures import MultiDict
+from wtforms import Form
+
+from newrem.forms import (CharacterPickerField, ComicPickerField,
+                          label_for_comic)
+from newrem.models import db, Character
+from newrem.test.test_models import ComicTestCase
 
 
 FauxComic = namedtuple("FauxComic", "id, title, position")
@@ -29,45 +34,62 @@ class TestLabelForComic(TestCase):
         self.assertEqual(label_for_comic(comic), expected)
 
 
-class TestSelectOptionForComics(TestCase):
-
-    def test_select_option_for_comics(self):
-        first = FauxComic(1, "First", 0)
-        second = FauxComic(2, "Second", 1)
-        expected = 1, u'"First" (0) to "Second" (1)'
-        self.assertEqual(select_option_for_comics(first, second), expected)
-
-
-class TestSelectListForComics(TestCase):
-
-    def test_select_list_for_comics_one(self):
-        comics = [
-            FauxComic(1, "First", 0),
-        ]
-        expected = [
-            (-1, u'Before "First" (0)'),
-            (1, u'After "First" (0)'),
-        ]
-        self.assertEqual(select_list_for_comics(comics), expected)
-
-    def test_select_list_for_comics_one_id(self):
-        comics = [
-            FauxComic(42, "First", 0),
-        ]
-        expected = [
-            (-1, u'Before "First" (0)'),
-            (42, u'After "First" (0)'),
-        ]
-        self.assertEqual(select_list_for_comics(comics), expected)
-
-    def test_select_list_for_comics_two(self):
-        comics = [
-            FauxComic(1, "First", 0),
-            FauxComic(2, "Second", 1),
-        ]
-        expected = [
-            (-1, u'Before "First" (0)'),
-            (1, u'"First" (0) to "Second" (1)'),
-            (2, u'After "Second" (1)'),
-        ]
-        self.assertEqual(select_list_for_comics(comics), expected)
+class PickerForm(Form):
+    index = ComicPickerField()
+    characters = CharacterPickerField()
+
+
+class TestPickers(ComicTestCase):
+
+    def setUp(self):
+        super(TestPickers, self).setUp()
+        self.make_comic(None)
+        self.make_comic(self.comics[0], True)
+        self.character = Character(self.u, u"Tester")
+        db.session.add(self.character)
+        db.session.commit()
+
+    def form(self, **data):
+        form = PickerForm(MultiDict(data))
+        for field in form.index, form.characters:
+            field.universe = self.u
+            field.url = "/search"
+        return form
+
+    def test_valid(self):
+        form = self.form(index=str(self.comics[1].id),
+                         characters=self.character.slug)
+        self.assertTrue(form.validate())
+        self.assertEqual(form.index.data, self.comics[1].id)
+        self.assertEqual(form.characters.data, [self.character])
+
+    def test_before(self):
+        form = self.form(index="-1")
+        self.assertTrue(form.validate())
+        self.assertEqual(form.characters.data, [])
+
+    def test_no_comics(self):
+        form = self.form(index="-2")
+        self.assertFalse(form.validate())
+        self.assertTrue("index" in form.errors)
+
+    def test_unknown_comic(self):
+        form = self.form(index="42")
+        self.assertFalse(form.validate())
+        self.assertTrue("index" in form.errors)
+
+    def test_unknown_character(self):
+        form = self.form(index="-1", characters="nobody")
+        self.assertFalse(form.validate())
+        self.assertTrue("characters" in form.errors)
+
+    def test_chosen(self):
+        form = self.form(index=str(self.comics[1].id),
+                         characters=self.character.slug)
+        html = form.index()
+        self.assertTrue('data-url="/search"' in html)
+        self.assertTrue('<option value="-1">Before' in html)
+        self.assertTrue('<option selected value="%d">After'
+                        % self.comics[1].id in html)
+        self.assertEqual(form.characters.chosen(),
+                         [(self.character.slug, u"Tester")])
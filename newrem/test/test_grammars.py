@@ -11,11 +11,13 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
 # License for the specific language governing permissions and limitations under
 # the License.
+from random import Random
 from unittest import TestCase
 
 from ometa.runtime import ParseError
 
-from newrem.grammars import BlogGrammar
+from newrem.grammars import (BlogGrammar, SafeBlogGrammar, paragraphs,
+                             safe_paragraphs)
 
 class TestBlogGrammar(TestCase):
 
@@ -110,3 +112,74 @@ class TestBlogGrammarSafety(TestCase):
         text = """;!--"<XSS>=&{()}"""
         sanitized = BlogGrammar(text).safe_paragraphs()
         self.assertTrue("<XSS>" not in sanitized)
+
+    def test_decorated_xss(self):
+        text = "*<XSS>*"
+        sanitized = SafeBlogGrammar(text).safe_paragraphs()
+        self.assertEqual(sanitized, "<p><i>&lt;XSS&gt;</i></p>")
+
+    def test_greentext_xss(self):
+        text = "\r\n><XSS>\r\n"
+        sanitized = SafeBlogGrammar(text).safe_paragraphs()
+        self.assertTrue("<XSS>" not in sanitized)
+
+class TestParagraphs(TestCase):
+    """
+    The compiled renderer must agree with BlogGrammar.
+    """
+
+    def test_empty(self):
+        self.assertEqual(paragraphs(""), "<p></p>")
+
+    def test_trivial(self):
+        self.assertEqual(paragraphs("asdf"), "<p>asdf</p>")
+
+    def test_break(self):
+        self.assertEqual(paragraphs("asdf\r\njkl"), "<p>asdf<br />jkl</p>")
+
+    def test_multiple(self):
+        self.assertEqual(paragraphs("asdf\r\n\r\njkl"),
+            "<p>asdf</p><p>jkl</p>")
+
+    def test_bold_nested(self):
+        self.assertEqual(paragraphs("**a*sd*f**"), "<p><b>a<i>sd</i>f</b></p>")
+
+    def test_italics_nested(self):
+        self.assertEqual(paragraphs("*a**sd**f*"), "<p><i>a<b>sd</b>f</i></p>")
+
+    def test_underline_nested(self):
+        self.assertEqual(paragraphs("_a*sd*f_"), "<p><u>a<i>sd</i>f</u></p>")
+
+    def test_italics_cross(self):
+        self.assertEqual(paragraphs("*as\r\n\r\ndf*"),
+            "<p>*as</p><p>df*</p>")
+
+    def test_quote(self):
+        self.assertEqual(paragraphs("\r\n>mfw\r\n"),
+            '<p><br /><span class="quote">&gt;mfw</span><br /></p>')
+
+    def test_safe_escapes(self):
+        self.assertEqual(safe_paragraphs("<br />"), "<p>&lt;br /&gt;</p>")
+
+    def test_safe_decorated(self):
+        self.assertEqual(safe_paragraphs("_<_"), "<p><u>&lt;</u></p>")
+
+    def test_safe_quotes(self):
+        self.assertEqual(safe_paragraphs("\"'"), "<p>&quot;&apos;</p>")
+
+    def test_reference(self):
+        self.assertEqual(paragraphs("*a*", reference=True), "<p><i>a</i></p>")
+
+    def test_deep_nesting(self):
+        text = "_*" * 1000 + "a" + "*_" * 1000
+        expected = "<p>%sa%s</p>" % ("<u><i>" * 1000, "</i></u>" * 1000)
+        self.assertEqual(paragraphs(text), expected)
+
+    def test_random(self):
+        r = Random(0)
+        pieces = ["a", "*", "**", "_", ">", "\r\n", "\r", "<", "&", " "]
+        for i in range(500):
+            text = "".join(r.choice(pieces) for j in range(r.randint(0, 20)))
+            self.assertEqual(paragraphs(text), BlogGrammar(text).paragraphs())
+            self.assertEqual(safe_paragraphs(text),
+                SafeBlogGrammar(text).safe_paragraphs())
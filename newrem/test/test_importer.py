@@ -0,0 +1,134 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+from datetime import datetime
+import os.path
+import stat
+from tempfile import mkdtemp
+
+from dateutil.tz import tzlocal, tzoffset
+
+from newrem.files import FILE_MODE
+from newrem.importer import Importer, read_manifest
+from newrem.models import db, Appearance, Board, Character, Comic
+from newrem.test.test_derivatives import make_image
+from newrem.test.test_models import ComicTestCase
+
+
+class TestImporter(ComicTestCase):
+
+    def setUp(self):
+        super(TestImporter, self).setUp()
+        self.u.board = Board("t", u"Testing")
+        Character(self.u, u"Alice")
+        db.session.add(self.u)
+        db.session.commit()
+
+        self.directory = mkdtemp()
+        for i in range(3):
+            self.write("%d.png" % i, make_image(size=(10 + i, 10)))
+        self.write("broken.png", "test")
+
+        self.entries = [
+            {"file": "%d.png" % i, "title": u"Comic %d" % i,
+             "time": datetime(2012, 1, 1 + i), "cast": ["Alice"]}
+            for i in range(3)
+        ]
+        self.importer = Importer(self.u, self.directory, processes=0,
+                                 batch_size=2)
+
+    def write(self, name, data):
+        with open(os.path.join(self.directory, name), "wb") as handle:
+            handle.write(data)
+
+    def titles(self):
+        q = Comic.query.order_by(Comic.position)
+        return [comic.title for comic in q]
+
+    def test_import(self):
+        imported, skipped, problems = self.importer.run(self.entries)
+        self.assertEqual((imported, skipped, problems), (3, 0, []))
+        self.assertEqual(self.titles(), [u"Comic 0", u"Comic 1", u"Comic 2"])
+
+        comic = Comic.query.filter_by(title=u"Comic 1").one()
+        self.assertEqual(comic.slug, "comic-1")
+        self.assertEqual(comic.thread.subject, u"Comic 1")
+        self.assertEqual([c.slug for c in comic.characters], ["alice"])
+        self.assertTrue(comic.fp().exists())
+        mode = os.stat(comic.fp().path).st_mode
+        self.assertEqual(stat.S_IMODE(mode), FILE_MODE)
+        self.assertEqual(Appearance.query.count(), 3)
+
+    def test_order(self):
+        self.entries[0]["order"] = 5
+        self.importer.run(self.entries)
+        self.assertEqual(self.titles(), [u"Comic 1", u"Comic 2", u"Comic 0"])
+
+    def test_append(self):
+        self.make_comic(None)
+        self.importer.run(self.entries)
+        self.assertEqual(self.titles()[0], u"Test")
+
+    def test_resume(self):
+        self.importer.run(self.entries[:1])
+        imported, skipped, problems = self.importer.run(self.entries)
+        self.assertEqual((imported, skipped), (2, 1))
+        self.assertEqual(self.titles(), [u"Comic 0", u"Comic 1", u"Comic 2"])
+
+    def test_shared_blob(self):
+        self.write("copy.png", make_image(size=(10, 10)))
+        self.entries.append({"file": "copy.png", "title": u"Copy"})
+        imported, skipped, problems = self.importer.run(self.entries)
+        self.assertEqual(problems, [])
+        first = Comic.query.filter_by(title=u"Comic 0").one()
+        copy = Comic.query.filter_by(title=u"Copy").one()
+        self.assertEqual(first.blob_id, copy.blob_id)
+
+    def test_problems(self):
+        self.entries.extend([
+            {"file": "missing.png", "title": u"Missing"},
+            {"file": "broken.png", "title": u"Broken"},
+            {"file": "0.png", "title": u"Again"},
+            {"title": u"No file"},
+        ])
+        self.entries[1]["cast"] = ["Bob"]
+        imported, skipped, problems = self.importer.run(self.entries)
+        self.assertEqual(imported, 0)
+        self.assertEqual(len(problems), 5)
+        self.assertEqual(Comic.query.count(), 0)
+
+    def test_shared_time(self):
+        self.entries[1]["time"] = self.entries[0]["time"]
+        imported, skipped, problems = self.importer.run(self.entries)
+        self.assertEqual(problems, ["Some comics share a time"])
+
+    def test_time_offset(self):
+        self.entries[1]["time"] = u"2012-01-02T12:00:00+05:00"
+        del self.entries[2]["time"]
+        imported, skipped, problems = self.importer.run(self.entries)
+        self.assertEqual(problems, [])
+        comic = Comic.query.filter_by(title=u"Comic 1").one()
+        time = datetime(2012, 1, 2, 12, tzinfo=tzoffset(None, 5 * 3600))
+        self.assertEqual(comic.time,
+                         time.astimezone(tzlocal()).replace(tzinfo=None))
+
+    def test_csv(self):
+        self.write("manifest.csv", "file,title,cast,time\n"
+                                   "0.png,Comic 0,\"Alice,Bob\",2012-01-01\n"
+                                   "1.png,Comic 1,,\n")
+        entries = read_manifest(os.path.join(self.directory, "manifest.csv"))
+        self.assertEqual(entries, [
+            {"file": u"0.png", "title": u"Comic 0", "cast": u"Alice,Bob",
+             "time": u"2012-01-01"},
+            {"file": u"1.png", "title": u"Comic 1"},
+        ])
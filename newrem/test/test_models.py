@@ -11,9 +11,23 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
 # License for the specific language governing permissions and limitations under
 # the License.
+from datetime import datetime, timedelta
+from StringIO import StringIO
+from tempfile import mkdtemp
 import unittest
 
-from newrem.models import (Board, Newspost, Post, Universe)
+from bp.filepath import FilePath
+
+from werkzeug.datastructures import FileStorage
+
+from flask import Flask
+
+from newrem.cache import cache
+from newrem.grammars import VERSION
+from newrem.models import (db, Appearance, Blob, Board, Character, Comic,
+                           Newspost, Post, Universe, User, add_columns,
+                           add_indexes, load_user, position_between,
+                           rerender)
 
 class TestPostModel(unittest.TestCase):
 
@@ -23,6 +37,11 @@ class TestPostModel(unittest.TestCase):
     def test_trivial(self):
         pass
 
+    def test_rendered_escaped(self):
+        m = Post("Anonymous", u"*<b>*", "", None)
+        self.assertEqual(m.comment_html, u"<p><i>&lt;b&gt;</i></p>")
+        self.assertEqual(m.grammar, VERSION)
+
 class TestBoardModel(unittest.TestCase):
 
     def setUp(self):
@@ -46,3 +65,373 @@ class TestNewspostModel(unittest.TestCase):
 
     def test_trivial(self):
         pass
+
+    def test_rendered(self):
+        self.assertEqual(self.m.content_html, u"<p>Content</p>")
+
+    def test_render(self):
+        self.m.content = u"**New**"
+        self.m.render()
+        self.assertEqual(self.m.html("content"), u"<p><b>New</b></p>")
+
+    def test_html_unrendered(self):
+        self.m.content_html = None
+        self.assertEqual(self.m.html("content"), u"<p>Content</p>")
+
+class TestPositionBetween(unittest.TestCase):
+
+    def test_open(self):
+        self.assertEqual(position_between(None, None), 0)
+
+    def test_open_lower(self):
+        self.assertTrue(position_between(None, 0) < 0)
+
+    def test_open_upper(self):
+        self.assertTrue(position_between(0, None) > 0)
+
+    def test_midpoint(self):
+        self.assertEqual(position_between(0, 10), 5)
+
+    def test_adjacent(self):
+        self.assertEqual(position_between(4, 5), None)
+
+    def test_equal(self):
+        self.assertEqual(position_between(5, 5), None)
+
+class ComicTestCase(unittest.TestCase):
+    """
+    Set up a database with a universe in it.
+    """
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        self.app.config["DCON_UPLOAD_PATH"] = FilePath(mkdtemp())
+        db.init_app(self.app)
+
+        self.context = self.app.test_request_context()
+        self.context.push()
+        db.create_all()
+
+        self.u = Universe(u"Testing")
+        self.time = datetime(2012, 1, 1)
+        self.comics = []
+
+    def tearDown(self):
+        db.drop_all()
+        self.context.pop()
+
+    def make_comic(self, prior, after=False):
+        comic = Comic(self.u, "%d.png" % len(self.comics))
+        comic.title = u"Test"
+        comic.time = self.time + timedelta(days=len(self.comics))
+        comic.insert(prior, after)
+        db.session.commit()
+        self.comics.append(comic)
+        return comic
+
+    def timeline(self):
+        q = Comic.query.order_by(Comic.position)
+        return [self.comics.index(comic) for comic in q]
+
+class TestComicInsert(ComicTestCase):
+
+    def test_insert_after(self):
+        first = self.make_comic(None)
+        self.make_comic(first)
+        self.make_comic(first)
+        self.assertEqual(self.timeline(), [0, 2, 1])
+
+    def test_insert_before(self):
+        first = self.make_comic(None)
+        self.make_comic(first, after=True)
+        self.assertEqual(self.timeline(), [1, 0])
+
+    def test_insert_touches_one_row(self):
+        first = self.make_comic(None)
+        last = self.make_comic(first)
+        self.make_comic(first)
+        position = last.position
+        self.make_comic(first)
+        self.assertEqual(last.position, position)
+
+    def test_insert_respace(self):
+        first = self.make_comic(None)
+        self.make_comic(first)
+        for i in range(20):
+            self.make_comic(first)
+        expected = [0] + range(21, 1, -1) + [1]
+        self.assertEqual(self.timeline(), expected)
+
+    def test_insert_respace_ties(self):
+        first = self.make_comic(None)
+        second = self.make_comic(first)
+        second.position = first.position
+        db.session.commit()
+        self.make_comic(first)
+        self.assertEqual(self.timeline(), [0, 2, 1])
+
+    def test_move(self):
+        first = self.make_comic(None)
+        second = self.make_comic(first)
+        third = self.make_comic(second)
+        first.insert(third)
+        db.session.commit()
+        self.assertEqual(self.timeline(), [1, 2, 0])
+
+class TestComicMove(ComicTestCase):
+
+    def setUp(self):
+        super(TestComicMove, self).setUp()
+        prior = None
+        for i in range(6):
+            prior = self.make_comic(prior)
+
+    def ids(self, *indices):
+        return [self.comics[i].id for i in indices]
+
+    def test_move_block(self):
+        Comic.move(self.u, self.ids(3, 4), self.comics[0])
+        db.session.commit()
+        self.assertEqual(self.timeline(), [0, 3, 4, 1, 2, 5])
+
+    def test_move_start(self):
+        Comic.move(self.u, self.ids(5, 4), None)
+        db.session.commit()
+        self.assertEqual(self.timeline(), [5, 4, 0, 1, 2, 3])
+
+    def test_move_end(self):
+        Comic.move(self.u, self.ids(0, 1), self.comics[5])
+        db.session.commit()
+        self.assertEqual(self.timeline(), [2, 3, 4, 5, 0, 1])
+
+    def test_move_everything(self):
+        Comic.move(self.u, self.ids(5, 4, 3, 2, 1, 0), None)
+        db.session.commit()
+        self.assertEqual(self.timeline(), [5, 4, 3, 2, 1, 0])
+
+    def test_move_only_renumbers_block(self):
+        count = Comic.move(self.u, self.ids(4), self.comics[1])
+        self.assertEqual(count, 1)
+
+    def test_move_makes_room(self):
+        # Squeeze the comics together, so that there's no room anywhere.
+        for i, comic in enumerate(self.comics):
+            comic.position = i
+        db.session.commit()
+
+        count = Comic.move(self.u, self.ids(4, 5), self.comics[0])
+        db.session.commit()
+        self.assertEqual(self.timeline(), [0, 4, 5, 1, 2, 3])
+        self.assertEqual(count, 5)
+        self.assertEqual(self.comics[0].position, 0)
+
+    def test_move_ties(self):
+        self.comics[1].position = self.comics[0].position
+        db.session.commit()
+        Comic.move(self.u, self.ids(5), self.comics[0])
+        db.session.commit()
+        self.assertEqual(self.timeline(), [0, 5, 1, 2, 3, 4])
+
+    def test_move_after_itself(self):
+        self.assertRaises(ValueError, Comic.move, self.u, self.ids(1, 2),
+                          self.comics[1])
+
+    def test_move_duplicates(self):
+        self.assertRaises(ValueError, Comic.move, self.u, self.ids(1, 1),
+                          self.comics[0])
+
+    def test_move_missing(self):
+        self.assertRaises(ValueError, Comic.move, self.u, [1000],
+                          self.comics[0])
+
+    def test_reorder(self):
+        Comic.reorder(self.u, self.ids(5, 3, 1, 0, 2, 4))
+        db.session.commit()
+        self.assertEqual(self.timeline(), [5, 3, 1, 0, 2, 4])
+
+    def test_reorder_incomplete(self):
+        self.assertRaises(ValueError, Comic.reorder, self.u, self.ids(0, 1))
+
+class TestAppearanceReindex(ComicTestCase):
+
+    def test_reindex(self):
+        c = Character(self.u, u"Alice")
+        first = self.make_comic(None)
+        second = self.make_comic(first, after=True)
+        first.characters = [c]
+        second.characters = [c]
+        Appearance.reindex([c.slug])
+        db.session.commit()
+
+        q = Appearance.query.order_by(Appearance.ordinal)
+        self.assertEqual([a.comic_id for a in q], [second.id, first.id])
+
+    def test_reindex_removed(self):
+        c = Character(self.u, u"Alice")
+        first = self.make_comic(None)
+        first.characters = [c]
+        Appearance.reindex([c.slug])
+        first.characters = []
+        Appearance.reindex([c.slug])
+        db.session.commit()
+
+        self.assertEqual(Appearance.query.count(), 0)
+
+class TestRerender(ComicTestCase):
+
+    def test_rerender(self):
+        comic = self.make_comic(None)
+        comic.comment = u"_Old_"
+        comic.grammar = VERSION - 1
+        db.session.commit()
+
+        self.assertEqual(rerender(), 1)
+        self.assertEqual(comic.comment_html, u"<p><u>Old</u></p>")
+        self.assertEqual(comic.grammar, VERSION)
+
+    def test_rerender_current(self):
+        comic = self.make_comic(None)
+        comic.render()
+        db.session.commit()
+
+        self.assertEqual(rerender(), 0)
+
+class TestBlob(ComicTestCase):
+
+    def store(self, data):
+        fs = FileStorage(StringIO(data), filename="test.png")
+        blob = Blob.store(fs)
+        db.session.commit()
+        return blob
+
+    def test_store(self):
+        blob = self.store("test")
+        self.assertEqual(blob.fp().getContent(), "test")
+        self.assertEqual(blob.segments()[-1], blob.digest + ".png")
+
+    def test_store_dedupe(self):
+        first = self.store("test")
+        second = self.store("test")
+        self.assertTrue(first is second)
+        self.assertEqual(Blob.query.count(), 1)
+
+    def test_store_race(self):
+        # Another worker has just stored the same bytes, unbeknownst to
+        # this one's session, which has other changes pending.
+        first = self.store("test")
+        digest = first.digest
+        db.session.expunge_all()
+
+        character = Character(Universe(u"Other"), u"Pending")
+        db.session.add(character)
+        character.blob = Blob.store(FileStorage(StringIO("test"),
+                                                filename="test.png"))
+        db.session.commit()
+
+        self.assertEqual(character.blob.digest, digest)
+        self.assertEqual(Blob.query.count(), 1)
+        self.assertEqual(Character.query.one().name, u"Pending")
+
+    def test_location(self):
+        comic = self.make_comic(None)
+        comic.blob = self.store("test")
+        self.assertEqual(comic.fp(), comic.blob.fp())
+
+    def test_references(self):
+        blob = self.store("test")
+        for i in range(2):
+            self.make_comic(None).blob = blob
+        db.session.commit()
+        self.assertEqual(Blob.references(), {blob.digest: 2})
+
+    def test_sweep(self):
+        used = self.store("used")
+        unused = self.store("unused")
+        self.make_comic(None).blob = used
+        db.session.commit()
+        fp = unused.fp()
+
+        self.assertEqual(Blob.sweep(timedelta(0)), 1)
+        self.assertEqual(Blob.query.all(), [used])
+        self.assertFalse(fp.exists())
+
+    def test_sweep_grace(self):
+        self.store("unused")
+        self.assertEqual(Blob.sweep(), 0)
+
+
+class TestAddColumns(ComicTestCase):
+
+    def columns(self, table):
+        return [column["name"]
+                for column in db.inspect(db.engine).get_columns(table)]
+
+    def test_add(self):
+        # A post table from before blobs.
+        Post.__table__.drop(db.engine)
+        db.engine.execute("CREATE TABLE post (id INTEGER PRIMARY KEY)")
+        self.assertEqual(add_columns(Post, "id", "blob_id"), ["blob_id"])
+        self.assertTrue("blob_id" in self.columns("post"))
+
+    def test_present(self):
+        self.assertEqual(add_columns(Post, "blob_id"), [])
+
+    def test_indexes(self):
+        db.engine.execute("DROP INDEX post_thread")
+        self.assertEqual(add_indexes(Post), ["post_thread"])
+        self.assertEqual(add_indexes(Post), [])
+
+
+class TestLoadUser(ComicTestCase):
+
+    def setUp(self):
+        super(TestLoadUser, self).setUp()
+        self.app.config["SECRET_KEY"] = "test"
+        self.user = User(u"tester", "password")
+        db.session.add(self.user)
+        db.session.commit()
+        self.user.forget()
+        self.token = self.user.get_id()
+
+    def vanish(self):
+        # Remove the user behind the session's back.
+        db.session.execute(User.__table__.delete())
+        db.session.commit()
+        db.session.expunge_all()
+
+    def test_load(self):
+        user = load_user(self.token)
+        self.assertEqual(user.username, u"tester")
+        self.assertTrue(user.is_authenticated())
+
+    def test_missing(self):
+        self.assertEqual(load_user(u"nobody|signature"), None)
+
+    def test_bad_signature(self):
+        self.assertEqual(load_user(u"tester|signature"), None)
+
+    def test_no_signature(self):
+        self.assertEqual(load_user(u"tester"), None)
+
+    def test_cached(self):
+        load_user(self.token)
+        self.vanish()
+        user = load_user(self.token)
+        self.assertEqual(user.username, u"tester")
+
+    def test_cached_signature(self):
+        load_user(self.token)
+        self.assertEqual(cache.get(self.user.cache_key),
+                         self.user.signature())
+
+    def test_set_password(self):
+        user = load_user(self.token)
+        user.set_password("changed")
+        db.session.commit()
+        user.forget()
+        token = user.get_id()
+        db.session.expunge_all()
+        self.assertNotEqual(token, self.token)
+        self.assertEqual(load_user(self.token), None)
+        self.assertEqual(load_user(token).username, u"tester")
@@ -0,0 +1,245 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from bp.filepath import FilePath
+
+from sqlalchemy.exc import OperationalError
+
+from flask import Flask
+
+from newrem.admin import admin
+from newrem.cache import invalidate
+from newrem.chan import osuchan
+from newrem.filters import load_filters
+from newrem.models import (db, lm, Appearance, Board, Character, Comic, Post,
+                           Thread, Universe)
+from newrem.profiling import Recorder, Statements, recorder
+from newrem.users import users
+from newrem.views import app
+
+
+class TestStatements(TestCase):
+
+    def test_keep(self):
+        tally = Statements(keep=2)
+        for i in range(5):
+            tally.add("SELECT %d" % i, i)
+        self.assertEqual(tally.count, 5)
+        self.assertEqual(tally.seconds, 10)
+        self.assertEqual(tally.slowest(), [(4, "SELECT 4"), (3, "SELECT 3")])
+
+    def test_keep_all(self):
+        tally = Statements()
+        for i in range(5):
+            tally.add("SELECT %d" % i, i)
+        self.assertEqual(len(tally.slowest()), 5)
+
+
+class TestRecorder(TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        db.init_app(self.app)
+        self.recorder = Recorder(keep=1)
+        self.recorder.init_app(self.app)
+
+        @self.app.route("/")
+        def index():
+            db.session.execute("SELECT 1")
+            db.session.execute("SELECT 2")
+            return "index"
+
+    def test_capture(self):
+        with self.app.app_context():
+            with self.recorder.capture() as tally:
+                db.session.execute("SELECT 1")
+        self.assertEqual(list(tally), ["SELECT 1"])
+
+    def test_failed(self):
+        with self.app.app_context():
+            with self.recorder.capture() as tally:
+                self.assertRaises(OperationalError, db.session.execute,
+                                  "SELECT * FROM missing")
+                db.session.execute("SELECT 1")
+            info = db.session.connection().info
+        self.assertEqual(list(tally), ["SELECT * FROM missing", "SELECT 1"])
+        self.assertFalse(info.get("started"))
+
+    def test_views(self):
+        self.app.test_client().get("/")
+        views, statements = self.recorder.stats()
+        self.assertEqual([view[:3] for view in views], [("index", 1, 2)])
+        self.assertEqual(len(statements), 1)
+
+    def test_server_timing(self):
+        response = self.app.test_client().get("/")
+        self.assertFalse("Server-Timing" in response.headers)
+        self.app.config["DCON_SERVER_TIMING"] = True
+        response = self.app.test_client().get("/")
+        header = response.headers["Server-Timing"]
+        self.assertTrue('desc="2 queries"' in header)
+
+
+# The username and password of the administrator.
+ADMIN = "admin", "test"
+
+
+def configure():
+    """
+    Set up the real application against an in-memory database, once.
+    """
+
+    if app.config.get("DCON_CONFIG"):
+        return
+
+    passwords = FilePath(mkdtemp()).child("passwords.dcon")
+    passwords.setContent("%s:%s\n" % ADMIN)
+
+    app.config.update({
+        "SQLALCHEMY_DATABASE_URI": "sqlite://",
+        "DCON_CONFIG": {"slogan": "Test"},
+        "DCON_UPLOAD_PATH": FilePath(mkdtemp()),
+        "DCON_STATIC_URL": "/static/",
+        "DCON_PASSWORD_FILE": passwords,
+        "SECRET_KEY": "test",
+        "DCON_CACHE_PAGES": True,
+        "WTF_CSRF_ENABLED": False,
+    })
+    app.static_paths = []
+
+    @app.context_processor
+    def site_config():
+        return {"dcon": app.config["DCON_CONFIG"]}
+
+    load_filters(app)
+    db.init_app(app)
+    lm.setup_app(app)
+    recorder.init_app(app)
+    app.register_blueprint(users)
+    app.register_blueprint(osuchan, url_prefix="/chan")
+    app.register_blueprint(admin, url_prefix="/admin")
+
+
+class ViewTestCase(TestCase):
+    """
+    Run requests against the real views, with a universe of comics and a
+    chan thread in the database.
+    """
+
+    def setUp(self):
+        configure()
+        self.context = app.app_context()
+        self.context.push()
+        db.create_all()
+        # Nothing cached by other tests applies to this database.
+        invalidate()
+
+        self.u = Universe(u"Testing")
+        self.u.board = Board("t", u"Testing")
+        alice = Character(self.u, u"Alice")
+        alice.major = True
+
+        start = datetime.now() - timedelta(days=30)
+        prior = None
+        for i in range(10):
+            comic = Comic(self.u, "%d.png" % i)
+            comic.title = u"Comic %d" % i
+            comic.time = start + timedelta(days=i)
+            comic.characters = [alice]
+            comic.thread = Thread(self.u.board, comic.title, u"DCoN")
+            with db.session.no_autoflush:
+                comic.insert(prior)
+            db.session.add(comic)
+            db.session.flush()
+            prior = comic
+        Appearance.reindex(["alice"])
+
+        self.thread = Thread(self.u.board, u"Subject", u"Anonymous")
+        db.session.add(self.thread)
+        db.session.flush()
+        for i in range(30):
+            Thread.add(self.thread.id, Post(u"Anonymous", u"Hi", "", None))
+        db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    @contextmanager
+    def assertQueries(self, budget):
+        """
+        Assert that a block runs at most `budget` SQL statements.
+        """
+
+        with recorder.capture() as tally:
+            yield tally
+        if tally.count > budget:
+            self.fail("%d statements, over a budget of %d:\n%s"
+                      % (tally.count, budget, "\n".join(tally)))
+
+    def get(self, path, budget):
+        with self.assertQueries(budget):
+            response = self.client.get(path)
+        self.assertTrue(response.status_code in (200, 302),
+                        "%s: %s" % (path, response.status))
+        return response
+
+
+class TestQueryBudgets(ViewTestCase):
+
+    def test_comics(self):
+        self.get("/testing/comics/5", 7)
+        # Served from the page cache.
+        self.get("/testing/comics/5", 0)
+
+    def test_comics_warm(self):
+        # Once the timeline has been loaded, other comics' pages only need
+        # the comic itself and its neighbours, even when they aren't cached.
+        self.get("/testing/comics/5", 7)
+        self.get("/testing/comics/6", 2)
+        self.get("/testing/comics/7?char=alice", 2)
+
+    def test_pages_uncached(self):
+        app.config["DCON_CACHE_PAGES"] = False
+        try:
+            self.get("/testing/comics/5", 7)
+            with recorder.capture() as tally:
+                self.get("/testing/comics/5", 7)
+            self.assertTrue(tally.count > 0)
+        finally:
+            app.config["DCON_CACHE_PAGES"] = True
+
+    def test_recent(self):
+        self.get("/testing/comics/recent", 3)
+
+    def test_showthread(self):
+        self.get("/chan/t/%d" % self.thread.id, 4)
+
+    def test_showboard(self):
+        self.get("/chan/t/", 4)
+
+    def test_feeds(self):
+        self.get("/rss.xml", 5)
+        # The items were all serialized for the first feed.
+        self.get("/testing/rss.xml", 1)
+        self.get("/testing/feed.json", 2)
+        self.get("/testing/feed.json", 0)
@@ -0,0 +1,96 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+from datetime import datetime
+from unittest import TestCase
+
+from newrem.timeline import Sequence, Timeline
+
+
+def day(i):
+    return datetime(2012, 1, i)
+
+
+class TestSequence(TestCase):
+
+    def setUp(self):
+        self.s = Sequence([1, 2, 3, 4], [day(1), day(2), day(3), day(4)],
+                          monotonic=True)
+
+    def test_neighbors_middle(self):
+        expected = 1, 1, 3, 4
+        self.assertEqual(self.s.neighbors(2, day(10)), expected)
+
+    def test_neighbors_live_filter(self):
+        expected = 1, 1, None, 2
+        self.assertEqual(self.s.neighbors(2, day(3)), expected)
+
+    def test_neighbors_nothing_live(self):
+        expected = None, None, None, None
+        self.assertEqual(self.s.neighbors(1, day(1)), expected)
+
+    def test_neighbors_unsorted(self):
+        s = Sequence([1, 2, 3, 4], [day(1), day(4), day(2), day(3)])
+        expected = 1, 1, 4, 4
+        self.assertEqual(s.neighbors(3, day(4)), expected)
+
+
+class TestTimeline(TestCase):
+
+    def setUp(self):
+        # Uploaded in ID order, but placed in reverse.
+        comics = [(1, 30, day(1)), (2, 20, day(2)), (3, 10, day(3))]
+        appearances = [("alice", 3), ("alice", 1), ("bob", 2)]
+        self.t = Timeline(comics, appearances)
+
+    def test_buffered(self):
+        self.assertEqual(self.t.buffered, day(3))
+
+    def test_buffered_empty(self):
+        self.assertEqual(Timeline([], []).buffered, None)
+
+    def test_live(self):
+        self.assertEqual(self.t.live(day(3)), (2, day(2)))
+
+    def test_live_none(self):
+        self.assertEqual(self.t.live(day(1)), (0, None))
+
+    def test_next_live(self):
+        self.assertEqual(self.t.next_live(day(2)), day(2))
+
+    def test_next_live_none(self):
+        self.assertEqual(self.t.next_live(day(10)), None)
+
+    def test_contains(self):
+        self.assertTrue(2 in self.t)
+        self.assertFalse(4 in self.t)
+
+    def test_navigation_upload(self):
+        d = self.t.navigation(2, day(10))
+        self.assertEqual(d["upload"], (1, 1, 3, 3))
+
+    def test_navigation_upload_ends(self):
+        d = self.t.navigation(1, day(10))
+        self.assertEqual(d["upload"], (None, None, 2, 3))
+
+    def test_navigation_chrono(self):
+        d = self.t.navigation(2, day(10))
+        self.assertEqual(d["chrono"], (3, 1))
+
+    def test_navigation_chrono_live_filter(self):
+        d = self.t.navigation(2, day(3))
+        self.assertEqual(d["chrono"], (None, 1))
+
+    def test_navigation_characters(self):
+        d = self.t.navigation(1, day(10))
+        self.assertEqual(d["characters"], {"alice": (3, 3, None, 1)})
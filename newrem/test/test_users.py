@@ -0,0 +1,100 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+from newrem.models import db, User
+from newrem.test.test_profiling import ViewTestCase
+from newrem.views import app
+
+
+class TestSessions(ViewTestCase):
+    """
+    Logging out signs out one browser; changing the password signs out all
+    of them.
+    """
+
+    def setUp(self):
+        super(TestSessions, self).setUp()
+        user = User(u"reader", "secret")
+        db.session.add(user)
+        db.session.commit()
+        user.forget()
+
+    def login(self, client, password="secret"):
+        response = client.post("/login", data={
+            "username": u"reader",
+            "password": password,
+        })
+        return response.status_code == 302
+
+    def logged_in(self, client):
+        response = client.get("/login")
+        self.assertEqual(response.status_code, 200)
+        return "Logged in as reader" in response.data
+
+    def copy(self):
+        """
+        Make another browser holding this one's remember cookie.
+        """
+
+        cookie, = [cookie for cookie in self.client.cookie_jar
+                   if cookie.name == "remember_token"]
+        client = app.test_client()
+        client.set_cookie("localhost", cookie.name, cookie.value)
+        return client
+
+    def change(self, current, password):
+        return self.client.post("/password", data={
+            "current": current,
+            "password": password,
+            "confirm": password,
+        })
+
+    def test_login(self):
+        self.assertTrue(self.login(self.client))
+        self.assertTrue(self.logged_in(self.client))
+        self.assertTrue(self.logged_in(self.copy()))
+
+    def test_wrong_password(self):
+        self.assertFalse(self.login(self.client, "wrong"))
+        self.assertFalse(self.logged_in(self.client))
+
+    def test_logout(self):
+        self.login(self.client)
+        other = self.copy()
+        self.client.get("/logout")
+        self.assertFalse(self.logged_in(self.client))
+        # Only the browser which logged out is signed out.
+        self.assertTrue(self.logged_in(other))
+
+    def test_change_password(self):
+        self.login(self.client)
+        other = self.copy()
+        response = self.change("secret", "changed")
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(self.logged_in(self.client))
+        self.assertFalse(self.logged_in(other))
+        self.assertFalse(self.login(other))
+        self.assertTrue(self.login(other, "changed"))
+
+    def test_change_wrong_password(self):
+        self.login(self.client)
+        other = self.copy()
+        response = self.change("wrong", "changed")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue("Incorrect password!" in response.data)
+        self.assertTrue(self.logged_in(other))
+
+    def test_change_anonymous(self):
+        response = self.client.get("/password")
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue("/login?next=%2Fpassword" in response.location)
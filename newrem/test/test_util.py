@@ -13,7 +13,7 @@
 # the License.
 import unittest
 
-from newrem.util import abbreviate, slugify, split_camel_case
+from newrem.util import abbreviate, excerpt, slugify, split_camel_case
 
 class TestAbbreviate(unittest.TestCase):
 
@@ -27,6 +27,20 @@ class TestAbbreviate(unittest.TestCase):
         e = "po"
         self.assertEqual(e, abbreviate(s))
 
+class TestExcerpt(unittest.TestCase):
+
+    def test_short(self):
+        self.assertEqual(u"short", excerpt(u"short", 10))
+
+    def test_long(self):
+        self.assertEqual(u"a long\u2026", excerpt(u"a long sentence", 7))
+
+    def test_whitespace(self):
+        self.assertEqual(u"two lines", excerpt(u"two\n\n  lines", 10))
+
+    def test_none(self):
+        self.assertEqual(u"", excerpt(None, 10))
+
 class TestSlugify(unittest.TestCase):
 
     def test_noop(self):
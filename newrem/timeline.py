@@ -0,0 +1,266 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License.  You may obtain a copy
+# of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
+# License for the specific language governing permissions and limitations under
+# the License.
+from bisect import bisect_left
+from collections import namedtuple
+
+from newrem.cache import cache, tags_for
+from newrem.models import db, Appearance, Character, Comic, Universe
+
+# Lightweight stand-ins for rows which templates only read a couple of
+# columns from. Both have a slug, so they can be passed to url_for() wherever
+# the real models are accepted.
+Member = namedtuple("Member", "slug, name")
+Summary = namedtuple("Summary", "slug, title")
+
+
+class Sequence(object):
+    """
+    A list of comic IDs in some order, along with their go-live times.
+
+    If `monotonic` is True, then the times are known to be sorted, and the
+    live comics are always a prefix of the sequence.
+    """
+
+    def __init__(self, ids, times, monotonic=False):
+        self.ids = ids
+        self.times = times
+        self.monotonic = monotonic
+        self.index = dict((cid, i) for i, cid in enumerate(ids))
+
+    def __contains__(self, cid):
+        return cid in self.index
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _live(self, indices, now):
+        """
+        Find the first live comic among some indices.
+        """
+
+        for i in indices:
+            if self.times[i] < now:
+                return self.ids[i]
+        return None
+
+    def neighbors(self, cid, now):
+        """
+        Find the first, previous, next, and last live comics relative to the
+        given comic.
+
+        Missing neighbors are None. The first and last comics might be the
+        given comic.
+        """
+
+        i = self.index[cid]
+        size = len(self.ids)
+
+        if self.monotonic:
+            # Everything before the cutoff is live, and nothing after it is.
+            cutoff = bisect_left(self.times, now)
+            j = min(i, cutoff)
+            first = self.ids[0] if cutoff else None
+            previous = self.ids[j - 1] if j else None
+            next = self.ids[i + 1] if i + 1 < cutoff else None
+            last = self.ids[cutoff - 1] if cutoff else None
+        else:
+            first = self._live(xrange(size), now)
+            previous = self._live(xrange(i - 1, -1, -1), now)
+            next = self._live(xrange(i + 1, size), now)
+            last = self._live(xrange(size - 1, -1, -1), now)
+
+        return first, previous, next, last
+
+
+class Timeline(object):
+    """
+    An index of the comics in a single universe.
+
+    `comics` is an iterable of (id, position, time) tuples, and `appearances`
+    is an iterable of (character slug, comic id) tuples, with each character's
+    appearances in timeline order. `majors` is a list of the universe's major
+    characters.
+
+    Comics which haven't gone live yet are still indexed; the temporal filter
+    is applied at lookup time instead, so that the index doesn't have to be
+    rebuilt whenever a comic goes live.
+    """
+
+    def __init__(self, comics, appearances, majors=()):
+        comics = list(comics)
+
+        times = dict((cid, time) for cid, position, time in comics)
+
+        # Upload order. Upload times are unique, so this is total.
+        upload = sorted((time, cid) for cid, position, time in comics)
+        self.upload = Sequence([cid for time, cid in upload],
+                               [time for time, cid in upload],
+                               monotonic=True)
+
+        # Timeline order. Positions aren't guaranteed to be unique, so break
+        # ties with the ID.
+        chrono = sorted((position, cid) for cid, position, time in comics)
+        self.chrono = Sequence([cid for position, cid in chrono],
+                               [times[cid] for position, cid in chrono])
+
+        # Per-character timeline order, which was already worked out by
+        # Appearance.reindex().
+        cast = {}
+        self.cast = {}
+        for slug, cid in appearances:
+            if cid in times:
+                cast.setdefault(slug, []).append(cid)
+                self.cast.setdefault(cid, []).append(slug)
+
+        self.characters = {}
+        for slug, ids in cast.iteritems():
+            self.characters[slug] = Sequence(ids, [times[cid] for cid in ids])
+
+        self.majors = list(majors)
+
+    def __contains__(self, cid):
+        return cid in self.upload
+
+    @property
+    def buffered(self):
+        """
+        The upload time of the latest comic, whether or not it is live.
+        """
+
+        if self.upload.times:
+            return self.upload.times[-1]
+        return None
+
+    def live(self, now):
+        """
+        Count the comics which are live, and find the upload time of the
+        latest of them, or None if none are.
+        """
+
+        times = self.upload.times
+        i = bisect_left(times, now)
+        return i, times[i - 1] if i else None
+
+    def next_live(self, now):
+        """
+        Find the time at which the next comic goes live, or None if every
+        comic is already live.
+        """
+
+        times = self.upload.times
+        i = bisect_left(times, now)
+        if i < len(times):
+            return times[i]
+        return None
+
+    def navigation(self, cid, now):
+        """
+        Look up every comic ID that a comic's page links to.
+
+        Returns a dictionary with the keys "upload" and "chrono", mapping to
+        tuples of (first, previous, next, last) and (previous, next)
+        respectively, and "characters", a dictionary of character slugs to
+        tuples of (first, previous, next, last) appearances.
+
+        The upload order's first and last comics are None when they are the
+        given comic.
+        """
+
+        first, previous, next, last = self.upload.neighbors(cid, now)
+        if first == cid:
+            first = None
+        if last == cid:
+            last = None
+
+        d = {
+            "upload": (first, previous, next, last),
+            "chrono": self.chrono.neighbors(cid, now)[1:3],
+            "characters": {},
+        }
+
+        for slug in self.cast.get(cid, []):
+            sequence = self.characters[slug]
+            d["characters"][slug] = sequence.neighbors(cid, now)
+
+        return d
+
+
+class TimelineIndex(object):
+    """
+    A cache of timelines for every universe.
+
+    Timelines are built on demand and kept until invalidated. Each timeline
+    remembers the versions of its universe's cache tags when it was built, so
+    that invalidations made by other processes sharing the cache are noticed
+    too.
+    """
+
+    def __init__(self):
+        self._timelines = {}
+        self._universes = None
+
+    def timeline(self, universe):
+        """
+        Get the timeline for a universe, building it if necessary.
+        """
+
+        slug = universe.slug
+        versions = cache.versions(tags_for(slug))
+        entry = self._timelines.get(slug)
+        if entry is None or entry[0] != versions:
+            entry = self._timelines[slug] = versions, self.build(slug)
+        return entry[1]
+
+    def build(self, slug):
+        q = db.session.query(Comic.id, Comic.position, Comic.time)
+        comics = q.filter(Comic.universe_fk == slug).all()
+
+        q = db.session.query(Appearance.character_id, Appearance.comic_id)
+        q = q.join(Comic, Comic.id == Appearance.comic_id)
+        q = q.filter(Comic.universe_fk == slug)
+        q = q.order_by(Appearance.character_id, Appearance.ordinal)
+        appearances = q.all()
+
+        q = db.session.query(Character.slug, Character.name)
+        q = q.filter_by(universe_fk=slug, major=True)
+        majors = [Member(*row) for row in q.order_by(Character.name)]
+
+        return Timeline(comics, appearances, majors)
+
+    def universes(self):
+        """
+        Get a summary of every universe.
+        """
+
+        versions = cache.versions(["site"])
+        if self._universes is None or self._universes[0] != versions:
+            q = db.session.query(Universe.slug, Universe.title)
+            self._universes = versions, [Summary(*row) for row in q]
+        return self._universes[1]
+
+    def invalidate(self, universe=None):
+        """
+        Forget about a universe's timeline.
+
+        If no universe is given, forget everything.
+        """
+
+        if universe is None:
+            self._timelines.clear()
+            self._universes = None
+        else:
+            self._timelines.pop(universe.slug, None)
+
+
+timelines = TimelineIndex()
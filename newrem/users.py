@@ -12,9 +12,9 @@
 # License for the specific language governing permissions and limitations under
 # the License.
 from flask import Blueprint, flash, redirect, render_template, request, url_for
-from flask.ext.login import login_user, logout_user
+from flask.ext.login import current_user, login_user, logout_user
 
-from newrem.forms import LoginForm, RegisterForm
+from newrem.forms import LoginForm, PasswordForm, RegisterForm
 from newrem.models import db, User
 
 users = Blueprint("users", __name__)
@@ -31,7 +31,7 @@ def register():
         else:
             user = User(form.username.data, form.password.data)
             db.session.add(user)
-            user.login()
+            db.session.commit()
             login_user(user, remember=True)
             flash("Logged in!")
             if "next" in request.args:
@@ -50,7 +50,6 @@ def login():
 
         if user:
             if user.check_password(form.password.data):
-                user.login()
                 login_user(user, remember=True)
                 flash("Logged in!")
                 if "next" in request.args:
@@ -66,6 +65,8 @@ def login():
 
 @users.route("/logout")
 def logout():
+    # This only signs this browser out. Changing the password signs out
+    # everywhere.
     logout_user()
     flash("Logged out!")
 
@@ -73,3 +74,27 @@ def logout():
         return redirect(request.args["next"])
     else:
         return redirect(url_for("index"))
+
+@users.route("/password", methods=("GET", "POST"))
+def password():
+    if current_user.is_anonymous():
+        return redirect(url_for("users.login", next=request.path))
+
+    form = PasswordForm()
+
+    if form.validate_on_submit():
+        user = current_user._get_current_object()
+
+        if user.check_password(form.current.data):
+            user.set_password(form.password.data)
+            db.session.commit()
+            user.forget()
+            # Every old session is signed out, this one included, so sign
+            # this one back in.
+            login_user(user, remember=True)
+            flash("Password changed! You've been logged out everywhere else.")
+            return redirect(url_for("index"))
+        else:
+            flash("Incorrect password!")
+
+    return render_template("password.html", form=form)
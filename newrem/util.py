@@ -11,14 +11,9 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.  See the
 # License for the specific language governing permissions and limitations under
 # the License.
-from datetime import datetime
-from hashlib import md5
-from mimetypes import guess_extension
 import string
 import re
 
-from PyRSS2Gen import Guid, RSS2, RSSItem
-
 from unidecode import unidecode
 
 alphanum = string.digits + string.lowercase
@@ -41,22 +36,6 @@ def abbreviate(s):
 
     return "".join(letters)
 
-def chan_filename(f):
-    """
-    Given an uploaded file, determine a filename for it.
-
-    The filenames produced by this function are always reasonable and secure.
-    """
-
-    hash = md5(f.stream.read())
-    f.stream.seek(0)
-
-    md5sum = hash.hexdigest()
-
-    extension = guess_extension(f.content_type)
-
-    return "%s%s" % (md5sum, extension)
-
 def slugify(s):
     """
     Turn a Unicode string into a URL-safe ASCII slug.
@@ -68,6 +47,18 @@ def slugify(s):
         l.extend(unidecode(word).split())
     return u"-".join(word.strip().lower() for word in l).encode("ascii")
 
+def excerpt(s, length):
+    """
+    Cut a string down to at most `length` characters, for previews.
+
+    Runs of whitespace, including newlines, are squashed into single spaces.
+    """
+
+    s = u" ".join((s or u"").split())
+    if len(s) > length:
+        s = s[:length - 1].rstrip() + u"\u2026"
+    return s
+
 def split_camel_case(s):
     """
     Split a camel-cased string into its separate parts.
@@ -104,25 +95,3 @@ def split_camel_case(s):
     pieces.append(s[beginning:])
 
     return pieces
-
-def make_rss2(url, title, stuff):
-    """
-    Make an RSS2 feed from stuff.
-
-    Practically, the stuff is nearly always comics, but it could be anything
-    else meeting the polymorphic requirements.
-
-    `url` is a URL. `title` is a title for the feed.  `stuff` is a dictionary
-    of URLs to objects with `title`, `time`, and `universe` attributes.
-    """
-
-    items = []
-    for url, obj in stuff:
-        item = RSSItem(title = ("%s: %s" % (obj.universe.title, obj.title)), 
-            link=url, description=obj.comment,
-            guid=Guid(url), pubDate=obj.time)
-        items.append(item)
-
-    rss2 = RSS2(title=title, link=url, description=title,
-                lastBuildDate=datetime.utcnow(), items=items)
-    return rss2.to_xml(encoding="utf8")
@@ -16,6 +16,7 @@ import os.path
 from operator import attrgetter
 from random import choice
 
+from sqlalchemy.orm import joinedload
 from sqlalchemy.orm.exc import NoResultFound
 
 from flask import abort, flash, redirect, render_template, request, url_for
@@ -23,15 +24,18 @@ from flask.ext.holster.main import init_holster
 from flask.ext.login import current_user
 
 from newrem.app import DCoN
-from newrem.converters import make_model_converter
-from newrem.decorators import cached
-from newrem.files import assets_in_paths, save_file
+from newrem.cache import board_tag
+from newrem.converters import attach_models, make_model_converter
+from newrem.decorators import cached, conditional, rendered
+from newrem.derivatives import pipeline
+from newrem.feeds import latest_comics, make_feed
+from newrem.files import assets, pick_asset
 from newrem.filters import url_for_comic
 from newrem.forms import CommentForm
-from newrem.grammars import BlogGrammar
-from newrem.models import (db, Board, Character, Comic, Newspost, Post,
-    Universe)
-from newrem.util import chan_filename, make_rss2
+from newrem.grammars import paragraphs, safe_paragraphs
+from newrem.models import (db, Blob, Board, Character, Comic, Newspost, Post,
+    Thread, Universe)
+from newrem.timeline import timelines
 
 app = DCoN(__name__)
 init_holster(app)
@@ -45,6 +49,7 @@ app.url_map.converters["newspost"] = make_model_converter(app, Newspost,
     "time")
 app.url_map.converters["universe"] = make_model_converter(app, Universe,
     "slug")
+app.url_value_preprocessor(attach_models)
 
 @app.template_filter()
 def blogify(s):
@@ -52,7 +57,7 @@ def blogify(s):
     Run a string through a grammar to prettify it somewhat.
     """
 
-    return BlogGrammar(s).paragraphs()
+    return paragraphs(s)
 
 @app.template_filter()
 def eblogify(s):
@@ -60,7 +65,7 @@ def eblogify(s):
     Like ``blogify``, but also apply HTML escapes. For untrusted input.
     """
 
-    return BlogGrammar(s).safe_paragraphs()
+    return safe_paragraphs(s)
 
 def get_comic_query(universe):
     """
@@ -77,29 +82,9 @@ def get_comic_query(universe):
     q = Comic.query.filter(Comic.universe == universe)
     return q.filter(Comic.time < datetime.now())
 
-def get_neighbors_for(universe, comic):
-    """
-    Grab the comics around a given comic.
-    """
-
-    comics = {}
-
-    # Grab the comics corresponding to navigation buttons: First, previous,
-    # next, last. This first query doesn't need to have the temporal filter.
-    q = Comic.query.filter(Comic.universe == universe)
-    q = q.filter(Comic.time < comic.time)
-    a = q.order_by(Comic.time).first()
-    b = q.order_by(Comic.time.desc()).first()
-
-    q = get_comic_query(universe).filter(Comic.time > comic.time)
-    c = q.order_by(Comic.time).first()
-    d = q.order_by(Comic.time.desc()).first()
-
-    comics["upload"] = a, b, c, d
-
-    return comics
-
 @app.route("/")
+@conditional
+@rendered
 def index():
     universes = Universe.query.all()
     newsposts = Newspost.query.order_by(Newspost.time.desc())[:5]
@@ -110,10 +95,10 @@ def index():
 
 def universe_context(app, u):
     segments = [u.slug, "images", "banners"]
-    banners = assets_in_paths(app, segments)
+    filename = pick_asset(assets.names(app, segments), u.slug)
 
-    if banners:
-        segments.append(choice(banners))
+    if filename:
+        segments.append(filename)
         banner = "/".join(segments)
     else:
         banner = None
@@ -125,9 +110,9 @@ def universe_context(app, u):
 
 
 @app.route("/<universe:u>/cast")
+@conditional
+@rendered
 def cast(u):
-    # Re-add the universe to the session so that we can query it.
-    db.session.add(u)
     q = Character.query.filter_by(universe=u, major=True)
     characters = sorted(q.all(), key=attrgetter("name"))
 
@@ -189,63 +174,76 @@ def recent(u):
 
 @app.route("/<universe:u>/comics/<int:cid>/<name>")
 @app.route("/<universe:u>/comics/<int:cid>")
+@conditional
+@rendered
 def comics(u, cid, name=None):
     # The name is purely decorative.
+
     try:
-        comic = get_comic_query(u).filter_by(id=cid).one()
+        q = get_comic_query(u).options(joinedload(Comic.characters))
+        comic = q.filter_by(id=cid).one()
     except NoResultFound:
         abort(404)
 
     char = request.args.get("char", None)
     if char is not None:
-        char = Character.query.filter_by(universe=u, slug=char).first()
-        if char is None:
-            flash("That character doesn't exist, and typing them into the "
-                "URL doesn't magically spring them into the comic. Sorry.")
-        elif char not in comic.characters:
-            flash("That character isn't in this particular comic, and won't "
-                "be, no matter how hard you wish. Sorry.")
-            char = None
-
-    comics = get_neighbors_for(u, comic)
-
-    before = get_comic_query(u).filter(Comic.position < comic.position)
-    # And reverse it for first() and such.
-    before = before.order_by(Comic.position.desc())
-    after = get_comic_query(u).filter(Comic.position > comic.position)
-    after = after.order_by(Comic.position)
+        slug = char
+        char = None
+        for character in comic.characters:
+            if character.slug == slug:
+                char = character
 
-    chrono = before.first(), after.first()
+        if char is None:
+            q = Character.query.filter_by(universe=u, slug=slug)
+            if q.first() is None:
+                flash("That character doesn't exist, and typing them into "
+                    "the URL doesn't magically spring them into the comic. "
+                    "Sorry.")
+            else:
+                flash("That character isn't in this particular comic, and "
+                    "won't be, no matter how hard you wish. Sorry.")
+
+    timeline = timelines.timeline(u)
+    if comic.id not in timeline:
+        # Somebody wrote to the comics without telling the index.
+        timelines.invalidate(u)
+        timeline = timelines.timeline(u)
+
+    navigation = timeline.navigation(comic.id, datetime.now())
+
+    # Fetch every comic which is linked to in a single query.
+    ids = set(navigation["upload"]) | set(navigation["chrono"])
+    for t in navigation["characters"].itervalues():
+        ids.update(t)
+    ids.discard(None)
+    ids.discard(comic.id)
+
+    neighbors = {None: None, comic.id: comic}
+    if ids:
+        for neighbor in Comic.query.filter(Comic.id.in_(ids)):
+            neighbors[neighbor.id] = neighbor
+
+    comics = {
+        "upload": tuple(neighbors[i] for i in navigation["upload"]),
+    }
+    chrono = tuple(neighbors[i] for i in navigation["chrono"])
 
     cdict = {}
 
-    majors = Character.query.filter_by(universe=u, major=True).all()
-    universes = Universe.query.all()
-
     for character in comic.characters:
-        pred = Comic.characters.any(Character.slug == character.slug)
-        previous = before.filter(pred).first()
-        next = after.filter(pred).first()
-        # SQLAlchemy doesn't make this any easier.
-        first = get_comic_query(u).filter(pred).order_by(Comic.position).first()
-        last = get_comic_query(u).filter(pred).order_by(Comic.position.desc()).first()
-
-        cdict[character.slug] = character, first, previous, next, last
-
-    # Buffer watch feature. Figure out the datetime for the latest comic
-    # uploaded, and send that datetime along.
-    q = Comic.query.filter(Comic.universe == u)
-    buffered = q.order_by(Comic.time.desc()).first().time
+        t = navigation["characters"].get(character.slug, (None,) * 4)
+        cdict[character.slug] = (character,) + tuple(neighbors[i] for i in t)
 
     context = universe_context(app, u)
     context.update({
-        "buffered": buffered,
+        # Buffer watch feature. The datetime for the latest comic uploaded.
+        "buffered": timeline.buffered,
         "comic": comic,
         "comics": comics,
         "chrono": chrono,
         "characters": cdict,
-        "majors": majors,
-        "universes": universes,
+        "majors": timeline.majors,
+        "universes": timelines.universes(),
     })
 
     return render_template("universe/comics.html", **context)
@@ -270,53 +268,68 @@ def comment(u, cid):
             name = current_user.username
 
         post = Post(name, form.comment.data, "", None)
-        post.thread = comic.thread
 
         image = form.datafile.file
         if image:
-            post.filename = chan_filename(image)
-            save_file(post.fp(), image)
+            post.blob = Blob.store(image)
 
-        db.session.add(post)
+        Thread.add(comic.threadid, post)
         db.session.commit()
+        pipeline.submit(post.blob, [board_tag(u.board_fk)])
 
     return redirect(url_for_comic(comic))
 
-@app.route("/rss.xml")
+@app.route("/rss.xml", defaults={"kind": "rss"})
+@app.route("/atom.xml", defaults={"kind": "atom"})
+@app.route("/feed.json", defaults={"kind": "json"})
+@conditional
 @cached
-def rss():
-    # Filter out comics that have not yet gone live.
-    q = Comic.query.filter(Comic.time < datetime.now())
-    comics = q.order_by(Comic.time.desc())[:10]
-    stuff = []
-    for comic in comics:
-        url = url_for_comic(comic, _external=True)
-        stuff.append((url, comic))
-
+def feed(kind):
+    comics = latest_comics(timelines.universes(), datetime.now())
     link = url_for("index", _external=True)
 
-    return make_rss2(link, "DCoN", stuff)
+    body, mimetype = make_feed(kind, "DCoN", link, comics)
+    return body, 200, {"Content-Type": mimetype}
 
-@app.route("/<universe:u>/rss.xml")
+@app.route("/<universe:u>/rss.xml", defaults={"kind": "rss"})
+@app.route("/<universe:u>/atom.xml", defaults={"kind": "atom"})
+@app.route("/<universe:u>/feed.json", defaults={"kind": "json"})
+@conditional
 @cached
-def universe_rss(u):
-    q = get_comic_query(u).order_by(Comic.time.desc())
-    comics = q[:10]
-    stuff = []
-    for comic in comics:
-        url = url_for_comic(comic, _external=True)
-        stuff.append((url, comic))
-
+def universe_feed(u, kind):
+    comics = latest_comics([u], datetime.now())
     link = url_for("recent", _external=True, u=u)
 
-    return make_rss2(link, u.title, stuff)
+    body, mimetype = make_feed(kind, u.title, link, comics)
+    return body, 200, {"Content-Type": mimetype}
+
+@app.route("/<universe:u>/cast/<char>/rss.xml",
+           defaults={"kind": "rss"})
+@app.route("/<universe:u>/cast/<char>/atom.xml",
+           defaults={"kind": "atom"})
+@app.route("/<universe:u>/cast/<char>/feed.json",
+           defaults={"kind": "json"})
+@conditional
+@cached
+def character_feed(u, char, kind):
+    character = Character.query.filter_by(universe=u, slug=char).first()
+    if character is None:
+        abort(404)
+
+    comics = latest_comics([u], datetime.now(), char)
+    link = url_for("recent", _external=True, u=u, char=char)
+    title = u"%s: %s" % (u.title, character.name)
+
+    body, mimetype = make_feed(kind, title, link, comics)
+    return body, 200, {"Content-Type": mimetype}
 
 @app.errorhandler(404)
 def not_found(error):
-    segments = ["404"]
-    images = assets_in_paths(app, segments)
-    filename = choice(images)
-    image = os.path.join("404", filename)
+    images = assets.names(app, ["404"])
+    if images:
+        image = os.path.join("404", choice(images))
+    else:
+        image = None
     # 404s should still send the 404 status to the application.
     return render_template("404.html", image=image), 404, {}
 
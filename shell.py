@@ -14,10 +14,56 @@
 import readline, rlcompleter
 readline.parse_and_bind("tab:complete")
 
+from sqlalchemy.exc import OperationalError
+
 from newrem.main import app
 from newrem.models import *
 
 db.init_app(app)
 app.test_request_context().push()
 
+# Appearances used to copy each comic's time. They're only derived from other
+# tables, so rebuild them rather than migrating them.
+if db.engine.has_table("appearances"):
+    columns = db.inspect(db.engine).get_columns("appearances")
+    if "time" in [column["name"] for column in columns]:
+        Appearance.__table__.drop(db.engine)
+
 db.create_all()
+
+# Columns added to tables which older databases already have.
+add_columns(Comic, "comment_html", "grammar", "blob_id", "slug")
+add_columns(Newspost, "content_html", "grammar")
+add_columns(Character, "blob_id")
+add_columns(Post, "comment_html", "grammar", "blob_id")
+add_columns(Portrait, "blob_id")
+add_columns(Thread, "bumped", "replies", "images", "last_author",
+            "op_preview", "last_preview")
+add_indexes(Thread)
+add_indexes(Post)
+add_indexes(Comic)
+
+# Users used to have a logged_in column. It's nullable and unused, so it can
+# stay where the database can't drop it, as SQLite can't while a CHECK
+# constraint mentions it.
+columns = db.inspect(db.engine).get_columns("users")
+if "logged_in" in [column["name"] for column in columns]:
+    try:
+        db.engine.execute("ALTER TABLE users DROP COLUMN logged_in")
+    except OperationalError:
+        pass
+
+# Fill in any denormalized tables which were just created.
+if not Appearance.query.first():
+    Appearance.reindex(c.slug for c in Character.query)
+    db.session.commit()
+
+# Only rows from before the columns were added are filled in, so these are
+# safe to run again.
+for comic in Comic.query.filter_by(slug=None):
+    comic.rename(comic.title)
+db.session.commit()
+
+for thread in Thread.query.filter_by(replies=None):
+    thread.summarize()
+db.session.commit()